@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Замеры скорости ETL 1С на синтетических выгрузках
+
+Для каждого размера генерирует файлы (synthetic_1c.py) и замеряет:
+- parse / parse_stream: разбор файла (pandas / openpyxl read_only)
+- load / load_bulk: загрузку записей (execute_batch / COPY)
+- load_incremental: повторную загрузку остатков в режиме дельты
+
+Результаты дописываются в JSON lines (по умолчанию bench_results.jsonl)
+вместе с коммитом и разбивкой по этапам etl_metrics. Каждый замер
+сравнивается с предыдущим для того же случая: замедление больше порога
+выводится как регрессия (--check - код возврата 1).
+
+Загрузка идёт в отдельную схему etl_bench, которая пересоздаётся из
+schema_final.sql на каждый запуск - рабочие таблицы не затрагиваются.
+Без --connection / DATABASE_URL замеряется только парсинг.
+
+Использование:
+    python bench_etl.py --rows 1000,10000,100000
+    python bench_etl.py -c "postgresql://localhost/foundry" --rows 10000 --repeat 3
+    python bench_etl.py --rows 500000 --kinds inventory --check
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from pathlib import Path
+import psycopg2
+from psycopg2.extras import execute_values
+import etl_1c_xls
+import etl_metrics
+import reference_data
+import synthetic_1c
+
+BENCH_SCHEMA = 'etl_bench'
+
+SCHEMA_FILE = Path(__file__).with_name('schema_final.sql')
+
+KINDS = ['inventory', 'requirements', 'materials']
+
+def git_commit():
+    """Текущий коммит репозитория (None вне git)"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=Path(__file__).parent, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+def ensure_file(data_dir, kind, rows, details, warehouses, seed):
+    """Синтетический файл (генерируется один раз для набора параметров)"""
+    path = Path(data_dir) / f"{kind}_{rows}_{details}_{warehouses}_{seed}.xlsx"
+    if not path.exists():
+        started = time.perf_counter()
+        synthetic_1c.generate(kind, path, rows, details, warehouses, seed)
+        print(f"📄 Сгенерирован {path.name} ({time.perf_counter() - started:.1f} с)")
+    return path
+
+def measure(repeat, func):
+    """
+    Лучший из repeat запусков
+    
+    Возвращает: (секунды, результат, {этап: секунды}) для лучшего запуска
+    """
+    best = None
+    for _ in range(repeat):
+        etl_metrics.collect()
+        started = time.perf_counter()
+        # Логи парсера и загрузчиков в замер не выводим
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best[0]:
+            stages = {}
+            for entry in etl_metrics.collect():
+                stages[entry['stage']] = stages.get(entry['stage'], 0) + entry['seconds']
+            best = (seconds, result, stages)
+    return best
+
+def parse_file(kind, path, stream):
+    """Разбор файла нужного типа"""
+    if kind == 'inventory':
+        return etl_1c_xls.parse_inventory_file(path, date.today(), stream=stream)
+    if kind == 'requirements':
+        return etl_1c_xls.parse_requirements_file(path, stream=stream)
+    return etl_1c_xls.parse_materials_file(path, stream=stream)
+
+def connect_bench(conn_string):
+    """Подключение к БД со схемой etl_bench в search_path"""
+    try:
+        conn = psycopg2.connect(conn_string, options=f"-c search_path={BENCH_SCHEMA}")
+        conn.autocommit = False
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def setup_schema(conn, details, warehouses):
+    """Пересоздание схемы etl_bench и справочников под синтетические файлы"""
+    cursor = conn.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+    cursor.execute(SCHEMA_FILE.read_text(encoding='utf-8'))
+    
+    execute_values(cursor, "INSERT INTO warehouses (warehouse_name) VALUES %s",
+                   [(name,) for name in synthetic_1c.warehouse_names(warehouses)])
+    execute_values(cursor, "INSERT INTO details (nomenclature_code, name, weight_kg) VALUES %s",
+                   [(code, f"Деталь {code}", 1.0) for code in synthetic_1c.detail_codes(details)],
+                   page_size=1000)
+    conn.commit()
+    cursor.close()
+    reference_data.invalidate()
+
+def load_records(conn, kind, records, case):
+    """Загрузка записей выбранным способом (справочники читаются заново)"""
+    reference_data.invalidate()
+    if kind == 'inventory':
+        etl_1c_xls.load_inventory(conn, records, date.today(), bulk=(case == 'load_bulk'),
+                                  incremental=(case == 'load_incremental'))
+    elif kind == 'requirements':
+        etl_1c_xls.load_requirements(conn, records, bulk=(case == 'load_bulk'))
+    else:
+        etl_1c_xls.load_materials(conn, records, date.today())
+
+def load_cases(kind):
+    """Способы загрузки, доступные для типа файла"""
+    if kind == 'inventory':
+        return ['load', 'load_bulk', 'load_incremental']
+    if kind == 'requirements':
+        return ['load', 'load_bulk']
+    return ['load']
+
+def case_key(result):
+    """Ключ для сравнения с прошлыми запусками"""
+    return (result['kind'], result['case'], result['rows'], result['details'],
+            result['warehouses'], result['seed'])
+
+def read_history(path):
+    """Последний результат по каждому случаю из файла результатов"""
+    history = {}
+    if not Path(path).exists():
+        return history
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            history[case_key(result)] = result
+    return history
+
+def report(result, previous, threshold):
+    """Строка результата; True если замедление больше порога"""
+    change = ''
+    regression = False
+    if previous and previous.get('seconds'):
+        ratio = result['seconds'] / previous['seconds']
+        change = f"{(ratio - 1) * 100:+.0f}% к {previous.get('commit') or '?'}"
+        if ratio > 1 + threshold:
+            regression = True
+            change += ' ⚠️  регрессия'
+    
+    print(f"   {result['kind']:<13} {result['case']:<17} {result['rows']:>8} "
+          f"{result['records']:>8} {result['seconds']:>8.3f} {result['rows_per_sec']:>10.0f}  {change}")
+    return regression
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Замеры скорости ETL 1С на синтетических выгрузках',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Примеры использования:
+
+  # Только парсинг, три размера
+  python bench_etl.py --rows 1000,10000,100000
+  
+  # Парсинг и загрузка (схема etl_bench), лучший из 3 запусков
+  python bench_etl.py -c "postgresql://..." --rows 10000 --repeat 3
+  
+  # Проверка на регрессии относительно прошлого запуска
+  python bench_etl.py -c "postgresql://..." --rows 100000 --check
+        """
+    )
+    
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL); без него - только парсинг')
+    parser.add_argument('--rows', default='1000,10000,100000',
+                       help='Размеры файлов в строках через запятую (по умолчанию 1000,10000,100000)')
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                       help='Типы файлов через запятую (по умолчанию все)')
+    parser.add_argument('--details', type=int,
+                       help='Число деталей (по умолчанию - строк / 25, не меньше 100)')
+    parser.add_argument('--warehouses', type=int, default=8,
+                       help='Число складов (по умолчанию 8)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=1,
+                       help='Запусков на замер, берётся лучший (по умолчанию 1)')
+    parser.add_argument('--data-dir',
+                       help='Каталог для синтетических файлов (по умолчанию - временный)')
+    parser.add_argument('--results', default='bench_results.jsonl',
+                       help='Файл результатов JSON lines (по умолчанию bench_results.jsonl)')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                       help='Допустимое замедление к прошлому запуску (по умолчанию 0.2 = 20%%)')
+    parser.add_argument('--check', action='store_true',
+                       help='Код возврата 1 при регрессии')
+    
+    args = parser.parse_args()
+    
+    kinds = [kind.strip() for kind in args.kinds.split(',') if kind.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        parser.error(f"Неизвестные типы файлов: {', '.join(sorted(unknown))}")
+    try:
+        sizes = [int(value) for value in args.rows.split(',')]
+    except ValueError:
+        parser.error("--rows: числа через запятую")
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='etl_bench_')
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    
+    history = read_history(args.results)
+    commit = git_commit()
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    conn = connect_bench(conn_string) if conn_string else None
+    
+    print("=" * 70)
+    print(f"ЗАМЕРЫ ETL 1С (коммит {commit or '?'}, данные: {data_dir})")
+    print("=" * 70)
+    
+    results = []
+    regressions = 0
+    try:
+        for rows in sizes:
+            details = args.details or max(100, rows // 25)
+            if conn:
+                setup_schema(conn, details, args.warehouses)
+            
+            print(f"\n📊 {rows} строк, {details} деталей, {args.warehouses} складов")
+            print(f"   {'Тип':<13} {'Замер':<17} {'Строк':>8} {'Записей':>8} {'Секунд':>8} {'Строк/с':>10}")
+            
+            for kind in kinds:
+                path = ensure_file(data_dir, kind, rows, details, args.warehouses, args.seed)
+                
+                cases = []
+                for case, stream in [('parse', False), ('parse_stream', True)]:
+                    seconds, records, stages = measure(args.repeat, lambda: parse_file(kind, path, stream))
+                    cases.append((case, seconds, len(records), stages))
+                
+                if conn:
+                    for case in load_cases(kind):
+                        seconds, _, stages = measure(args.repeat,
+                                                     lambda: load_records(conn, kind, records, case))
+                        cases.append((case, seconds, len(records), stages))
+                
+                for case, seconds, count, stages in cases:
+                    result = {
+                        'ts': timestamp,
+                        'commit': commit,
+                        'kind': kind,
+                        'case': case,
+                        'rows': rows,
+                        'details': details,
+                        'warehouses': args.warehouses,
+                        'seed': args.seed,
+                        'repeat': args.repeat,
+                        'records': count,
+                        'seconds': seconds,
+                        'rows_per_sec': rows / seconds if seconds > 0 else 0,
+                        'stages': stages
+                    }
+                    if report(result, history.get(case_key(result)), args.threshold):
+                        regressions += 1
+                    results.append(result)
+    finally:
+        if conn:
+            conn.close()
+    
+    with open(args.results, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+    
+    print("\n" + "=" * 70)
+    print(f"✅ Записано замеров: {len(results)} → {args.results}")
+    if regressions:
+        print(f"⚠️  Регрессий: {regressions} (порог {args.threshold:.0%})")
+    print("=" * 70)
+    
+    if args.check and regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Модель мощности: штук за смену для каждой пары (машина, деталь)
+
+Плотная матрица machines × details строится один раз из
+machine_mold_params и machine_detail_params:
+- Отливка: форма ставится один раз за смену (loading_duration),
+  дальше циклы по cycle_duration, за цикл - details.qty_per_hit штук
+- Остальные фазы: каждый цикл = загрузка + обработка,
+  за цикл - quantity_per_cycle штук
+Смена одна, 8 часов (MVP). Пара без параметров = 0 (деталь на машине не делается).
+
+Модель кэшируется на процесс и перестраивается, когда меняются
+machines, details или таблицы параметров (проверка версии как в reference_data).
+
+Использование:
+    model = capacity_model.get_model(conn)
+    model.pieces_per_shift(machine_id, detail_id)
+    model.best_machine(detail_id, 'зачистка')
+"""
+
+import argparse
+import sys
+import os
+import numpy as np
+import psycopg2
+import reference_data
+
+# Длительность смены, минут (одна смена - 8 часов)
+SHIFT_MINUTES = 8 * 60
+
+# Таблицы, от которых зависит модель (смена версии = перестройка)
+SOURCE_TABLES = ['machines', 'details', 'machine_mold_params', 'machine_detail_params']
+
+# dsn -> {'version': ..., 'model': CapacityModel}
+_cache = {}
+
+class CapacityModel:
+    """Штук за смену и время переналадки по (машина, деталь)"""
+    
+    def __init__(self, machines, details, pieces, setup_minutes):
+        """
+        Args:
+            machines: строки справочника machines (ось 0, по id)
+            details: строки справочника details (ось 1, по id)
+            pieces: штук за смену [машина, деталь]
+            setup_minutes: время установки формы / загрузки [машина, деталь]
+        """
+        self.machine_ids = np.array([row['id'] for row in machines], dtype=np.int64)
+        self.detail_ids = np.array([row['id'] for row in details], dtype=np.int64)
+        self.machine_index = {machine_id: i for i, machine_id in enumerate(self.machine_ids.tolist())}
+        self.detail_index = {detail_id: i for i, detail_id in enumerate(self.detail_ids.tolist())}
+        self.machine_phase = np.array([row['output_phase'] for row in machines], dtype=object)
+        self.machine_active = np.array([row['status'] == 'active' for row in machines], dtype=bool)
+        self.pieces = pieces
+        self.setup_minutes = setup_minutes
+    
+    def pieces_per_shift(self, machine_id, detail_id):
+        """Штук за смену (0 - деталь на машине не делается)"""
+        m = self.machine_index.get(machine_id)
+        d = self.detail_index.get(detail_id)
+        if m is None or d is None:
+            return 0
+        return int(self.pieces[m, d])
+    
+    def machines_for(self, detail_id, phase, active_only=True):
+        """id машин фазы, на которых делается деталь, от самой производительной"""
+        d = self.detail_index.get(detail_id)
+        if d is None:
+            return []
+        mask = (self.machine_phase == phase) & (self.pieces[:, d] > 0)
+        if active_only:
+            mask &= self.machine_active
+        positions = np.nonzero(mask)[0]
+        # Стабильная сортировка: при равной мощности - меньший id машины
+        order = np.argsort(-self.pieces[positions, d], kind='stable')
+        return self.machine_ids[positions[order]].tolist()
+    
+    def best_machine(self, detail_id, phase, active_only=True):
+        """Самая производительная машина фазы для детали или None"""
+        machines = self.machines_for(detail_id, phase, active_only)
+        return machines[0] if machines else None
+    
+    def shifts_needed(self, machine_id, detail_id, quantity):
+        """Смен на выпуск quantity штук (inf - деталь на машине не делается)"""
+        pieces = self.pieces_per_shift(machine_id, detail_id)
+        if pieces <= 0:
+            return float('inf')
+        return quantity / pieces
+
+def build_model(conn):
+    """Матрица мощности из справочников и таблиц параметров"""
+    machines = reference_data.rows(conn, 'machines')
+    details = reference_data.rows(conn, 'details')
+    
+    machine_pos = {row['id']: i for i, row in enumerate(machines)}
+    detail_pos = {row['id']: i for i, row in enumerate(details)}
+    pieces = np.zeros((len(machines), len(details)), dtype=np.int64)
+    setup_minutes = np.zeros((len(machines), len(details)), dtype=np.int64)
+    
+    # Форма -> позиции деталей (1 форма - обычно 1 деталь)
+    mold_details = {}
+    for row in details:
+        if row['mold_id'] is not None:
+            mold_details.setdefault(row['mold_id'], []).append(detail_pos[row['id']])
+    qty_per_hit = np.array([float(row['qty_per_hit'] or 1) for row in details])
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT machine_id, mold_id, cycle_duration_minutes, loading_duration_minutes
+            FROM machine_mold_params
+        """)
+        mold_params = cursor.fetchall()
+        
+        cursor.execute("""
+            SELECT machine_id, detail_id, quantity_per_cycle,
+                   cycle_duration_minutes, loading_duration_minutes
+            FROM machine_detail_params
+        """)
+        detail_params = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    # Отливка: установка формы раз в смену, затем циклы
+    rows, cols, cycles, loading = [], [], [], []
+    for machine_id, mold_id, cycle, load in mold_params:
+        for d in mold_details.get(mold_id, []):
+            rows.append(machine_pos[machine_id])
+            cols.append(d)
+            cycles.append(cycle)
+            loading.append(load)
+    if rows:
+        cycles = np.array(cycles, dtype=float)
+        loading = np.array(loading, dtype=np.int64)
+        hits = np.floor(np.maximum(SHIFT_MINUTES - loading, 0) / np.where(cycles > 0, cycles, np.inf))
+        pieces[rows, cols] = np.floor(hits * qty_per_hit[cols]).astype(np.int64)
+        setup_minutes[rows, cols] = loading
+    
+    # Остальные фазы: загрузка + обработка на каждый цикл
+    if detail_params:
+        machine_ids, detail_ids, per_cycle, cycle, load = zip(*detail_params)
+        rows = [machine_pos[machine_id] for machine_id in machine_ids]
+        cols = [detail_pos[detail_id] for detail_id in detail_ids]
+        cycle_minutes = np.array(cycle, dtype=float) + np.array(load, dtype=float)
+        cycles = np.floor(SHIFT_MINUTES / np.where(cycle_minutes > 0, cycle_minutes, np.inf))
+        pieces[rows, cols] = (cycles * np.array(per_cycle)).astype(np.int64)
+        setup_minutes[rows, cols] = load
+    
+    return CapacityModel(machines, details, pieces, setup_minutes)
+
+def model_version(conn):
+    """Версии таблиц, из которых строится модель"""
+    cursor = conn.cursor()
+    try:
+        return tuple(reference_data.table_version(cursor, table) for table in SOURCE_TABLES)
+    finally:
+        cursor.close()
+
+def get_model(conn):
+    """Модель мощности из кэша (перестраивается при изменении параметров)"""
+    version = model_version(conn)
+    entry = _cache.get(conn.dsn)
+    if entry is None or entry['version'] != version:
+        entry = {'version': version, 'model': build_model(conn)}
+        _cache[conn.dsn] = entry
+    return entry['model']
+
+def invalidate():
+    """Сброс кэша модели"""
+    _cache.clear()
+
+def print_model(model, details):
+    """Таблица штук за смену: детали × машины"""
+    codes = {row['id']: row['nomenclature_code'] for row in details}
+    print(f"\n📊 Штук за смену ({SHIFT_MINUTES // 60} ч):")
+    print(f"   {'Деталь':<16} " + ' '.join(f"{machine_id:>6}" for machine_id in model.machine_ids))
+    print(f"   {'':<16} " + ' '.join(f"{phase[:6]:>6}" for phase in model.machine_phase))
+    for d, detail_id in enumerate(model.detail_ids):
+        print(f"   {codes[detail_id][:16]:<16} " + ' '.join(f"{int(v):>6}" for v in model.pieces[:, d]))
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Модель мощности: штук за смену по машинам и деталям')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    conn = connect_db(conn_string)
+    try:
+        print_model(get_model(conn), reference_data.rows(conn, 'details'))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+Расписание форм на литейных машинах (отливка)
+
+Каждая деталь льётся в одной форме, литейных машин две, смена формы
+стоит machine_mold_params.loading_duration_minutes. Расписание - по
+рабочим дням горизонта: машина в день работает с одной формой, первый
+день кампании теряет время установки формы.
+
+Спрос - выпуск фазы 'отливка' из нетто-расчёта (mrp_netting), в ударах
+формы: ceil(штук / qty_per_hit), к концу каждого месяца накопленно.
+Цель (лексикографически):
+    1. недолив к срокам (удары, не отлитые к концу месяца)
+    2. минуты переналадки
+
+Эвристика:
+- жадно по дням: машина продолжает текущую форму, пока у неё не
+  закрыт ближайший срок и нет формы, которая иначе опоздает
+- локальный поиск по кампаниям: слияние кампаний одной формы и
+  перестановка соседних кампаний, пока цель улучшается
+Опционально (--solver cp-sat) - точная модель CP-SAT (ortools),
+для офлайн-прогонов; без ortools остаётся эвристика.
+
+Результат заменяет строки отливки нетто-расчёта в
+tentative_production_plan: строка на кампанию (машина, форма, даты),
+status='heuristic'.
+
+Использование:
+    python casting_scheduler.py --connection "postgresql://..."
+    python casting_scheduler.py --date 2025-12-01 --dry-run
+    python casting_scheduler.py --solver cp-sat --time-limit 300
+"""
+
+import argparse
+import sys
+import os
+import time
+from datetime import datetime, date
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import reference_data
+import mrp_netting
+from capacity_model import SHIFT_MINUTES
+from planning_common import horizon, working_days, machine_states, HORIZON_MONTHS, UNAVAILABLE_STATES
+
+try:
+    from ortools.sat.python import cp_model
+except ImportError:
+    cp_model = None
+
+CASTING_PHASE = 'отливка'
+
+# Метка строк плана, записанных планировщиком отливки
+PLAN_NOTE = 'casting_scheduler'
+
+SOLVERS = ['heuristic', 'cp-sat']
+
+# Время на локальный поиск / CP-SAT по умолчанию, секунд
+TIME_LIMIT = 5
+
+# ============================================================================
+# ЗАДАЧА
+# ============================================================================
+
+def installed_molds(conn, start_date):
+    """Форма на литейной машине по последнему machine_state: {machine_id: mold_id}"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT ON (machine_id) machine_id, (config_params->>'mold_id')::int
+            FROM machine_state
+            WHERE state_date <= %s AND config_params ? 'mold_id'
+            ORDER BY machine_id, state_date DESC
+        """, (start_date,))
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def build_problem(conn, start_date, months=HORIZON_MONTHS, sources=None):
+    """
+    Задача расписания из нетто-расчёта и параметров форм
+    
+    Возвращает: dict с полями
+        days: рабочие дни горизонта (ось времени)
+        due: индекс последнего рабочего дня каждого месяца
+        machine_ids, mold_ids: оси машин и форм
+        full_hits, setup_hits: ударов за день без / с установкой формы [машина, форма]
+        loading: минут на установку формы [машина, форма]
+        demand: накопленный спрос в ударах к концу месяца [форма, месяц]
+        initial: позиция формы, стоящей на машине к началу (-1 - нет)
+        mold_details: позиция формы -> [(detail_id, qty_per_hit, штук на горизонт)]
+        blocked: {detail_id: штук на горизонт} - спрос на детали с формой не в статусе active
+    """
+    start_month, end_month = horizon(start_date, months)
+    inputs = mrp_netting.load_inputs(conn, start_date, months, sources)
+    output = mrp_netting.net_requirements(inputs['requirements'], inputs['inventory'])
+    casting = output[:, mrp_netting.PHASE_INDEX[CASTING_PHASE], :]
+    
+    states = machine_states(conn, start_date)
+    machine_ids = [row['id'] for row in reference_data.rows(conn, 'machines')
+                   if row['output_phase'] == CASTING_PHASE and row['status'] == 'active'
+                   and states.get(row['id']) not in UNAVAILABLE_STATES]
+    
+    details = {row['id']: row for row in reference_data.rows(conn, 'details', active=True)}
+    active_molds = {row['id'] for row in reference_data.rows(conn, 'molds') if row['status'] == 'active'}
+    mold_ids = sorted({row['mold_id'] for row in details.values() if row['mold_id'] in active_molds})
+    mold_pos = {mold_id: j for j, mold_id in enumerate(mold_ids)}
+    machine_pos = {machine_id: k for k, machine_id in enumerate(machine_ids)}
+    
+    # Спрос формы в ударах: несколько деталей в форме льются одним ударом
+    hits = np.zeros((len(mold_ids), months), dtype=np.int64)
+    mold_details = {}
+    blocked = {}
+    for d, detail_id in enumerate(inputs['detail_ids'].tolist()):
+        row = details[detail_id]
+        if row['mold_id'] is None or not casting[d].any():
+            continue
+        if row['mold_id'] not in mold_pos:
+            blocked[detail_id] = int(casting[d].sum())
+            continue
+        j = mold_pos[row['mold_id']]
+        qty_per_hit = max(float(row['qty_per_hit'] or 1), 1.0)
+        hits[j] = np.maximum(hits[j], np.ceil(casting[d] / qty_per_hit).astype(np.int64))
+        mold_details.setdefault(j, []).append((detail_id, qty_per_hit, int(casting[d].sum())))
+    
+    full_hits = np.zeros((len(machine_ids), len(mold_ids)), dtype=np.int64)
+    setup_hits = np.zeros_like(full_hits)
+    loading = np.zeros_like(full_hits)
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT machine_id, mold_id, cycle_duration_minutes, loading_duration_minutes
+            FROM machine_mold_params
+            WHERE machine_id = ANY(%s)
+        """, (machine_ids,))
+        for machine_id, mold_id, cycle, load in cursor.fetchall():
+            if mold_id not in mold_pos or cycle <= 0:
+                continue
+            k, j = machine_pos[machine_id], mold_pos[mold_id]
+            full_hits[k, j] = SHIFT_MINUTES // cycle
+            setup_hits[k, j] = max(SHIFT_MINUTES - load, 0) // cycle
+            loading[k, j] = load
+    finally:
+        cursor.close()
+    
+    days = working_days(start_date, end_month)
+    month_ends = [np.datetime64(month, 'D') for month in inputs['months'][1:]] + [np.datetime64(end_month, 'D')]
+    due = np.maximum(np.searchsorted(days, month_ends) - 1, 0)
+    
+    installed = installed_molds(conn, start_date)
+    initial = np.array([mold_pos.get(installed.get(machine_id), -1) for machine_id in machine_ids],
+                       dtype=np.int64)
+    
+    return {
+        'days': days,
+        'due': due,
+        'machine_ids': machine_ids,
+        'mold_ids': mold_ids,
+        'full_hits': full_hits,
+        'setup_hits': setup_hits,
+        'loading': loading,
+        'demand': np.cumsum(hits, axis=1),
+        'initial': initial,
+        'mold_details': mold_details,
+        'blocked': blocked
+    }
+
+# ============================================================================
+# ОЦЕНКА РАСПИСАНИЯ
+# ============================================================================
+
+def schedule_changes(problem, assign):
+    """Дни установки формы [машина, день]: форма отличается от стоящей на машине"""
+    machines, days = assign.shape
+    extended = np.concatenate([problem['initial'][:, None], assign], axis=1)
+    # Простой машины форму не снимает: протягиваем последнюю стоявшую форму
+    positions = np.where(extended >= 0, np.arange(days + 1), 0)
+    positions = np.maximum.accumulate(positions, axis=1)
+    previous = extended[np.arange(machines)[:, None], positions][:, :-1]
+    return (assign >= 0) & (assign != previous)
+
+def production(problem, assign):
+    """Ударов по форме и дню [форма, день] и дни установки формы"""
+    machines, days = assign.shape
+    changes = schedule_changes(problem, assign)
+    busy = assign >= 0
+    k, t = np.nonzero(busy)
+    j = assign[busy]
+    hits = np.where(changes[busy], problem['setup_hits'][k, j], problem['full_hits'][k, j])
+    produced = np.bincount(j * days + t, weights=hits,
+                           minlength=len(problem['mold_ids']) * days)
+    return produced.reshape(len(problem['mold_ids']), days), changes
+
+def evaluate(problem, assign):
+    """
+    Цель расписания (меньше - лучше)
+    
+    Возвращает: (конфликты формы, недолив к срокам в ударах, минуты переналадки)
+    """
+    produced, changes = production(problem, assign)
+    cumulative = np.cumsum(produced, axis=1)[:, problem['due']]
+    shortage = int(np.maximum(problem['demand'] - cumulative, 0).sum())
+    
+    k, t = np.nonzero(changes)
+    setup = int(problem['loading'][k, assign[k, t]].sum())
+    
+    # Одна форма не может стоять на двух машинах в один день
+    busy = assign >= 0
+    _, t = np.nonzero(busy)
+    counts = np.bincount(t * len(problem['mold_ids']) + assign[busy])
+    conflicts = int(np.maximum(counts - 1, 0).sum())
+    return conflicts, shortage, setup
+
+# ============================================================================
+# ЭВРИСТИКА
+# ============================================================================
+
+def greedy_schedule(problem):
+    """
+    Жадное расписание по дням
+    
+    Машина берёт форму с самым ранним незакрытым сроком (EDD), но
+    продолжает стоящую форму и дальше её срока, пока запас мощности
+    это позволяет: для каждого более раннего срока суммарный спрос
+    всех форм в машино-днях (форма занимает машину на день целиком) помещается в оставшиеся дни.
+    
+    Возвращает: назначения [машина, день] - позиция формы или -1
+    """
+    demand = problem['demand']
+    due = problem['due']
+    full_hits = problem['full_hits']
+    setup_hits = problem['setup_hits']
+    machines, days = len(problem['machine_ids']), len(problem['days'])
+    
+    # Ударов за машино-день по форме (средняя по машинам, где форма ставится)
+    castable = full_hits > 0
+    rate = full_hits.sum(axis=0) / np.maximum(castable.sum(axis=0), 1)
+    rate = np.where(rate > 0, rate, np.inf)
+    
+    assign = np.full((machines, days), -1, dtype=np.int64)
+    produced = np.zeros(len(problem['mold_ids']), dtype=np.int64)
+    installed = problem['initial'].copy()
+    
+    for t in range(days):
+        taken = set()
+        for k in range(machines):
+            # Ближайший незакрытый срок каждой формы (len(due) - спрос закрыт)
+            next_due = (demand <= produced[:, None]).sum(axis=1)
+            candidates = [j for j in np.nonzero((next_due < len(due)) & castable[k])[0].tolist()
+                          if j not in taken]
+            if not candidates:
+                continue
+            
+            current = installed[k]
+            earliest = min(next_due[j] for j in candidates)
+            if current in candidates and next_due[current] > earliest:
+                # Запас: спрос к каждому более раннему сроку + этот день <= дни машин до срока
+                need = np.ceil(np.maximum(demand - produced[:, None], 0) / rate[:, None]).sum(axis=0)
+                capacity = (due - t + 1) * machines - k
+                if np.any(need[:next_due[current]] + 1 > capacity[:next_due[current]]):
+                    current = -1
+            
+            if current in candidates:
+                j = current
+            else:
+                j = min(candidates, key=lambda j: (next_due[j], -(demand[j, next_due[j]] - produced[j]), j))
+            
+            assign[k, t] = j
+            produced[j] += setup_hits[k, j] if j != installed[k] else full_hits[k, j]
+            installed[k] = j
+            taken.add(j)
+    
+    return assign
+
+def to_runs(assign):
+    """Кампании по машинам: [[форма, дней], ...] (-1 - простой)"""
+    runs = []
+    for row in assign.tolist():
+        machine_runs = []
+        for j in row:
+            if machine_runs and machine_runs[-1][0] == j:
+                machine_runs[-1][1] += 1
+            else:
+                machine_runs.append([j, 1])
+        runs.append(machine_runs)
+    return runs
+
+def from_runs(runs):
+    """Назначения [машина, день] из кампаний"""
+    return np.array([[j for j, length in machine_runs for _ in range(length)]
+                     for machine_runs in runs], dtype=np.int64)
+
+def run_moves(machine_runs):
+    """Соседние расписания одной машины: слияние кампаний формы, обмен соседних"""
+    for a in range(len(machine_runs)):
+        if machine_runs[a][0] < 0:
+            continue
+        # Слияние: следующая кампания той же формы переезжает к этой
+        for b in range(a + 2, len(machine_runs)):
+            if machine_runs[b][0] == machine_runs[a][0]:
+                moved = [list(run) for run in machine_runs]
+                moved[a][1] += moved[b][1]
+                del moved[b]
+                yield moved
+                break
+        # Обмен соседних кампаний
+        if a + 1 < len(machine_runs):
+            moved = [list(run) for run in machine_runs]
+            moved[a], moved[a + 1] = moved[a + 1], moved[a]
+            yield moved
+
+def local_search(problem, assign, time_limit=TIME_LIMIT):
+    """
+    Улучшение расписания по кампаниям (первое улучшение, до time_limit секунд)
+    
+    Возвращает: (назначения, число принятых ходов)
+    """
+    deadline = time.perf_counter() + time_limit
+    runs = to_runs(assign)
+    best = evaluate(problem, assign)
+    accepted = 0
+    
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for k in range(len(runs)):
+            for moved in run_moves(runs[k]):
+                candidate = runs[:k] + [moved] + runs[k + 1:]
+                score = evaluate(problem, from_runs(candidate))
+                if score < best:
+                    runs, best = to_runs(from_runs(candidate)), score
+                    accepted += 1
+                    improved = True
+                    break
+                if time.perf_counter() >= deadline:
+                    break
+    
+    return from_runs(runs), accepted
+
+# ============================================================================
+# CP-SAT (опционально, ortools)
+# ============================================================================
+
+def solve_cpsat(problem, time_limit=TIME_LIMIT, hint=None):
+    """
+    Точная модель CP-SAT: x[машина, день, форма], установка формы, недолив
+    
+    Простой в модели считается снятием формы (после простоя - установка),
+    поэтому на выходе цель пересчитывается через evaluate.
+    
+    Возвращает: назначения [машина, день] или None (решение не найдено)
+    """
+    if cp_model is None:
+        raise RuntimeError("ortools не установлен: pip install ortools")
+    
+    full_hits = problem['full_hits']
+    setup_hits = problem['setup_hits']
+    loading = problem['loading']
+    machines, molds = full_hits.shape
+    days = len(problem['days'])
+    
+    model = cp_model.CpModel()
+    x, change = {}, {}
+    produced = {j: [] for j in range(molds)}
+    for k in range(machines):
+        for t in range(days):
+            for j in np.nonzero(full_hits[k])[0].tolist():
+                x[k, t, j] = model.NewBoolVar(f"x_{k}_{t}_{j}")
+            model.AddAtMostOne(x[k, t, j] for j in np.nonzero(full_hits[k])[0].tolist())
+        for j in np.nonzero(full_hits[k])[0].tolist():
+            for t in range(days):
+                change[k, t, j] = model.NewBoolVar(f"c_{k}_{t}_{j}")
+                if t > 0:
+                    model.Add(change[k, t, j] >= x[k, t, j] - x[k, t - 1, j])
+                elif problem['initial'][k] != j:
+                    model.Add(change[k, t, j] >= x[k, t, j])
+                model.Add(change[k, t, j] <= x[k, t, j])
+                produced[j].append((t, int(full_hits[k, j]) * x[k, t, j]
+                                    - int(full_hits[k, j] - setup_hits[k, j]) * change[k, t, j]))
+    
+    for t in range(days):
+        for j in range(molds):
+            on_day = [x[k, t, j] for k in range(machines) if (k, t, j) in x]
+            if len(on_day) > 1:
+                model.AddAtMostOne(on_day)
+    
+    shortage = []
+    for j in range(molds):
+        for m, last_day in enumerate(problem['due'].tolist()):
+            if problem['demand'][j, m] <= 0:
+                continue
+            short = model.NewIntVar(0, int(problem['demand'][j, m]), f"s_{j}_{m}")
+            model.Add(short >= int(problem['demand'][j, m])
+                      - sum(expr for t, expr in produced[j] if t <= last_day))
+            shortage.append(short)
+    
+    # Вес удара больше любой суммы переналадок - цель лексикографическая
+    weight = int(loading.max(initial=0)) * machines * days + 1
+    model.Minimize(weight * sum(shortage)
+                   + sum(int(loading[k, j]) * var for (k, t, j), var in change.items()))
+    
+    if hint is not None:
+        for (k, t, j), var in x.items():
+            model.AddHint(var, int(hint[k, t] == j))
+    
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(time_limit)
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+    
+    assign = np.full((machines, days), -1, dtype=np.int64)
+    for (k, t, j), var in x.items():
+        if solver.Value(var):
+            assign[k, t] = j
+    return assign
+
+# ============================================================================
+# ПЛАН
+# ============================================================================
+
+def schedule_rows(problem, assign):
+    """
+    Строки tentative_production_plan: одна на кампанию и деталь формы
+    
+    В количество идут только удары в счёт спроса (перелив последнего
+    дня кампании не планируется).
+    
+    Возвращает: список строк
+    """
+    total = problem['demand'][:, -1]
+    
+    # Удары в счёт спроса: по дням, внутри дня - по машинам
+    useful = np.zeros(assign.shape, dtype=np.int64)
+    done = np.zeros(len(problem['mold_ids']), dtype=np.int64)
+    changes = schedule_changes(problem, assign)
+    for t in range(assign.shape[1]):
+        for k in range(assign.shape[0]):
+            j = assign[k, t]
+            if j < 0:
+                continue
+            hits = problem['setup_hits'][k, j] if changes[k, t] else problem['full_hits'][k, j]
+            useful[k, t] = min(done[j] + hits, total[j]) - min(done[j], total[j])
+            done[j] += hits
+    
+    remaining = {detail_id: pieces for details in problem['mold_details'].values()
+                 for detail_id, _, pieces in details}
+    rows = []
+    for k, machine_runs in enumerate(to_runs(assign)):
+        t = 0
+        for j, length in machine_runs:
+            run_hits = int(useful[k, t:t + length].sum())
+            if j >= 0 and run_hits > 0:
+                for detail_id, qty_per_hit, _ in problem['mold_details'].get(j, []):
+                    quantity = min(int(run_hits * qty_per_hit), remaining[detail_id])
+                    if quantity <= 0:
+                        continue
+                    remaining[detail_id] -= quantity
+                    rows.append((
+                        detail_id,
+                        CASTING_PHASE,
+                        problem['machine_ids'][k],
+                        problem['days'][t].item(),
+                        problem['days'][t + length - 1].item(),
+                        quantity,
+                        'heuristic',
+                        PLAN_NOTE
+                    ))
+            t += length
+    return rows
+
+def write_schedule(conn, rows, start_date, end_month):
+    """Замена строк отливки (нетто-расчёт и прошлое расписание) на горизонте одной транзакцией"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM tentative_production_plan
+            WHERE operation = %s AND notes = ANY(%s)
+              AND end_date >= %s AND start_date < %s
+        """, (CASTING_PHASE, [mrp_netting.PLAN_NOTE, PLAN_NOTE], start_date, end_month))
+        deleted = cursor.rowcount
+        
+        if rows:
+            execute_values(cursor, """
+                INSERT INTO tentative_production_plan (
+                    detail_id, operation, machine_id, start_date, end_date,
+                    quantity_planned, status, notes
+                ) VALUES %s
+            """, rows, page_size=1000)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return deleted
+
+def run_scheduler(conn, start_date=None, months=HORIZON_MONTHS, sources=None,
+                  solver='heuristic', time_limit=TIME_LIMIT, dry_run=False):
+    """
+    Расписание форм на горизонт и запись в tentative_production_plan
+    
+    Возвращает: (problem, назначения [машина, день])
+    """
+    if start_date is None:
+        start_date = date.today()
+    start_month, end_month = horizon(start_date, months)
+    
+    print(f"\n=== Расписание отливки: {start_date} - {end_month} ===")
+    
+    problem = build_problem(conn, start_date, months, sources)
+    if not problem['machine_ids']:
+        raise RuntimeError("Нет доступных литейных машин")
+    print(f"Машин: {len(problem['machine_ids'])}, форм со спросом: {len(problem['mold_details'])}, "
+          f"рабочих дней: {len(problem['days'])}, ударов: {int(problem['demand'][:, -1].sum())}")
+    if problem['blocked']:
+        print(f"⚠️  Форма не в работе (ремонт / списана), не планируется: "
+              f"деталей {len(problem['blocked'])}, штук {sum(problem['blocked'].values())}")
+    
+    started = time.perf_counter()
+    assign = greedy_schedule(problem)
+    _, shortage, setup = evaluate(problem, assign)
+    print(f"Жадное расписание: недолив {shortage}, переналадка {setup} мин "
+          f"({time.perf_counter() - started:.2f} с)")
+    
+    if solver == 'cp-sat':
+        solved = solve_cpsat(problem, time_limit, hint=assign)
+        if solved is None:
+            print("⚠️  CP-SAT не нашёл решения - остаётся эвристика")
+        elif evaluate(problem, solved) < evaluate(problem, assign):
+            assign = solved
+        label = 'CP-SAT'
+    else:
+        assign, accepted = local_search(problem, assign, time_limit)
+        label = f"Локальный поиск ({accepted} ходов)"
+    
+    conflicts, shortage, setup = evaluate(problem, assign)
+    changeovers = int(schedule_changes(problem, assign).sum())
+    print(f"{label}: недолив {shortage}, переналадок {changeovers} ({setup} мин), "
+          f"{time.perf_counter() - started:.2f} с")
+    if conflicts:
+        print(f"⚠️  Форма на двух машинах в один день: {conflicts}")
+    if shortage:
+        print(f"⚠️  Не отливается к сроку: {shortage} ударов")
+    
+    if dry_run:
+        return problem, assign
+    
+    rows = schedule_rows(problem, assign)
+    deleted = write_schedule(conn, rows, start_date, end_month)
+    print(f"✅ Строк плана: {len(rows)} (удалено старых: {deleted})")
+    return problem, assign
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Расписание форм на литейных машинах')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Начало горизонта (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--months', type=int, default=HORIZON_MONTHS,
+                       help=f'Горизонт в месяцах (по умолчанию {HORIZON_MONTHS})')
+    parser.add_argument('--source', action='append', choices=mrp_netting.SOURCES,
+                       help='Источник потребностей (можно несколько раз), по умолчанию все')
+    parser.add_argument('--solver', choices=SOLVERS, default='heuristic',
+                       help='heuristic (по умолчанию) или cp-sat (нужен ortools)')
+    parser.add_argument('--time-limit', type=float, default=TIME_LIMIT,
+                       help=f'Секунд на улучшение расписания (по умолчанию {TIME_LIMIT})')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Расчёт без записи плана в БД')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    if args.solver == 'cp-sat' and cp_model is None:
+        parser.error("Для --solver cp-sat нужен ortools: pip install ortools")
+    
+    start_date = None
+    if args.date:
+        try:
+            start_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        run_scheduler(conn, start_date, args.months, args.source,
+                      args.solver, args.time_limit, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Текущие остатки из current_inventory
+
+current_inventory - копия последнего снапшота (полного из
+inventory_snapshots или восстановленного из inventory_history) по
+ключу (detail_id, phase, warehouse_id). Загрузка остатков обновляет её
+в той же транзакции (SQL-функция refresh_current_inventory), если
+снапшот не старше уже загруженного: читатели видят либо старый, либо
+новый снапшот целиком, без MAX(snapshot_date) по истории.
+
+Использование:
+    snapshot_date, inventory = current_inventory.load_array(conn, detail_ids, PHASES)
+    inventory[d, p]              # сумма по складам
+    
+    python current_inventory.py                # остатки по фазам
+    python current_inventory.py --refresh      # пересобрать из последнего снапшота
+"""
+
+import argparse
+import sys
+import os
+import numpy as np
+import psycopg2
+
+def snapshot_date(conn):
+    """Дата снапшота в current_inventory (None - таблица пуста)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT snapshot_date FROM current_inventory LIMIT 1")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return row[0] if row else None
+
+def load_array(conn, detail_ids, phases):
+    """
+    Текущие остатки одним запросом, сумма по складам
+    
+    Args:
+        detail_ids: id деталей (ось 0), порядок сохраняется
+        phases: фазы (ось 1), остальные фазы не читаются
+    
+    Возвращает: (snapshot_date или None, np.ndarray [деталь, фаза])
+    """
+    inventory = np.zeros((len(detail_ids), len(phases)), dtype=np.int64)
+    if not len(detail_ids):
+        return None, inventory
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT detail_id, phase, SUM(quantity), MAX(snapshot_date)
+            FROM current_inventory
+            WHERE phase = ANY(%s)
+            GROUP BY detail_id, phase
+        """, (list(phases),))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    detail_index = {detail_id: i for i, detail_id in enumerate(np.asarray(detail_ids).tolist())}
+    phase_index = {phase: i for i, phase in enumerate(phases)}
+    rows = [(detail_index.get(detail_id), phase_index[phase], quantity, row_date)
+            for detail_id, phase, quantity, row_date in rows]
+    rows = [row for row in rows if row[0] is not None]
+    if not rows:
+        return None, inventory
+    
+    positions, phase_pos, quantities, dates = zip(*rows)
+    np.add.at(inventory, (list(positions), list(phase_pos)), np.array(quantities, dtype=np.int64))
+    return max(dates), inventory
+
+def refresh(conn, snapshot=None):
+    """
+    Пересборка current_inventory из снапшота (по умолчанию - последнего,
+    полного или из истории)
+    
+    Возвращает: число изменённых строк
+    """
+    cursor = conn.cursor()
+    try:
+        if snapshot is None:
+            cursor.execute("SELECT latest_inventory_date()")
+            snapshot = cursor.fetchone()[0]
+        if snapshot is None:
+            print(f"⚠️  Нет снапшотов остатков")
+            return 0
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot,))
+        changed = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    print(f"🔁 current_inventory: снапшот {snapshot}, изменено строк {changed}")
+    return changed
+
+def print_inventory(conn):
+    """Текущие остатки по фазам"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT phase, COUNT(DISTINCT detail_id), SUM(quantity)
+            FROM current_inventory
+            GROUP BY phase
+            ORDER BY phase
+        """)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    print(f"\n📊 Текущие остатки (снапшот {snapshot_date(conn) or '-'}):")
+    for phase, details, quantity in rows:
+        print(f"   {phase:<12} деталей {details:>4}, штук {quantity:>8}")
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Текущие остатки (current_inventory)')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Пересобрать из последнего снапшота (полного или из истории)')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    conn = connect_db(conn_string)
+    try:
+        if args.refresh:
+            refresh(conn)
+        print_inventory(conn)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Твёрдый план на день (daily_production_plan) из предварительного плана
+
+Источник - строки tentative_production_plan, период которых покрывает
+дату плана (status heuristic/cached/emergency), самого мелкого уровня
+для каждой пары деталь-операция (неделя, месяц, грубый план - см.
+plan_refinement; ручные строки без метки - уровень грубого плана).
+На день берётся доля количества по рабочим дням периода (целыми
+штуками, в сумме ровно количество периода; в выходные - ничего), с учётом:
+- machine_state: машины в out_of_order / maintenance не планируются,
+  их строки переносятся на другую доступную машину той же фазы
+- capacity_model: на машине не больше одной смены работы, остаток
+  переходит на другие машины фазы
+
+Запись одной транзакцией: изменённые строки - execute_values
+INSERT ... ON CONFLICT (plan_date, detail_id, operation, machine_id) DO UPDATE,
+удаляются только строки, исчезнувшие из плана. Неизменённые строки
+не трогаются - перепланирование в течение смены дешёвое и не блокирует
+читателей.
+
+Использование:
+    python daily_plan.py --connection "postgresql://..."
+    python daily_plan.py --date 2025-11-12 --dry-run
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime, date, timedelta
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import capacity_model
+from mrp_netting import PHASES
+from planning_common import spread_quantity, machine_states, ACTIVE_STATUSES, UNAVAILABLE_STATES, REFINED_NOTES
+
+def tentative_rows(conn, plan_date):
+    """Строки предварительного плана, покрывающие дату (самого мелкого уровня по детали и операции)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            WITH covering AS (
+                SELECT detail_id, operation, machine_id, start_date, end_date, quantity_planned,
+                       COALESCE(array_position(%s::text[], notes), cardinality(%s::text[]) + 1) AS level
+                FROM tentative_production_plan
+                WHERE start_date <= %s AND end_date >= %s
+                  AND status = ANY(%s)
+            ),
+            ranked AS (
+                SELECT *, MIN(level) OVER (PARTITION BY detail_id, operation) AS finest
+                FROM covering
+            )
+            SELECT detail_id, operation, machine_id, start_date, end_date, quantity_planned
+            FROM ranked
+            WHERE level = finest
+            ORDER BY end_date, detail_id
+        """, (REFINED_NOTES, REFINED_NOTES, plan_date, plan_date, ACTIVE_STATUSES))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def daily_share(quantity, start_date, end_date, plan_date):
+    """
+    Доля количества периода на дату плана
+    
+    Раскладка как в plan_refinement / emergency_replan (spread_quantity):
+    целыми штуками, сумма по рабочим дням равна количеству периода.
+    Нерабочий день или дата вне периода - 0.
+    """
+    days, shares = spread_quantity(quantity, start_date, end_date)
+    position = np.searchsorted(days, np.datetime64(plan_date, 'D'))
+    if position < len(days) and days[position] == np.datetime64(plan_date, 'D'):
+        return int(shares[position])
+    return 0
+
+def build_daily_plan(tentative, model, states, plan_date):
+    """
+    План на день: {(detail_id, операция, machine_id): количество}
+    
+    Строки идут по сроку окончания периода, затем по цепочке фаз;
+    загрузка машины считается долями смены по capacity_model. Что не
+    влезло в смену своей машины, переходит на другие машины той же фазы.
+    
+    Возвращает: (план, статистика)
+    """
+    def available(machine_id):
+        m = model.machine_index.get(machine_id)
+        return (states.get(machine_id) not in UNAVAILABLE_STATES
+                and (m is None or model.machine_active[m]))
+    
+    phase_order = {phase: i for i, phase in enumerate(PHASES)}
+    tentative = sorted(tentative, key=lambda row: (row[4], phase_order.get(row[1], 0), row[0]))
+    
+    plan = {}
+    load = {}
+    stats = {'moved': 0, 'no_machine': 0, 'capacity_cut': 0}
+    
+    for detail_id, operation, machine_id, start_date, end_date, quantity in tentative:
+        quantity = daily_share(quantity, start_date, end_date, plan_date)
+        if quantity <= 0:
+            continue
+        
+        # Своя машина, затем остальные доступные машины фазы по мощности
+        candidates = [m for m in model.machines_for(detail_id, operation)
+                      if m != machine_id and available(m)]
+        if available(machine_id):
+            candidates.insert(0, machine_id)
+        elif candidates:
+            stats['moved'] += 1
+        else:
+            stats['no_machine'] += 1
+            continue
+        
+        for candidate in candidates:
+            if quantity <= 0:
+                break
+            # Загрузка машины в долях смены (без параметров - не ограничиваем)
+            pieces = model.pieces_per_shift(candidate, detail_id)
+            portion = quantity
+            if pieces > 0:
+                portion = min(quantity, int((1.0 - load.get(candidate, 0.0)) * pieces))
+                if portion <= 0:
+                    continue
+                load[candidate] = load.get(candidate, 0.0) + portion / pieces
+            
+            key = (detail_id, operation, candidate)
+            plan[key] = plan.get(key, 0) + portion
+            quantity -= portion
+        
+        if quantity > 0:
+            stats['capacity_cut'] += 1
+    
+    return plan, stats
+
+def write_daily_plan(conn, plan_date, plan):
+    """
+    Запись плана на день: только изменения, одной транзакцией
+    
+    Возвращает: dict inserted/updated/deleted/unchanged
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT detail_id, operation, machine_id, quantity_planned
+            FROM daily_production_plan
+            WHERE plan_date = %s
+        """, (plan_date,))
+        old = {(detail_id, operation, machine_id): quantity
+               for detail_id, operation, machine_id, quantity in cursor.fetchall()}
+        
+        upserts = [(plan_date, *key, quantity) for key, quantity in plan.items()
+                   if old.get(key) != quantity]
+        deletes = [(plan_date, *key) for key in old if key not in plan]
+        inserted = sum(1 for _, *key, _ in upserts if tuple(key) not in old)
+        
+        if deletes:
+            execute_values(cursor, """
+                DELETE FROM daily_production_plan p
+                USING (VALUES %s) AS d(plan_date, detail_id, operation, machine_id)
+                WHERE p.plan_date = d.plan_date
+                  AND p.detail_id = d.detail_id
+                  AND p.operation = d.operation
+                  AND p.machine_id = d.machine_id
+            """, deletes)
+        
+        if upserts:
+            execute_values(cursor, """
+                INSERT INTO daily_production_plan (
+                    plan_date, detail_id, operation, machine_id, quantity_planned
+                )
+                VALUES %s
+                ON CONFLICT (plan_date, detail_id, operation, machine_id)
+                DO UPDATE SET quantity_planned = EXCLUDED.quantity_planned
+            """, upserts)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    return {
+        'inserted': inserted,
+        'updated': len(upserts) - inserted,
+        'deleted': len(deletes),
+        'unchanged': len(plan) - len(upserts)
+    }
+
+def generate_daily_plan(conn, plan_date=None, dry_run=False):
+    """
+    План на дату (по умолчанию - завтра) из предварительного плана
+    
+    Возвращает: {(detail_id, операция, machine_id): количество}
+    """
+    if plan_date is None:
+        plan_date = date.today() + timedelta(days=1)
+    
+    print(f"\n=== План на день: {plan_date} ===")
+    
+    model = capacity_model.get_model(conn)
+    states = machine_states(conn, plan_date)
+    tentative = tentative_rows(conn, plan_date)
+    plan, stats = build_daily_plan(tentative, model, states, plan_date)
+    
+    print(f"Строк предварительного плана: {len(tentative)}, в плане на день: {len(plan)}")
+    if stats['moved']:
+        print(f"🔁 Перенесено с неработающих машин: {stats['moved']}")
+    if stats['no_machine']:
+        print(f"⚠️  Нет доступной машины: {stats['no_machine']}")
+    if stats['capacity_cut']:
+        print(f"⚠️  Урезано по мощности смены: {stats['capacity_cut']}")
+    
+    if dry_run:
+        return plan
+    
+    result = write_daily_plan(conn, plan_date, plan)
+    print(f"✅ Добавлено {result['inserted']}, изменено {result['updated']}, "
+          f"удалено {result['deleted']}, без изменений {result['unchanged']}")
+    return plan
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Твёрдый план на день из предварительного плана')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Дата плана (YYYY-MM-DD), по умолчанию - завтра')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Расчёт без записи в БД')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    plan_date = None
+    if args.date:
+        try:
+            plan_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        generate_daily_plan(conn, plan_date, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Экстренное перепланирование при поломке / обслуживании машины
+
+Полный проход (plan_refinement) пересчитывает грубый план целиком -
+посреди смены это долго. Здесь переносятся только строки сломанной
+машины за период [date, until]:
+- daily_production_plan: строки машины на эти дни раскладываются по
+  другим доступным машинам той же фазы (output_phase) с учётом уже
+  запланированной загрузки смены по capacity_model; что не влезло -
+  на самую производительную из них (с предупреждением о перегрузе).
+  Перенесённые строки - notes='emergency'
+- tentative_production_plan: строка машины делится по рабочим дням на
+  части до периода / в периоде / после; часть в периоде по дням
+  раскладывается так же по свободной части смены других машин фазы
+  (загрузка - строки того же уровня плана, notes) со status='emergency',
+  остальные остаются на машине как были
+
+Доступность машин берётся из machine_state на каждый день периода.
+
+Всё одной транзакцией, несколько запросов - ответ за доли секунды.
+
+Использование:
+    python emergency_replan.py --machine 3 --date 2025-11-12
+    python emergency_replan.py --machine 3 --date 2025-11-12 --until 2025-11-14 --status maintenance
+    python emergency_replan.py --machine 3 --dry-run
+"""
+
+import argparse
+import sys
+import os
+import time
+from datetime import datetime, date
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import capacity_model
+from planning_common import spread_quantity, ACTIVE_STATUSES, UNAVAILABLE_STATES
+
+EMERGENCY_STATUS = 'emergency'
+
+def alternatives(model, detail_id, operation, machine_id, states):
+    """Доступные машины фазы для детали, кроме сломанной, от самой производительной"""
+    return [m for m in model.machines_for(detail_id, operation)
+            if m != machine_id and states.get(m) not in UNAVAILABLE_STATES]
+
+def states_by_day(conn, date_from, date_to):
+    """Последнее состояние каждой машины на каждый день периода: {дата: {machine_id: status}}"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT d::date, s.machine_id, s.status
+            FROM generate_series(%s::date, %s::date, interval '1 day') AS d
+            CROSS JOIN LATERAL (
+                SELECT DISTINCT ON (machine_id) machine_id, status
+                FROM machine_state
+                WHERE state_date <= d::date
+                ORDER BY machine_id, state_date DESC
+            ) s
+        """, (date_from, date_to))
+        states = {}
+        for day, machine_id, status in cursor.fetchall():
+            states.setdefault(day, {})[machine_id] = status
+        return states
+    finally:
+        cursor.close()
+
+def fill_shifts(model, detail_id, quantity, candidates, load, slot):
+    """
+    Количество по свободной части смены кандидатов (от лучшего), что не
+    влезло - на лучшего
+    
+    Args:
+        load: {(*slot, machine_id): загрузка в долях смены}, дополняется
+        slot: ключ смены без машины, например (plan_date,)
+    
+    Возвращает: ([(machine_id, штук)], перегружена ли машина)
+    """
+    portions = {}
+    for candidate in candidates:
+        if quantity <= 0:
+            break
+        pieces = model.pieces_per_shift(candidate, detail_id)
+        key = (*slot, candidate)
+        portion = min(quantity, int((1.0 - load.get(key, 0.0)) * pieces))
+        if portion <= 0:
+            continue
+        load[key] = load.get(key, 0.0) + portion / pieces
+        portions[candidate] = portion
+        quantity -= portion
+    if quantity > 0:
+        portions[candidates[0]] = portions.get(candidates[0], 0) + quantity
+    return list(portions.items()), quantity > 0
+
+def record_state(cursor, machine_id, state_date, status):
+    """Состояние машины на дату в machine_state"""
+    cursor.execute("""
+        INSERT INTO machine_state (state_date, machine_id, status, notes)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (state_date, machine_id) DO UPDATE SET status = EXCLUDED.status
+    """, (state_date, machine_id, status, EMERGENCY_STATUS))
+
+def replan_daily(cursor, model, machine_id, date_from, date_to, states):
+    """
+    Перенос строк плана на день со сломанной машины
+    
+    Возвращает: (строки для UPSERT, ключи перенесённых строк, статистика)
+    """
+    cursor.execute("""
+        SELECT plan_date, detail_id, operation, machine_id, quantity_planned
+        FROM daily_production_plan
+        WHERE plan_date BETWEEN %s AND %s
+    """, (date_from, date_to))
+    rows = cursor.fetchall()
+    
+    # Уже запланированная загрузка машин в долях смены
+    load = {}
+    affected = []
+    for plan_date, detail_id, operation, row_machine, quantity in rows:
+        if row_machine == machine_id:
+            affected.append((plan_date, detail_id, operation, quantity))
+            continue
+        pieces = model.pieces_per_shift(row_machine, detail_id)
+        if pieces > 0:
+            load[(plan_date, row_machine)] = load.get((plan_date, row_machine), 0.0) + quantity / pieces
+    
+    moved = {}
+    removed = []
+    stats = {'daily': 0, 'no_machine': 0, 'overload': 0}
+    for plan_date, detail_id, operation, quantity in affected:
+        candidates = alternatives(model, detail_id, operation, machine_id, states.get(plan_date, {}))
+        if not candidates:
+            stats['no_machine'] += 1
+            continue
+        stats['daily'] += 1
+        removed.append((plan_date, detail_id, operation, machine_id))
+        
+        portions, overload = fill_shifts(model, detail_id, quantity, candidates, load, (plan_date,))
+        stats['overload'] += overload
+        for candidate, portion in portions:
+            key = (plan_date, detail_id, operation, candidate)
+            moved[key] = moved.get(key, 0) + portion
+    
+    return [(*key, quantity, EMERGENCY_STATUS) for key, quantity in moved.items()], removed, stats
+
+def split_row(quantity, start_date, end_date, date_from, date_to):
+    """
+    Количество строки до периода, в периоде и после (по рабочим дням)
+    
+    Возвращает: (до, после, в периоде) - до / после: (начало, конец, штук)
+    или None; в периоде: [(номер рабочего дня строки, день, штук)] с ненулевой долей
+    """
+    days, shares = spread_quantity(quantity, start_date, end_date)
+    first, last = np.datetime64(date_from, 'D'), np.datetime64(date_to, 'D')
+    parts = []
+    for mask in (days < first, days > last):
+        mask &= shares > 0
+        if not mask.any():
+            parts.append(None)
+            continue
+        parts.append((days[mask][0].item(), days[mask][-1].item(), int(shares[mask].sum())))
+    during = (days >= first) & (days <= last) & (shares > 0)
+    parts.append([(int(position), days[position].item(), int(shares[position]))
+                  for position in np.flatnonzero(during)])
+    return parts
+
+def tentative_load(cursor, model, machine_id, date_from, date_to):
+    """
+    Загрузка других машин по предварительному плану в периоде
+    
+    Уровни плана (исходный, refine_month, refine_week) повторяют друг
+    друга, поэтому загрузка считается отдельно по notes строки.
+    
+    Возвращает: {(notes, день, machine_id): загрузка в долях смены}
+    """
+    cursor.execute("""
+        SELECT machine_id, detail_id, start_date, end_date, quantity_planned, COALESCE(notes, '')
+        FROM tentative_production_plan
+        WHERE machine_id <> %s AND status = ANY(%s)
+          AND start_date <= %s AND end_date >= %s
+    """, (machine_id, ACTIVE_STATUSES, date_to, date_from))
+    
+    first, last = np.datetime64(date_from, 'D'), np.datetime64(date_to, 'D')
+    load = {}
+    for row_machine, detail_id, start_date, end_date, quantity, notes in cursor.fetchall():
+        pieces = model.pieces_per_shift(row_machine, detail_id)
+        if pieces <= 0:
+            continue
+        days, shares = spread_quantity(quantity, start_date, end_date)
+        inside = (days >= first) & (days <= last)
+        for day, share in zip(days[inside].tolist(), shares[inside].tolist()):
+            key = (notes, day, row_machine)
+            load[key] = load.get(key, 0.0) + share / pieces
+    return load
+
+def day_runs(portions):
+    """
+    [(номер рабочего дня, день, штук)] → строки (начало, конец, штук)
+    
+    Соседние дни с одинаковой долей - одна строка: раскладка
+    spread_quantity по её рабочим дням даёт те же доли.
+    """
+    runs = []
+    for position, day, quantity in portions:
+        last = runs[-1] if runs else None
+        if last and last[0] == position - 1 and last[3] == quantity:
+            last[0], last[2] = position, day
+            last[4] += quantity
+        else:
+            runs.append([position, day, day, quantity, quantity])
+    return [(start, end, total) for _, start, end, _, total in runs]
+
+def replan_tentative(cursor, model, machine_id, date_from, date_to, states):
+    """
+    Перенос части строк предварительного плана со сломанной машины
+    
+    Часть в периоде раскладывается по дням, как в replan_daily: по
+    свободной части смены машин, доступных в этот день.
+    
+    Возвращает: (id удаляемых строк, новые строки, статистика)
+    """
+    load = tentative_load(cursor, model, machine_id, date_from, date_to)
+    
+    cursor.execute("""
+        SELECT id, detail_id, operation, start_date, end_date, quantity_planned, status, notes
+        FROM tentative_production_plan
+        WHERE machine_id = %s AND status = ANY(%s)
+          AND start_date <= %s AND end_date >= %s
+        ORDER BY end_date, id
+    """, (machine_id, ACTIVE_STATUSES, date_to, date_from))
+    
+    deleted, inserted = [], []
+    stats = {'tentative': 0, 'no_machine': 0, 'overload': 0}
+    for row_id, detail_id, operation, start_date, end_date, quantity, status, notes in cursor.fetchall():
+        before, after, during = split_row(quantity, start_date, end_date, date_from, date_to)
+        if not during:
+            continue
+        day_candidates = [alternatives(model, detail_id, operation, machine_id, states.get(day, {}))
+                          for _, day, _ in during]
+        if not any(day_candidates):
+            stats['no_machine'] += 1
+            continue
+        if not all(day_candidates):
+            stats['no_machine'] += 1
+        
+        stats['tentative'] += 1
+        deleted.append(row_id)
+        
+        # {машина: [(номер рабочего дня, день, штук)]} - по свободной части смены;
+        # дни без доступной машины остаются на сломанной
+        targets = {}
+        for (position, day, share), candidates in zip(during, day_candidates):
+            if not candidates:
+                targets.setdefault(machine_id, []).append((position, day, share))
+                continue
+            portions, overload = fill_shifts(model, detail_id, share, candidates, load,
+                                             (notes or '', day))
+            stats['overload'] += overload
+            for candidate, portion in portions:
+                targets.setdefault(candidate, []).append((position, day, portion))
+        
+        for part in (before, after):
+            if part is not None:
+                inserted.append((detail_id, operation, machine_id, *part, status, notes))
+        for target, portions in targets.items():
+            target_status = status if target == machine_id else EMERGENCY_STATUS
+            for start, end, total in day_runs(portions):
+                inserted.append((detail_id, operation, target, start, end, total,
+                                 target_status, notes))
+    return deleted, inserted, stats
+
+def emergency_replan(conn, machine_id, date_from=None, date_to=None, status=None, dry_run=False):
+    """
+    Перенос плана сломанной машины за период одной транзакцией
+    
+    Args:
+        machine_id: машина, вышедшая из строя
+        date_from, date_to: период простоя (по умолчанию - сегодня, один день)
+        status: записать состояние машины в machine_state на date_from
+    
+    Возвращает: статистика переноса
+    """
+    if date_from is None:
+        date_from = date.today()
+    if date_to is None:
+        date_to = date_from
+    
+    print(f"\n=== Экстренный перенос: машина {machine_id}, {date_from} - {date_to} ===")
+    
+    started = time.perf_counter()
+    model = capacity_model.get_model(conn)
+    if machine_id not in model.machine_index:
+        raise ValueError(f"Машина не найдена: {machine_id}")
+    
+    cursor = conn.cursor()
+    try:
+        if status:
+            record_state(cursor, machine_id, date_from, status)
+        states = states_by_day(conn, date_from, date_to)
+        
+        daily_rows, removed, stats = replan_daily(cursor, model, machine_id, date_from, date_to, states)
+        deleted, inserted, tentative_stats = replan_tentative(cursor, model, machine_id,
+                                                              date_from, date_to, states)
+        stats['tentative'] = tentative_stats['tentative']
+        stats['no_machine'] += tentative_stats['no_machine']
+        stats['overload'] += tentative_stats['overload']
+        
+        if not dry_run:
+            if removed:
+                execute_values(cursor, """
+                    DELETE FROM daily_production_plan p
+                    USING (VALUES %s) AS d(plan_date, detail_id, operation, machine_id)
+                    WHERE p.plan_date = d.plan_date
+                      AND p.detail_id = d.detail_id
+                      AND p.operation = d.operation
+                      AND p.machine_id = d.machine_id
+                """, removed)
+            if daily_rows:
+                execute_values(cursor, """
+                    INSERT INTO daily_production_plan (
+                        plan_date, detail_id, operation, machine_id, quantity_planned, notes
+                    ) VALUES %s
+                    ON CONFLICT (plan_date, detail_id, operation, machine_id)
+                    DO UPDATE SET quantity_planned = daily_production_plan.quantity_planned
+                                                     + EXCLUDED.quantity_planned,
+                                  notes = EXCLUDED.notes
+                """, daily_rows)
+            
+            if deleted:
+                cursor.execute("DELETE FROM tentative_production_plan WHERE id = ANY(%s)", (deleted,))
+            if inserted:
+                execute_values(cursor, """
+                    INSERT INTO tentative_production_plan (
+                        detail_id, operation, machine_id, start_date, end_date,
+                        quantity_planned, status, notes
+                    ) VALUES %s
+                """, inserted)
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    print(f"🔁 План на день: перенесено строк {stats['daily']}, "
+          f"предварительный план: {stats['tentative']} ({time.perf_counter() - started:.2f} с)")
+    if stats['no_machine']:
+        print(f"⚠️  Нет другой доступной машины фазы: {stats['no_machine']}")
+    if stats['overload']:
+        print(f"⚠️  Не влезло в смену, машина перегружена: {stats['overload']}")
+    if not dry_run:
+        print(f"✅ Записано: {len(daily_rows)} строк на день, {len(inserted)} строк предварительного плана")
+    return stats
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Экстренный перенос плана со сломанной машины')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--machine', '-m', type=int, required=True,
+                       help='id машины')
+    parser.add_argument('--date', '-d',
+                       help='Начало простоя (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--until',
+                       help='Последний день простоя (YYYY-MM-DD), по умолчанию = --date')
+    parser.add_argument('--status', choices=UNAVAILABLE_STATES,
+                       help='Записать состояние машины в machine_state на --date')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Расчёт без записи в БД')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    try:
+        date_from = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+        date_to = datetime.strptime(args.until, '%Y-%m-%d').date() if args.until else None
+    except ValueError:
+        parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    if date_from and date_to and date_to < date_from:
+        parser.error("--until раньше --date")
+    
+    conn = connect_db(conn_string)
+    try:
+        emergency_replan(conn, args.machine, date_from, date_to, args.status, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
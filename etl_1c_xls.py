@@ -16,13 +16,24 @@ ETL скрипт для импорта данных из Excel файлов 1С
 import argparse
 import sys
 import os
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import Counter
 from pathlib import Path
 from datetime import datetime, date
 import re
 import pandas as pd
 import numpy as np
+import openpyxl
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_batch, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+import reference_data
+import etl_metrics
+import inventory_history
+from parse_cache import cached_parse
+from warehouse_resolver import WarehouseResolver, parse_aliases
 
 # ============================================================================
 # ПАРСЕРЫ ФАЙЛОВ 1С
@@ -31,23 +42,82 @@ from psycopg2.extras import execute_batch
 # Константы
 PHASES = ['Отливка', 'Зачистка', 'Дробеструй', 'Токарка', 'Фрезеровка', 'Слесарка']
 
+# Фазы остатков в БД (check_phase_snapshot) и написание 1С, сводимое к ним
+SNAPSHOT_PHASES = ['отливка', 'зачистка', 'дробеструй', 'фрезеровка', 'покраска', 'брак']
+PHASE_ALIASES = {'токарка': 'фрезеровка'}
+
+# Версия парсеров - входит в ключ кэша, менять при изменении логики разбора
+PARSER_VERSION = 1
+
+# Строк в одном чанке при потоковом чтении (заголовки должны влезать в первый)
+CHUNK_ROWS = 5000
+
+INVENTORY_HEADER_RE = re.compile(r'Характеристика|Номенклатура|Склад', re.IGNORECASE)
+REQUIREMENTS_HEADER_RE = re.compile(r'Характеристика|Номенклатура|Заказ')
+
 def is_empty_row(row):
     """Проверка что строка пустая"""
     return row.isna().all() or (row.astype(str).str.strip() == '').all()
 
 
-def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
+def convert_cell(value):
+    """Значение ячейки openpyxl как у pd.read_excel: '' -> None, 5.0 -> 5"""
+    if value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def rows_to_frame(rows, first_row, ncols=0):
+    """Чанк строк -> DataFrame: индекс = номер строки, колонки = номер колонки"""
+    df = pd.DataFrame(rows, dtype=object)
+    df.index = range(first_row, first_row + len(rows))
+    if df.shape[1] < ncols:
+        df = df.reindex(columns=range(ncols))
+    return df
+
+
+def read_excel_chunks(filepath, stream=False, chunk_rows=CHUNK_ROWS):
     """
-    Универсальный парсер иерархических файлов из 1С
+    Генератор DataFrame-чанков первого листа
     
-    Args:
-        filepath: путь к файлу
-        level_matchers_builder: функция(hierarchy_levels) -> list[matcher_func]
-        record_builder: функция(current_level, level_name, cell_value, row, state, data_columns) -> record или None
+    stream=False - весь лист одним чанком через pd.read_excel,
+    stream=True - openpyxl read_only, по chunk_rows строк: память не растёт
+    с размером файла, первые чанки доступны до чтения всего файла.
+    """
+    if not stream:
+        yield pd.read_excel(filepath, sheet_name=0, header=None)
+        return
     
-    Возвращает: список записей
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = []
+        first_row = 0
+        ncols = 0
+        for values in wb.worksheets[0].iter_rows(values_only=True):
+            rows.append([convert_cell(v) for v in values])
+            if len(rows) >= chunk_rows:
+                df = rows_to_frame(rows, first_row, ncols)
+                ncols = max(ncols, df.shape[1])
+                yield df
+                first_row += len(rows)
+                rows = []
+        if rows:
+            yield rows_to_frame(rows, first_row, ncols)
+    finally:
+        wb.close()
+
+
+def detect_header(df, header_re):
+    """
+    Поиск заголовков отчёта 1С
+    
+    Returns:
+        (hierarchy_levels, data_columns, start_row):
+        уровни иерархии (вертикально), названия колонок данных (горизонтально)
+        и номер первой строки данных
     """
-    df = pd.read_excel(filepath, sheet_name=0, header=None)
     nrows, ncols = df.shape
     
     # 1. Пропускаем служебные строки (содержат ':')
@@ -61,7 +131,7 @@ def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
         
         first_cell = None
         for col in range(ncols):
-            val = str(row[col]) if pd.notna(row[col]) else ''
+            val = str(row.iloc[col]) if pd.notna(row.iloc[col]) else ''
             if val.strip():
                 first_cell = val
                 break
@@ -72,7 +142,7 @@ def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
             continue
         
         # Заголовки найдены?
-        if first_cell and re.search(r'Характеристика|Номенклатура|Склад', first_cell, re.IGNORECASE):
+        if first_cell and header_re.search(first_cell):
             break
         
         current_row += 1
@@ -95,7 +165,7 @@ def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
             # Вертикально: иерархия
             hierarchy_cell_col = None
             for col in range(ncols):
-                val = str(row[col]) if pd.notna(row[col]) else ''
+                val = str(row.iloc[col]) if pd.notna(row.iloc[col]) else ''
                 val = val.strip()
                 if val and val != '-':
                     hierarchy_levels.append({
@@ -107,11 +177,11 @@ def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
                     level_idx += 1
                     break
             
-            # Горизонтально: data_columns
+            # Горизонтально: data_columns (для merged cells перезаписываем)
             for col in range(ncols):
                 if col == hierarchy_cell_col:
                     continue
-                val = str(row[col]) if pd.notna(row[col]) else ''
+                val = str(row.iloc[col]) if pd.notna(row.iloc[col]) else ''
                 val = val.strip()
                 if val and val != '-':
                     data_columns[col] = val
@@ -123,90 +193,177 @@ def parse_hierarchical_file(filepath, level_matchers_builder, record_builder):
             if col_name:
                 print(f"   Колонка {col_idx}: '{col_name}'")
     
-    if not hierarchy_levels:
-        print("❌ Не найдены заголовки иерархии")
-        return []
-    
     # 3. Начало данных
     start_row = header_row
     while start_row < nrows and is_empty_row(df.iloc[start_row]):
         start_row += 1
     
+    return hierarchy_levels, data_columns, start_row
+
+
+def hierarchy_cells(df, hierarchy_col, start_row=0):
+    """
+    Непустые значения колонки иерархии начиная со start_row
+    
+    Возвращает: Series строк (strip, без '-'), индекс = номер строки в df
+    """
+    cells = df.iloc[start_row:, hierarchy_col]
+    cells = cells[cells.notna()].astype(str).str.strip()
+    return cells[(cells != '') & (cells != '-')]
+
+
+def classify_levels(cells, level_matchers, start_level=0):
+    """
+    Уровень иерархии для всех строк сразу
+    
+    Совпадение с матчером - его уровень (первый по порядку),
+    не совпало - инкремент от предыдущей строки со сбросом в 0 после последнего.
+    
+    Args:
+        cells: Series строк колонки иерархии
+        level_matchers: list[функция(Series) -> bool маска]
+        start_level: уровень перед первой строкой
+    
+    Возвращает: np.ndarray уровней
+    """
+    n = len(cells)
+    n_levels = len(level_matchers)
+    
+    matched = np.full(n, -1)
+    for level_idx in reversed(range(n_levels)):
+        mask = np.asarray(level_matchers[level_idx](cells), dtype=bool)
+        matched[mask] = level_idx
+    
+    # Позиция последней совпавшей строки и расстояние до неё
+    pos = np.arange(n)
+    last_pos = np.maximum.accumulate(np.where(matched >= 0, pos, -1))
+    base = np.where(last_pos >= 0, matched[last_pos], start_level)
+    
+    return (base + pos - last_pos) % n_levels
+
+
+def never_matches(cells):
+    """Матчер для неизвестного уровня"""
+    return np.zeros(len(cells), dtype=bool)
+
+
+def to_quantity(values):
+    """Количество из ячеек 1С ('1 234,5', '-', NaN) -> int, нечисловое = 0"""
+    text = values.astype(str).str.replace(',', '.', regex=False).str.replace(' ', '', regex=False)
+    numbers = pd.to_numeric(text, errors='coerce').where(values.notna())
+    numbers = numbers.where(np.isfinite(numbers), 0)
+    return np.trunc(numbers).astype(int)
+
+
+def iter_hierarchical_file(filepath, level_matchers_builder, records_builder,
+                           header_re=INVENTORY_HEADER_RE, stream=True):
+    """
+    Универсальный парсер иерархических файлов из 1С (генератор записей)
+    
+    Args:
+        filepath: путь к файлу
+        level_matchers_builder: функция(hierarchy_levels) -> list[matcher_func],
+            matcher_func(Series строк) -> bool маска
+        records_builder: функция(rows, df, data_columns, state) -> list[record],
+            rows - DataFrame (cell, level, level_name) с индексом = номер строки в df,
+            state - dict, переживает границы чанков
+        header_re: регулярка первой строки заголовков
+        stream: читать файл чанками через openpyxl read_only
+    """
+    chunks = read_excel_chunks(filepath, stream)
+    with etl_metrics.stage('read_excel') as timer:
+        df = next(chunks, None)
+        timer['rows'] = 0 if df is None else len(df)
+    if df is None:
+        print("❌ Пустой файл")
+        return
+    
+    # 1-3. Заголовки и начало данных (ищем в первом чанке)
+    with etl_metrics.stage('header_detection'):
+        hierarchy_levels, data_columns, start_row = detect_header(df, header_re)
+    
+    if not hierarchy_levels:
+        print("❌ Не найдены заголовки иерархии")
+        return
+    
     print(f"\n📊 Начало данных: строка {start_row}\n")
     
     # 4. Строим матчеры
     level_matchers = level_matchers_builder(hierarchy_levels)
     print(f"📊 Матчеры уровней: {len(level_matchers)} уровней\n")
     
-    # 5. Парсим данные
-    records = []
-    state = {}
     hierarchy_col = hierarchy_levels[0]['col'] if hierarchy_levels else 0
+    level_names = np.array([level['name'].lower() for level in hierarchy_levels])
+    print(f"📊 Колонка иерархии: {hierarchy_col}\n")
+    
+    # 5. Классифицируем строки чанками, уровень и state переносим между чанками
+    state = {}
     current_level = 0
     
-    for i in range(start_row, nrows):
-        row = df.iloc[i]
-        if is_empty_row(row):
-            continue
-        
-        cell_value = row[hierarchy_col]
-        if pd.isna(cell_value) or not str(cell_value).strip() or str(cell_value).strip() == '-':
-            continue
-        
-        cell_value = str(cell_value).strip()
-        
-        # Пробуем матчить
-        matched = False
-        for level_idx, matcher in enumerate(level_matchers):
-            if matcher(cell_value):
-                current_level = level_idx
-                matched = True
-                break
-        
-        # Не совпало - инкремент или сброс
-        if not matched:
-            if current_level >= len(level_matchers) - 1:
-                current_level = 0
-            else:
-                current_level += 1
+    while df is not None:
+        with etl_metrics.stage('classification') as timer:
+            cells = hierarchy_cells(df, hierarchy_col, start_row)
+            levels = classify_levels(cells, level_matchers, current_level)
+            if len(levels):
+                current_level = levels[-1]
+            
+            rows = pd.DataFrame({
+                'cell': cells.to_numpy(),
+                'level': levels,
+                'level_name': level_names[levels],
+            }, index=cells.index)
+            timer['rows'] = len(rows)
         
-        print(f"Строка {i:3d} | Уровень {current_level}: {cell_value[:50]}")
+        # Построчный лог только с -vv: на больших файлах он дороже парсинга
+        if etl_metrics.VERBOSITY >= 2:
+            for i, level, cell_value in zip(rows.index, rows['level'], rows['cell']):
+                print(f"Строка {i:3d} | Уровень {level}: {cell_value[:50]}")
         
-        # Обработка через callback
-        level_name = hierarchy_levels[current_level]['name'].lower() if current_level < len(hierarchy_levels) else ''
-        record = record_builder(current_level, level_name, cell_value, row, state, data_columns)
+        # 6. Записи из массивов через callback
+        with etl_metrics.stage('record_building') as timer:
+            records = records_builder(rows, df, data_columns, state)
+            timer['rows'] = len(records)
+        yield from records
         
-        if record:
-            records.append(record)
+        with etl_metrics.stage('read_excel') as timer:
+            df = next(chunks, None)
+            timer['rows'] = 0 if df is None else len(df)
+        start_row = 0
+
+
+def parse_hierarchical_file(filepath, level_matchers_builder, records_builder,
+                            header_re=INVENTORY_HEADER_RE, stream=False):
+    """
+    Универсальный парсер иерархических файлов из 1С
     
-    return records
+    Возвращает: список записей (см. iter_hierarchical_file)
+    """
+    return list(iter_hierarchical_file(filepath, level_matchers_builder, records_builder,
+                                       header_re, stream))
 
 
-def parse_inventory_file(filepath, snapshot_date=None):
-    """Парсинг файла "Товары на складах" """
+def iter_inventory_file(filepath, snapshot_date=None, stream=True):
+    """Парсинг файла "Товары на складах" (генератор записей)"""
     if snapshot_date is None:
         snapshot_date = datetime.now().date()
     
-    # Строим матчеры для инвентаря
+    # Строим матчеры для инвентаря (на вход - Series строк)
     def build_matchers(hierarchy_levels):
-        def is_nomenclature(text):
-            if text.startswith('Алюминий') and 'сплав' in text.lower():
-                return True
-            if re.search(r'К\d+\.\d+\.\d+', text):
-                return True
-            return False
-        
-        def is_characteristic(text):
-            if any(text.startswith(p) for p in PHASES):
-                return True
-            if text.startswith('Алюминий') and ('месяц' in text.lower() or 'месац' in text.lower()):
-                return True
-            return False
-        
-        def is_warehouse(text):
+        def is_aluminium(texts):
+            return texts.str.startswith('Алюминий')
+        
+        def is_nomenclature(texts):
+            alloy = is_aluminium(texts) & texts.str.lower().str.contains('сплав', regex=False)
+            return alloy | texts.str.contains(r'К\d+\.\d+\.\d+')
+        
+        def is_characteristic(texts):
+            month = is_aluminium(texts) & texts.str.lower().str.contains('месяц|месац')
+            return texts.str.startswith(tuple(PHASES)) | month
+        
+        def is_warehouse(texts):
             warehouse_keywords = ['цех', 'бокс', 'этаж', 'Склад', 'Малярка', 
                                  'Материалы', 'Брак', 'шоссе']
-            return any(kw in text for kw in warehouse_keywords)
+            return texts.str.contains('|'.join(warehouse_keywords))
         
         matchers = []
         for level in hierarchy_levels:
@@ -218,7 +375,7 @@ def parse_inventory_file(filepath, snapshot_date=None):
             elif 'склад' in name:
                 matchers.append(is_warehouse)
             else:
-                matchers.append(lambda x: False)
+                matchers.append(never_matches)
         return matchers
     
     # Обработчик записей
@@ -229,71 +386,77 @@ def parse_inventory_file(filepath, snapshot_date=None):
         'warehouse': None
     }
     
-    # Ищем колонку "Конечный остаток"
-    quantity_col_cache = [None]
-    
-    def build_record(current_level, level_name, cell_value, row, state, data_columns):
+    def build_records(rows, df, data_columns, state):
         # Инициализируем state
         if 'detail_code' not in state:
             state.update(inventory_state)
         
-        # Кэшируем колонку количества
-        if quantity_col_cache[0] is None:
-            for col_idx, col_name in enumerate(data_columns):
-                if col_name and ('Конечный' in col_name or 'конечный' in col_name.lower()):
-                    quantity_col_cache[0] = col_idx
-                    break
+        # Колонка "Конечный остаток"
+        quantity_col = None
+        for col_idx, col_name in enumerate(data_columns):
+            if col_name and ('Конечный' in col_name or 'конечный' in col_name.lower()):
+                quantity_col = col_idx
+                break
         
-        # Уровень 0: Номенклатура
-        if 'номенклатура' in level_name:
-            state['nomenclature'] = cell_value
-            match = re.search(r'К\d+\.\d+\.\d+[\.\d]*', cell_value)
-            if match:
-                state['detail_code'] = match.group(0)
-            else:
-                state['detail_code'] = None
-            state['characteristic'] = None
-            state['warehouse'] = None
+        level_name = rows['level_name']
+        cells = rows['cell']
+        is_nomenclature = level_name.str.contains('номенклатура', regex=False)
+        is_characteristic = ~is_nomenclature & level_name.str.contains('характеристика', regex=False)
+        is_warehouse = ~is_nomenclature & ~is_characteristic & level_name.str.contains('склад', regex=False)
         
-        # Уровень 1: Характеристика
-        elif 'характеристика' in level_name:
-            state['characteristic'] = cell_value
-            state['warehouse'] = None
+        # Протягиваем состояние вниз по строкам: '' = сброс на строке номенклатуры
+        codes = cells.str.extract(r'(К\d+\.\d+\.\d+[\.\d]*)', expand=False)
+        detail_code = (codes.fillna('').where(is_nomenclature).ffill()
+                       .fillna(state['detail_code'] or ''))
+        characteristic = (cells.where(is_characteristic, '').where(is_nomenclature | is_characteristic).ffill()
+                          .fillna(state['characteristic'] or ''))
+        nomenclature = cells.where(is_nomenclature).ffill().fillna(state['nomenclature'] or '')
         
-        # Уровень 2: Склад
-        elif 'склад' in level_name:
-            state['warehouse'] = cell_value.strip()
-            
-            if state['detail_code']:
-                quantity = 0
-                if quantity_col_cache[0] is not None:
-                    val = row[quantity_col_cache[0]]
-                    if pd.notna(val) and val != '-':
-                        try:
-                            quantity = int(float(str(val).replace(',', '.').replace(' ', '')))
-                        except:
-                            pass
-                
-                return {
-                    'detail_code': state['detail_code'],
-                    'characteristic': state['characteristic'],
-                    'warehouse': state['warehouse'],
-                    'snapshot_date': snapshot_date,
-                    'quantity': quantity
-                }
+        # Уровень склада с известной деталью = запись
+        selected = is_warehouse & (detail_code != '')
+        if quantity_col is not None:
+            quantity = to_quantity(df.loc[rows.index[selected], quantity_col]).tolist()
+        else:
+            quantity = [0] * int(selected.sum())
         
-        return None
+        records = [
+            {
+                'detail_code': code,
+                'characteristic': char or None,
+                'warehouse': warehouse,
+                'snapshot_date': snapshot_date,
+                'quantity': qty
+            }
+            for code, char, warehouse, qty in zip(
+                detail_code[selected], characteristic[selected], cells[selected], quantity
+            )
+        ]
+        
+        if len(rows):
+            state['nomenclature'] = nomenclature.iloc[-1] or None
+            state['detail_code'] = detail_code.iloc[-1] or None
+            state['characteristic'] = characteristic.iloc[-1] or None
+            state['warehouse'] = cells.iloc[-1] if is_warehouse.iloc[-1] else None
+        
+        return records
     
-    return parse_hierarchical_file(filepath, build_matchers, build_record)
+    return iter_hierarchical_file(filepath, build_matchers, build_records,
+                                  INVENTORY_HEADER_RE, stream)
 
 
-def parse_requirements_file(filepath, phase_filter=None):
+def parse_inventory_file(filepath, snapshot_date=None, stream=False):
+    """Парсинг файла "Товары на складах" """
+    return list(iter_inventory_file(filepath, snapshot_date, stream))
+
+
+def iter_requirements_file(filepath, phase_filter=None, stream=True):
     """
-    Парсинг файла "Анализ обеспеченности заказов" (Отливка.xlsx)
+    Парсинг файла "Анализ обеспеченности заказов" (генератор записей)
     
     Args:
         filepath: путь к файлу
         phase_filter: фильтр по фазе ('ot'|'za'|'dr'|'fr'|'ma'|'all'|None)
+        stream: читать файл чанками через openpyxl read_only
     """
     phase_map = {
         'ot': 'отливка',
@@ -303,275 +466,161 @@ def parse_requirements_file(filepath, phase_filter=None):
         'ma': 'материал'
     }
     
-    df = pd.read_excel(filepath, sheet_name=0, header=None)
-    nrows, ncols = df.shape
-    
-    # 1. Пропускаем служебные строки (содержат двоеточие)
-    current_row = 0
-    
-    while current_row < min(15, nrows):
-        row = df.iloc[current_row]
-        if is_empty_row(row):
-            current_row += 1
-            continue
-        
-        # Первая непустая ячейка
-        first_cell = None
-        for col in range(ncols):
-            val = str(row[col]) if pd.notna(row[col]) else ''
-            if val.strip():
-                first_cell = val
-                break
-        
-        # Служебная строка = содержит двоеточие
-        if first_cell and ':' in first_cell:
-            print(f"⏭️  Пропуск служебной строки {current_row}: {first_cell[:50]}...")
-            current_row += 1
-            continue
-        
-        # Заголовки найдены?
-        if first_cell and re.search(r'Характеристика|Номенклатура|Заказ', first_cell):
-            break
-        
-        current_row += 1
-    
-    # 2. Парсим заголовки - иерархия (вертикально) и колонки данных (горизонтально)
-    hierarchy_levels = []
-    data_columns = [''] * ncols  # Массив названий колонок данных
-    header_row = current_row
+    # Паттерны для каждого уровня иерархии (на вход - Series строк)
+    def is_aluminium(texts):
+        return texts.str.startswith('Алюминий')
     
-    if header_row < nrows:
-        print(f"\n📋 Чтение заголовков начиная со строки {header_row}")
-        
-        # Читаем все строки заголовков до первой пустой
-        level_idx = 0
-        while header_row < nrows:
-            row = df.iloc[header_row]
-            
-            # Пустая строка = конец заголовков
-            if is_empty_row(row):
-                break
-            
-            # Вертикально: ищем первую непустую ячейку для иерархии
-            hierarchy_cell_col = None
-            for col in range(ncols):
-                val = str(row[col]) if pd.notna(row[col]) else ''
-                val = val.strip()
-                if val and val != '-':
-                    hierarchy_levels.append({
-                        'col': col,
-                        'name': val
-                    })
-                    hierarchy_cell_col = col
-                    print(f"   Уровень {level_idx}: колонка {col} - '{val}'")
-                    level_idx += 1
-                    break
-            
-            # Горизонтально: остальные ячейки в data_columns (пропускаем иерархию)
-            for col in range(ncols):
-                if col == hierarchy_cell_col:
-                    continue  # Пропускаем колонку иерархии
-                val = str(row[col]) if pd.notna(row[col]) else ''
-                val = val.strip()
-                if val and val != '-':
-                    data_columns[col] = val  # Перезаписываем (для merged cells)
-            
-            header_row += 1
-        
-        # Выводим data_columns
-        print(f"\n📊 Колонки данных:")
-        for col_idx, col_name in enumerate(data_columns):
-            if col_name:
-                print(f"   Колонка {col_idx}: '{col_name}'")
-    
-    if not hierarchy_levels:
-        print("❌ Не найдены заголовки иерархии")
-        return []
-    
-    # 3. Начало данных - после заголовков (header_row уже указывает на пустую строку или первую строку данных)
-    start_row = header_row
-    while start_row < nrows and is_empty_row(df.iloc[start_row]):
-        start_row += 1
-    
-    print(f"\n📊 Начало данных: строка {start_row}\n")
-    
-    # 4. Парсим данные: паттерны для уровней + автоинкремент
-    records = []
-    state = {'phase': None, 'assembly': None, 'detail_code': None}
-    
-    # Определяем колонку иерархии (первый уровень)
-    hierarchy_col = hierarchy_levels[0]['col'] if hierarchy_levels else 1
-    
-    # Ищем колонку "Потребность"
-    quantity_col = None
-    for col_idx, col_name in enumerate(data_columns):
-        if 'Потребность' in col_name:
-            quantity_col = col_idx
-            break
-    
-    print(f"\n📊 Колонка иерархии: {hierarchy_col}, Колонка количества: {quantity_col}\n")
-    
-    # Определяем паттерны для каждого уровня иерархии
-    def is_phase(text):
-        if any(text.startswith(p) for p in PHASES):
-            return True
-        
+    def is_phase(texts):
         # Алюминий как фаза
-        if text.startswith('Алюминий') and 'мес' in text.lower():
-            return True
-        
-        return False
+        month = is_aluminium(texts) & texts.str.lower().str.contains('мес', regex=False)
+        return texts.str.startswith(tuple(PHASES)) | month
     
-    def is_assembly(text):
-        return bool(re.search(r'^\d{4}$|кресло|Лестница|Комплект|Опора|Привод|Поручень', text))
+    def is_assembly(texts):
+        return texts.str.contains(r'^\d{4}$|кресло|Лестница|Комплект|Опора|Привод|Поручень')
     
-    def is_okp(text):
-        return bool(re.match(r'^\(\d+-\d+\)$', text))  # (1-4)
+    def is_okp(texts):
+        return texts.str.match(r'^\(\d+-\d+\)$')  # (1-4)
     
-    def is_detail(text):
+    def is_detail(texts):
         # Номенклатура алюминий: начинается с "Алюминий" и содержит "сплав"
-        if text.startswith('Алюминий') and 'сплав' in text.lower():
-            return True
-        
+        alloy = is_aluminium(texts) & texts.str.lower().str.contains('сплав', regex=False)
         # Детали с кодом К##.##.###
-        return bool(re.search(r'К\d+\.\d+\.\d+', text))
+        return alloy | texts.str.contains(r'К\d+\.\d+\.\d+')
     
-    def is_date(text):
-        return bool(re.search(r'\d{2}\.\d{2}\.\d{4}', text))
+    def is_date(texts):
+        return texts.str.contains(r'\d{2}\.\d{2}\.\d{4}')
     
     # Динамически строим level_matchers из hierarchy_levels
-    level_matchers = []
-    for level in hierarchy_levels:
-        name = level['name'].lower()
-        if 'характеристика' in name and 'наименование' in name:
-            level_matchers.append(is_phase)
-        elif 'артикул' in name:
-            level_matchers.append(is_assembly)
-        elif 'окп' in name:
-            level_matchers.append(is_okp)
-        elif 'номенклатура' in name:
-            level_matchers.append(is_detail)
-        elif 'дата' in name:
-            level_matchers.append(is_date)
-        else:
-            # Неизвестный уровень - пропускаем
-            level_matchers.append(lambda x: False)
-    
-    print(f"📊 Матчеры уровней: {len(level_matchers)} уровней\n")
-    
-    current_level = 0
+    def build_matchers(hierarchy_levels):
+        level_matchers = []
+        for level in hierarchy_levels:
+            name = level['name'].lower()
+            if 'характеристика' in name and 'наименование' in name:
+                level_matchers.append(is_phase)
+            elif 'артикул' in name:
+                level_matchers.append(is_assembly)
+            elif 'окп' in name:
+                level_matchers.append(is_okp)
+            elif 'номенклатура' in name:
+                level_matchers.append(is_detail)
+            elif 'дата' in name:
+                level_matchers.append(is_date)
+            else:
+                # Неизвестный уровень - пропускаем
+                level_matchers.append(never_matches)
+        return level_matchers
     
-    for i in range(start_row, nrows):
-        row = df.iloc[i]
-        if is_empty_row(row):
-            continue
-        
-        # Читаем из фиксированной колонки иерархии
-        cell_value = row[hierarchy_col]
-        if pd.isna(cell_value) or not str(cell_value).strip() or str(cell_value).strip() == '-':
-            continue
-        
-        cell_value = str(cell_value).strip()
+    def build_records(rows, df, data_columns, state):
+        if 'phase' not in state:
+            state.update({'phase': None, 'assembly': None, 'detail_code': None})
         
-        # Пробуем матчить против всех уровней
-        matched = False
-        for level_idx, matcher in enumerate(level_matchers):
-            if matcher(cell_value):
-                current_level = level_idx
-                matched = True
+        # Ищем колонку "Потребность"
+        quantity_col = None
+        for col_idx, col_name in enumerate(data_columns):
+            if 'Потребность' in col_name:
+                quantity_col = col_idx
                 break
         
-        # Если не совпало - инкремент или сброс
-        if not matched:
-            if current_level >= len(level_matchers) - 1:
-                current_level = 0  # Сброс
-            else:
-                current_level += 1
-        
-        print(f"Строка {i:3d} | Уровень {current_level}: {cell_value[:50]}")
+        records = []
         
         # Обработка по типу уровня (не по номеру!)
-        level_name = hierarchy_levels[current_level]['name'].lower() if current_level < len(hierarchy_levels) else ''
-        
-        # Фаза
-        if 'характеристика' in level_name and 'наименование' in level_name:
-            phase = cell_value.split()[0].lower()
-            if phase == 'алюминий': phase = 'материал'
-            elif phase == 'токарка': phase = 'фрезеровка'
-            state['phase'] = phase
-            state['assembly'] = None
-            state['detail_code'] = None
-        
-        # Сборка/Артикул
-        elif 'артикул' in level_name:
-            state['assembly'] = cell_value
-            state['detail_code'] = None
-        
-        # ОКП - пропускаем
-        elif 'окп' in level_name:
-            pass
-        
-        # Деталь (Номенклатура)
-        elif 'номенклатура' in level_name and 'артикул' not in level_name:
-            match = re.search(r'\((К\d+\.\d+\.\d+[^\)]*)\)', cell_value)
-            if match:
-                state['detail_code'] = match.group(1)
-            else:
-                match = re.search(r'(К\d+\.\d+\.\d+[\.\d]*)', cell_value)
+        for i, level_name, cell_value in zip(rows.index, rows['level_name'], rows['cell']):
+            # Фаза
+            if 'характеристика' in level_name and 'наименование' in level_name:
+                phase = cell_value.split()[0].lower()
+                if phase == 'алюминий': phase = 'материал'
+                elif phase == 'токарка': phase = 'фрезеровка'
+                state['phase'] = phase
+                state['assembly'] = None
+                state['detail_code'] = None
+            
+            # Сборка/Артикул
+            elif 'артикул' in level_name:
+                state['assembly'] = cell_value
+                state['detail_code'] = None
+            
+            # ОКП - пропускаем
+            elif 'окп' in level_name:
+                pass
+            
+            # Деталь (Номенклатура)
+            elif 'номенклатура' in level_name and 'артикул' not in level_name:
+                match = re.search(r'\((К\d+\.\d+\.\d+[^\)]*)\)', cell_value)
                 if match:
-                    state['detail_code'] = match.group(0)
-        
-        # Дата
-        elif 'дата' in level_name:
-            if state['detail_code'] and state['phase']:
-                try:
-                    req_date = datetime.strptime(cell_value.split()[0], '%d.%m.%Y').date()
-                    req_month = req_date.replace(day=1)
-                    
-                    # Количество из колонки "Потребность"
-                    quantity = 0
-                    if quantity_col is not None:
-                        val = row[quantity_col]
-                        if pd.notna(val) and val != '-':
-                            try:
-                                quantity = int(float(str(val).replace(',', '.')))
-                            except:
-                                pass
-                    
-                    if quantity > 0:
-                        record = {
-                            'detail_code': state['detail_code'],
-                            'phase': state['phase'],
-                            'assembly': state['assembly'],
-                            'requirement_month': req_month,
-                            'required_quantity': quantity
-                        }
+                    state['detail_code'] = match.group(1)
+                else:
+                    match = re.search(r'(К\d+\.\d+\.\d+[\.\d]*)', cell_value)
+                    if match:
+                        state['detail_code'] = match.group(0)
+            
+            # Дата
+            elif 'дата' in level_name:
+                if state['detail_code'] and state['phase']:
+                    try:
+                        req_date = datetime.strptime(cell_value.split()[0], '%d.%m.%Y').date()
+                        req_month = req_date.replace(day=1)
+                        
+                        # Количество из колонки "Потребность"
+                        quantity = 0
+                        if quantity_col is not None:
+                            val = df.at[i, quantity_col]
+                            if pd.notna(val) and val != '-':
+                                try:
+                                    quantity = int(float(str(val).replace(',', '.')))
+                                except:
+                                    pass
                         
-                        if phase_filter is None or phase_filter == 'all':
-                            records.append(record)
-                        elif phase_filter in phase_map and state['phase'] == phase_map[phase_filter]:
-                            records.append(record)
-                except (ValueError, AttributeError):
-                    pass
+                        if quantity > 0:
+                            record = {
+                                'detail_code': state['detail_code'],
+                                'phase': state['phase'],
+                                'assembly': state['assembly'],
+                                'requirement_month': req_month,
+                                'required_quantity': quantity
+                            }
+                            
+                            if phase_filter is None or phase_filter == 'all':
+                                records.append(record)
+                            elif phase_filter in phase_map and state['phase'] == phase_map[phase_filter]:
+                                records.append(record)
+                    except (ValueError, AttributeError):
+                        pass
+        
+        return records
     
-    return records
+    return iter_hierarchical_file(filepath, build_matchers, build_records,
+                                  REQUIREMENTS_HEADER_RE, stream)
 
-def parse_materials_file(filepath):
+
+def parse_requirements_file(filepath, phase_filter=None, stream=False):
     """
-    Парсинг файла остатков металла
+    Парсинг файла "Анализ обеспеченности заказов" (Отливка.xlsx)
+    
+    Args:
+        filepath: путь к файлу
+        phase_filter: фильтр по фазе ('ot'|'za'|'dr'|'fr'|'ma'|'all'|None)
+        stream: читать файл чанками через openpyxl read_only
+    """
+    return list(iter_requirements_file(filepath, phase_filter, stream))
+
+
+def iter_materials_file(filepath, stream=True):
+    """
+    Парсинг файла остатков металла (генератор записей)
     
     Ожидаемая структура:
     - Колонки: Материал | Количество(кг)
     
-    Возвращает: список dict с полями:
-        - material_type: тип материала
-        - quantity_kg: количество в кг
+    Файл читается один раз: строка заголовков ищется в первом чанке.
     """
-    df = pd.read_excel(filepath, sheet_name=0, header=None)
+    chunks = read_excel_chunks(filepath, stream)
+    with etl_metrics.stage('read_excel') as timer:
+        df = next(chunks, None)
+        timer['rows'] = 0 if df is None else len(df)
     
     # Ищем заголовки
     header_row = None
-    for i in range(min(20, len(df))):
+    for i in range(min(20, 0 if df is None else len(df))):
         row_str = ' '.join([str(x) for x in df.iloc[i].tolist() if pd.notna(x)])
         if 'Материал' in row_str or 'материал' in row_str.lower():
             header_row = i
@@ -580,41 +629,228 @@ def parse_materials_file(filepath):
     if header_row is None:
         raise ValueError("Не найдена строка с заголовками (должна содержать 'Материал')")
     
-    df = pd.read_excel(filepath, sheet_name=0, header=header_row)
-    
-    records = []
-    for _, row in df.iterrows():
-        if pd.isna(row.get('Материал')):
-            continue
-        
-        material = str(row.get('Материал', '')).strip()
-        quantity = row.get('Количество', 0)
-        
-        # Конвертируем в кг если нужно
-        if 'г' in str(row.get('Единица', '')).lower():
-            quantity = quantity / 1000
+    # Колонки по названию (первое вхождение, как у pd.read_excel(header=...))
+    columns = {}
+    for col, name in enumerate(df.iloc[header_row].tolist()):
+        if pd.notna(name):
+            columns.setdefault(str(name), col)
+    
+    material_col = columns.get('Материал')
+    quantity_col = columns.get('Количество')
+    unit_col = columns.get('Единица')
+    
+    start_row = header_row + 1
+    while df is not None:
+        records = []
+        with etl_metrics.stage('record_building') as timer:
+            for row in df.iloc[start_row:].itertuples(index=False, name=None):
+                material = row[material_col] if material_col is not None else None
+                if pd.isna(material):
+                    continue
+                
+                material = str(material).strip()
+                quantity = row[quantity_col] if quantity_col is not None else 0
+                if pd.isna(quantity):
+                    continue
+                
+                # Конвертируем в кг если нужно
+                unit = row[unit_col] if unit_col is not None else ''
+                if 'г' in str(unit).lower():
+                    quantity = quantity / 1000
+                
+                if material and quantity > 0:
+                    records.append({
+                        'material_type': material,
+                        'quantity_kg': float(quantity)
+                    })
+            timer['rows'] = len(records)
+        yield from records
         
-        if material and quantity > 0:
-            records.append({
-                'material_type': material,
-                'quantity_kg': float(quantity)
-            })
+        with etl_metrics.stage('read_excel') as timer:
+            df = next(chunks, None)
+            timer['rows'] = 0 if df is None else len(df)
+        start_row = 0
+
+
+def parse_materials_file(filepath, stream=False):
+    """
+    Парсинг файла остатков металла
     
-    return records
+    Возвращает: список dict с полями:
+        - material_type: тип материала
+        - quantity_kg: количество в кг
+    """
+    return list(iter_materials_file(filepath, stream))
 
 # ============================================================================
 # ЗАГРУЗКА В БД
 # ============================================================================
 
-def load_requirements(conn, records, source='1C_import'):
-    """Загрузка потребностей в БД"""
+def format_copy_value(value):
+    """Значение в текстовом формате COPY (NULL = \\N, экранирование спецсимволов)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyStream:
+    """Файлоподобный объект для copy_expert: строки кодируются по мере чтения"""
+    
+    def __init__(self, rows):
+        self.lines = ('\t'.join(format_copy_value(v) for v in row) + '\n' for row in rows)
+        self.buffer = ''
+    
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def bulk_replace(cursor, table, columns, rows, where, params):
+    """
+    Замена строк таблицы по условию set-based запросами
+    
+    Строки идут потоком через COPY FROM STDIN во временную таблицу
+    (не пишется в WAL, удаляется при коммите), затем
+    DELETE WHERE + один INSERT ... SELECT из неё.
+    
+    Возвращает: количество вставленных строк
+    """
+    # Только схема временных таблиц сессии: постоянная staging_* не задевается.
+    # DROP - на случай второго вызова в той же транзакции (ON COMMIT DROP ещё не сработал)
+    staging = f"pg_temp.staging_{table}"
+    column_list = ', '.join(columns)
+    
+    cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    cursor.execute(f"""
+        CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+        SELECT {column_list} FROM {table} WITH NO DATA
+    """)
+    cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN", CopyStream(rows))
+    
+    # Одна транзакция: читатели видят либо старые, либо новые данные
+    cursor.execute(f"DELETE FROM {table} WHERE {where}", params)
+    cursor.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+    """)
+    return cursor.rowcount
+
+
+def apply_inventory_delta(cursor, snapshot_date, inserts):
+    """
+    Инкрементальная запись снапшота остатков: пишем только разницу
+    
+    Дата уже загружена - сравнение по ключу (detail_id, phase, warehouse_id)
+    с её снапшотом, пишутся только изменённые и удалённые строки. Новая
+    дата - строки вставляются как есть (без копии предыдущего снапшота),
+    а отчёт считается против предыдущего снапшота (inventory_on).
+    Дубли ключа в inserts суммируются.
+    
+    Возвращает: dict inserted/updated/deleted/unchanged
+    """
+    new = {}
+    for _, detail_id, phase, warehouse_id, quantity in inserts:
+        key = (detail_id, phase, warehouse_id)
+        new[key] = new.get(key, 0) + quantity
+    
+    cursor.execute("""
+        SELECT detail_id, phase, warehouse_id, quantity
+        FROM inventory_snapshots
+        WHERE snapshot_date = %s
+    """, (snapshot_date,))
+    rows = cursor.fetchall()
+    reload = bool(rows)
+    
+    if not reload:
+        # База отчёта - последний снапшот раньше даты, полный или из истории
+        cursor.execute("SELECT latest_inventory_date(%s::date - 1)", (snapshot_date,))
+        previous_date = cursor.fetchone()[0]
+        if previous_date:
+            print(f"Базовый снапшот: {previous_date}")
+            cursor.execute("""
+                SELECT detail_id, phase, warehouse_id, quantity
+                FROM inventory_on(%s)
+            """, (previous_date,))
+            rows = cursor.fetchall()
+    
+    old = {(detail_id, phase, warehouse_id): quantity
+           for detail_id, phase, warehouse_id, quantity in rows}
+    
+    upserts = [(snapshot_date, *key, quantity) for key, quantity in new.items()
+               if old.get(key) != quantity]
+    deletes = [(snapshot_date, *key) for key in old if key not in new]
+    inserted = sum(1 for _, *key, _ in upserts if tuple(key) not in old)
+    stats = {
+        'inserted': inserted,
+        'updated': len(upserts) - inserted,
+        'deleted': len(deletes),
+        'unchanged': len(new) - len(upserts)
+    }
+    
+    if not reload:
+        if new:
+            execute_values(cursor, """
+                INSERT INTO inventory_snapshots (
+                    snapshot_date, detail_id, phase, warehouse_id, quantity
+                )
+                VALUES %s
+            """, [(snapshot_date, *key, quantity) for key, quantity in new.items()], page_size=1000)
+        return stats
+    
+    if deletes:
+        execute_values(cursor, """
+            DELETE FROM inventory_snapshots s
+            USING (VALUES %s) AS d(snapshot_date, detail_id, phase, warehouse_id)
+            WHERE s.snapshot_date = d.snapshot_date
+              AND s.detail_id = d.detail_id
+              AND s.phase = d.phase
+              AND s.warehouse_id = d.warehouse_id
+        """, deletes)
+    
+    if upserts:
+        execute_values(cursor, """
+            INSERT INTO inventory_snapshots (
+                snapshot_date, detail_id, phase, warehouse_id, quantity
+            )
+            VALUES %s
+            ON CONFLICT (snapshot_date, detail_id, phase, warehouse_id)
+            DO UPDATE SET
+                quantity = EXCLUDED.quantity,
+                imported_at = CURRENT_TIMESTAMP
+        """, upserts)
+    
+    return stats
+
+
+def load_requirements(conn, records, source='1C_import', bulk=False):
+    """
+    Загрузка потребностей в БД
+    
+    bulk=True - COPY через временную таблицу вместо execute_batch
+    """
     cursor = conn.cursor()
     
     print(f"\n=== Загрузка detail_requirements ({len(records)} записей) ===")
     
-    # Получаем маппинг деталей по коду
-    cursor.execute("SELECT id, nomenclature_code FROM details")
-    detail_map = {code: detail_id for detail_id, code in cursor.fetchall()}
+    started = time.perf_counter()
+    
+    # Маппинг деталей по коду (кэш справочников)
+    detail_map = reference_data.id_map(conn, 'details', 'nomenclature_code')
     
     # Подготавливаем записи для вставки
     inserts = []
@@ -637,7 +873,18 @@ def load_requirements(conn, records, source='1C_import'):
             source
         ))
     
-    if inserts:
+    etl_metrics.record('db_mapping', time.perf_counter() - started, len(records))
+    started = time.perf_counter()
+    
+    if inserts and bulk:
+        # COPY в staging + замена записей с этим source одним запросом
+        bulk_replace(cursor, 'detail_requirements',
+                     ['detail_id', 'phase', 'requirement_month', 'required_quantity', 'source'],
+                     inserts, "source = %s", (source,))
+        
+        conn.commit()
+        print(f"✅ Загружено: {len(inserts)}, Пропущено: {skipped}")
+    elif inserts:
         # Удаляем старые записи с этим source перед вставкой
         cursor.execute("DELETE FROM detail_requirements WHERE source = %s", (source,))
         
@@ -657,11 +904,37 @@ def load_requirements(conn, records, source='1C_import'):
     else:
         print(f"⚠️  Нет записей для загрузки (пропущено: {skipped})")
     
+    etl_metrics.record('db_insert', time.perf_counter() - started, len(inserts))
     cursor.close()
 
 
-def load_inventory(conn, records, snapshot_date=None):
-    """Загрузка остатков склада в БД"""
+def snapshot_phase(characteristic):
+    """
+    Фаза остатков из характеристики 1С ('Отливка', 'Токарка ...')
+    
+    Как у потребностей: первое слово в нижнем регистре, токарка - это
+    фрезеровка. None - фазы нет в check_phase_snapshot.
+    """
+    words = str(characteristic or '').split()
+    if not words:
+        return None
+    phase = PHASE_ALIASES.get(words[0].lower(), words[0].lower())
+    return phase if phase in SNAPSHOT_PHASES else None
+
+def load_inventory(conn, records, snapshot_date=None, bulk=False, incremental=False,
+                   warehouse_aliases=None, history=False):
+    """
+    Загрузка остатков склада в БД
+    
+    bulk=True - COPY через временную таблицу вместо execute_batch
+    incremental=True - повторная загрузка даты пишет только разницу; новая
+                       дата - вставка, отчёт об изменениях против предыдущего снапшота
+    warehouse_aliases - {подстрока склада 1С: warehouse_name} для WarehouseResolver
+    history=True - только изменившиеся остатки в inventory_history вместо полного снапшота
+    
+    current_inventory обновляется в той же транзакции (если снапшот
+    не старше уже загруженного).
+    """
     cursor = conn.cursor()
     
     if snapshot_date is None:
@@ -670,21 +943,41 @@ def load_inventory(conn, records, snapshot_date=None):
     print(f"\n=== Загрузка inventory_snapshots ({len(records)} записей) ===")
     print(f"Дата снапшота: {snapshot_date}")
     
-    # Получаем маппинги по кодам
-    cursor.execute("SELECT id, nomenclature_code FROM details")
-    detail_map = {code: detail_id for detail_id, code in cursor.fetchall()}
+    started = time.perf_counter()
     
-    cursor.execute("SELECT id, warehouse_name FROM warehouses")
-    warehouse_map = {name: wh_id for wh_id, name in cursor.fetchall()}
+    # Маппинги по кодам (кэш справочников)
+    detail_map = reference_data.id_map(conn, 'details', 'nomenclature_code')
     
-    # Удаляем старые данные за эту дату
-    cursor.execute("DELETE FROM inventory_snapshots WHERE snapshot_date = %s", 
-                   (snapshot_date,))
+    warehouses = WarehouseResolver(
+        [(row['id'], row['warehouse_name'])
+         for row in reference_data.rows(conn, 'warehouses', active=True)],
+        warehouse_aliases
+    )
+    
+    # Секция месяца снапшота (у inventory_snapshots нет DEFAULT-секции)
+    if not history:
+        cursor.execute("SELECT ensure_month_partitions('inventory_snapshots', %s, %s)",
+                       (snapshot_date, snapshot_date))
+    
+    # Удаляем старые данные за эту дату (в bulk режиме - вместе со вставкой,
+    # в incremental - только исчезнувшие строки, в history - не пишем полный снапшот)
+    if not bulk and not incremental and not history:
+        cursor.execute("DELETE FROM inventory_snapshots WHERE snapshot_date = %s", 
+                       (snapshot_date,))
     
     inserts = []
     skipped = 0
+    unknown_phases = Counter()
     
     for rec in records:
+        # Фаза обработки из характеристики 1С
+        phase = snapshot_phase(rec['characteristic'])
+        
+        if not phase:
+            unknown_phases[rec['characteristic']] += 1
+            skipped += 1
+            continue
+        
         # Находим деталь по коду
         detail_id = detail_map.get(rec['detail_code'])
         
@@ -693,25 +986,50 @@ def load_inventory(conn, records, snapshot_date=None):
             skipped += 1
             continue
         
-        # Находим склад (используем частичное совпадение или дефолт)
-        warehouse_id = None
-        for wh_name, wh_id in warehouse_map.items():
-            if wh_name in rec['warehouse'] or rec['warehouse'] in wh_name:
-                warehouse_id = wh_id
-                break
+        # Находим склад (точно, по вхождению, по псевдониму)
+        warehouse_id = warehouses.resolve(rec['warehouse'])
         
         if not warehouse_id:
-            warehouse_id = warehouse_map.get('Склад отливок')
+            skipped += 1
+            continue
         
         inserts.append((
             snapshot_date,
             detail_id,
-            rec['characteristic'],  # Фаза обработки
+            phase,
             warehouse_id,
             rec['quantity']
         ))
     
-    if inserts:
+    for characteristic, count in unknown_phases.most_common():
+        print(f"⚠️  Неизвестная фаза: {characteristic} ({count} строк)")
+    warehouses.report()
+    etl_metrics.record('db_mapping', time.perf_counter() - started, len(records))
+    started = time.perf_counter()
+    
+    if inserts and history:
+        stats = inventory_history.record_snapshot(cursor, snapshot_date, inserts)
+        
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot_date,))
+        conn.commit()
+        print(f"✅ История: изменилось {stats['changed']}, без изменений {stats['unchanged']}, "
+              f"версий записано {stats['versions']}, Пропущено: {skipped}")
+    elif inserts and incremental:
+        delta = apply_inventory_delta(cursor, snapshot_date, inserts)
+        
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot_date,))
+        conn.commit()
+        print(f"✅ Дельта: добавлено {delta['inserted']}, изменено {delta['updated']}, "
+              f"удалено {delta['deleted']}, без изменений {delta['unchanged']}, Пропущено: {skipped}")
+    elif inserts and bulk:
+        bulk_replace(cursor, 'inventory_snapshots',
+                     ['snapshot_date', 'detail_id', 'phase', 'warehouse_id', 'quantity'],
+                     inserts, "snapshot_date = %s", (snapshot_date,))
+        
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot_date,))
+        conn.commit()
+        print(f"✅ Загружено: {len(inserts)}, Пропущено: {skipped}")
+    elif inserts:
         execute_batch(cursor, """
             INSERT INTO inventory_snapshots (
                 snapshot_date, detail_id, phase, warehouse_id, quantity
@@ -719,11 +1037,13 @@ def load_inventory(conn, records, snapshot_date=None):
             VALUES (%s, %s, %s, %s, %s)
         """, inserts)
         
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot_date,))
         conn.commit()
         print(f"✅ Загружено: {len(inserts)}, Пропущено: {skipped}")
     else:
         print(f"⚠️  Нет записей для загрузки (пропущено: {skipped})")
     
+    etl_metrics.record('db_insert', time.perf_counter() - started, len(inserts))
     cursor.close()
 
 def load_materials(conn, records, snapshot_date=None):
@@ -735,6 +1055,7 @@ def load_materials(conn, records, snapshot_date=None):
     
     print(f"\n=== Загрузка material_inventory_snapshots ({len(records)} записей) ===")
     print(f"Дата снапшота: {snapshot_date}")
+    started = time.perf_counter()
     
     # Удаляем старые данные за эту дату
     cursor.execute("DELETE FROM material_inventory_snapshots WHERE snapshot_date = %s", 
@@ -753,6 +1074,7 @@ def load_materials(conn, records, snapshot_date=None):
         
         conn.commit()
     
+    etl_metrics.record('db_insert', time.perf_counter() - started, len(inserts))
     print(f"✅ Загружено: {len(inserts)}")
 
 # ============================================================================
@@ -770,6 +1092,114 @@ def connect_db(connection_string):
         print(f"❌ Ошибка подключения: {e}")
         sys.exit(1)
 
+def parse_with_cache(args, filepath, params, parse_func, *parse_args, **parse_kwargs):
+    """Парсинг через кэш, если задан --cache-dir"""
+    if not args.cache_dir:
+        return parse_func(*parse_args, **parse_kwargs)
+    
+    return cached_parse(args.cache_dir, filepath, params, PARSER_VERSION,
+                        parse_func, *parse_args,
+                        max_bytes=args.cache_size_mb * 1024 * 1024, **parse_kwargs)
+
+def connect_pool(connection_string, size):
+    """Пул подключений к БД для параллельной загрузки"""
+    try:
+        pool = ThreadedConnectionPool(1, size, connection_string)
+        print(f"✅ Подключено к БД (пул: {size})")
+        return pool
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def expand_paths(value):
+    """Файл, каталог (все .xls/.xlsx) или glob -> отсортированный список файлов"""
+    path = Path(value)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir()
+                      if p.suffix.lower() in ('.xls', '.xlsx') and not p.name.startswith('~$'))
+    if any(c in value for c in '*?['):
+        return sorted(Path(p) for p in glob.glob(value))
+    return [path]
+
+def file_snapshot_date(filepath):
+    """Дата из имени файла (2025-11-15 или 15.11.2025) или None"""
+    match = re.search(r'\d{4}-\d{2}-\d{2}', filepath.name)
+    if match:
+        return datetime.strptime(match.group(0), '%Y-%m-%d').date()
+    match = re.search(r'\d{2}\.\d{2}\.\d{4}', filepath.name)
+    if match:
+        return datetime.strptime(match.group(0), '%d.%m.%Y').date()
+    return None
+
+def parse_job(job, args):
+    """
+    Парсинг одного файла (выполняется в процессе пула)
+    
+    Возвращает: (записи, время парсинга в секундах, замеры этапов)
+    """
+    etl_metrics.VERBOSITY = args.verbose
+    with etl_metrics.labels(file=job['path'].name, kind=job['kind']):
+        records, seconds = parse_file(job, args)
+    return records, seconds, etl_metrics.collect()
+
+def parse_file(job, args):
+    """Парсинг файла по типу задания: (записи, время в секундах)"""
+    started = time.perf_counter()
+    
+    if job['kind'] == 'inventory':
+        print(f"\n📄 Парсинг файла остатков: {job['path']}")
+        snapshot_date = job['snapshot_date']
+        records = parse_with_cache(args, job['path'], ('inventory', snapshot_date),
+                                   parse_inventory_file, job['path'], snapshot_date, stream=args.stream)
+    elif job['kind'] == 'requirements':
+        print(f"\n📄 Парсинг файла потребностей: {job['path']}")
+        if args.phase:
+            print(f"   Фильтр по фазе: {args.phase}")
+        records = parse_with_cache(args, job['path'], ('requirements', args.phase),
+                                   parse_requirements_file, job['path'], args.phase, stream=args.stream)
+    else:
+        print(f"\n📄 Парсинг файла металла: {job['path']}")
+        records = parse_with_cache(args, job['path'], ('materials',),
+                                   parse_materials_file, job['path'], stream=args.stream)
+    
+    print(f"\n✅ Распознано записей: {len(records)} ({job['path'].name})")
+    return records, time.perf_counter() - started
+
+def load_job(pool, job, records, args):
+    """Загрузка записей одного файла в своей транзакции (подключение из пула)"""
+    started = time.perf_counter()
+    conn = pool.getconn()
+    try:
+        with etl_metrics.labels(file=job['path'].name, kind=job['kind']):
+            if job['kind'] == 'inventory':
+                load_inventory(conn, records, job['snapshot_date'], bulk=args.bulk,
+                               incremental=args.incremental,
+                               warehouse_aliases=parse_aliases(args.warehouse_alias),
+                               history=args.history)
+            elif job['kind'] == 'requirements':
+                load_requirements(conn, records, bulk=args.bulk)
+            else:
+                load_materials(conn, records, job['snapshot_date'])
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+    return time.perf_counter() - started
+
+def load_sequence(pool, items, args):
+    """Загрузка [(job, записи)] по порядку, возвращает время по каждому"""
+    return [load_job(pool, job, records, args) for job, records in items]
+
+def print_summary(jobs):
+    """Сводка по файлам: записи, время парсинга и загрузки"""
+    print(f"\n📊 Сводка по файлам:")
+    print(f"   {'Тип':<13} {'Файл':<40} {'Записей':>8} {'Парсинг,с':>10} {'Загрузка,с':>11}  Статус")
+    for job in jobs:
+        load_seconds = f"{job['load_seconds']:.2f}" if job.get('load_seconds') is not None else '-'
+        print(f"   {job['kind']:<13} {job['path'].name[:40]:<40} {job.get('records', 0):>8} "
+              f"{job.get('parse_seconds', 0):>10.2f} {load_seconds:>11}  {job.get('status', 'ok')}")
+
 def main():
     parser = argparse.ArgumentParser(
         description='ETL скрипт для импорта данных из 1С в БД',
@@ -785,30 +1215,72 @@ def main():
   
   # Импорт остатков металла
   python etl_1c.py -c "postgresql://..." --materials металл.xlsx
+  
+  # Большая выгрузка: потоковое чтение без загрузки всего файла в память
+  python etl_1c.py -c "postgresql://..." --inventory остатки.xlsx --stream
+  
+  # Потребности на 9 месяцев через COPY
+  python etl_1c.py -c "postgresql://..." --requirements отливка.xlsx --bulk
+  
+  # Остатки: только изменения с прошлой выгрузки
+  python etl_1c.py -c "postgresql://..." --inventory остатки.xlsx --incremental
+  
+  # Повторные запуски по тому же файлу - без повторного парсинга
+  python etl_1c.py -c "postgresql://..." --requirements отливка.xlsx --cache-dir ~/.cache/etl_1c
+  
+  # Догрузка за месяц: все файлы каталога, дата снапшота из имени файла
+  python etl_1c.py -c "postgresql://..." --inventory "остатки/2025-11-*.xlsx" -j 4
+  
+  # Замеры этапов для Prometheus node_exporter (textfile collector)
+  python etl_1c.py -c "postgresql://..." --inventory остатки.xlsx --metrics /var/lib/node_exporter/etl_1c.prom
         """
     )
     
     parser.add_argument('--connection', '-c',
                        help='Connection string (или DATABASE_URL)')
     parser.add_argument('--requirements', '-r',
-                       help='Файл с потребностями (Отливка.xlsx)')
+                       help='Файл с потребностями (Отливка.xlsx), каталог или glob')
     parser.add_argument('--phase', '-p',
                        choices=['ot', 'za', 'dr', 'fr', 'ma', 'all'],
                        help='Фильтр по фазе: ot=отливка, za=зачистка, dr=дробеструй, fr=фрезер, ma=материал, all=все')
     parser.add_argument('--inventory', '-i',
-                       help='Файл с остатками склада')
+                       help='Файл с остатками склада, каталог или glob')
     parser.add_argument('--materials', '-m',
-                       help='Файл с остатками металла')
+                       help='Файл с остатками металла, каталог или glob')
     parser.add_argument('--date', '-d',
-                       help='Дата снапшота (YYYY-MM-DD), по умолчанию - сегодня')
+                       help='Дата снапшота (YYYY-MM-DD), если её нет в имени файла; по умолчанию - сегодня')
     parser.add_argument('--dry-run', action='store_true',
                        help='Парсинг без загрузки в БД')
+    parser.add_argument('--stream', action='store_true',
+                       help='Потоковое чтение Excel (openpyxl read_only) для больших выгрузок')
+    parser.add_argument('--bulk', action='store_true',
+                       help='Загрузка через COPY во временную таблицу (быстрее для больших объёмов)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Остатки: повторная загрузка даты - только изменения, отчёт против предыдущего снапшота')
+    parser.add_argument('--history', action='store_true',
+                       help='Остатки: вместо полного снапшота - только изменившиеся остатки в inventory_history')
+    parser.add_argument('--warehouse-alias', action='append', metavar='ПСЕВДОНИМ=СКЛАД',
+                       help='Склад для строк 1С, содержащих псевдоним (можно несколько раз)')
+    parser.add_argument('--cache-dir',
+                       help='Каталог кэша распознанных записей (повторный импорт того же файла без парсинга)')
+    parser.add_argument('--cache-size-mb', type=int, default=512,
+                       help='Максимальный размер кэша, МБ (по умолчанию 512)')
+    parser.add_argument('--workers', '-j', type=int, default=os.cpu_count(),
+                       help='Процессов для параллельного парсинга (по умолчанию - число CPU)')
+    parser.add_argument('--db-connections', type=int, default=2,
+                       help='Подключений к БД для параллельной загрузки (по умолчанию 2)')
+    parser.add_argument('--verbose', '-v', action='count', default=0,
+                       help='Подробный лог (-vv - построчный лог разбора иерархии)')
+    parser.add_argument('--metrics', metavar='PATH',
+                       help='Файл замеров этапов: *.prom - textfile для Prometheus, иначе JSON lines')
     
     args = parser.parse_args()
     
     # Проверка параметров
     if not any([args.requirements, args.inventory, args.materials]):
         parser.error("Укажи хотя бы один файл для импорта")
+    if args.history and (args.incremental or args.bulk):
+        parser.error("--history не совмещается с --incremental / --bulk")
     
     # Connection string
     conn_string = args.connection or os.getenv('DATABASE_URL')
@@ -823,60 +1295,123 @@ def main():
         except ValueError:
             parser.error("Неверный формат даты. Используй YYYY-MM-DD")
     
+    # Список файлов: каждый аргумент - файл, каталог или glob
+    jobs = []
+    for kind, value in [('inventory', args.inventory),
+                        ('requirements', args.requirements),
+                        ('materials', args.materials)]:
+        if not value:
+            continue
+        paths = expand_paths(value)
+        if not paths:
+            print(f"❌ Файлы не найдены: {value}")
+            sys.exit(1)
+        for filepath in paths:
+            if not filepath.exists():
+                print(f"❌ Файл не найден: {filepath}")
+                sys.exit(1)
+            jobs.append({
+                'kind': kind,
+                'path': filepath,
+                'snapshot_date': file_snapshot_date(filepath) or snapshot_date or date.today()
+            })
+    
+    # Снапшот за дату заменяется целиком (DELETE + INSERT), поэтому два
+    # файла одного типа на одну дату - ошибка до загрузки: параллельно
+    # они упадут или смешаются, по очереди - второй затрёт первый
+    by_date = {}
+    for job in jobs:
+        if job['kind'] != 'requirements':
+            by_date.setdefault((job['kind'], job['snapshot_date']), []).append(job['path'].name)
+    duplicates = [f"{kind} {day}: {', '.join(names)}"
+                  for (kind, day), names in sorted(by_date.items()) if len(names) > 1]
+    if duplicates:
+        parser.error("Несколько файлов на одну дату снапшота (дата из имени файла, --date "
+                     "или сегодня):\n  " + "\n  ".join(duplicates))
+    
     print("=" * 70)
     print("ETL: ИМПОРТ ДАННЫХ ИЗ 1С")
     print("=" * 70)
     
     # Подключение к БД
-    conn = None
+    pool = None
     if not args.dry_run:
-        conn = connect_db(conn_string)
+        pool = connect_pool(conn_string, max(1, args.db_connections))
+    
+    workers = max(1, min(args.workers or 1, len(jobs)))
+    parse_executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    load_executor = ThreadPoolExecutor(max(1, args.db_connections)) if pool else None
     
     try:
-        # Импорт остатков на складах
-        if args.inventory:
-            filepath = Path(args.inventory)
-            if not filepath.exists():
-                print(f"❌ Файл не найден: {filepath}")
-                sys.exit(1)
-            
-            print(f"\n📄 Парсинг файла остатков: {filepath}")
-            records = parse_inventory_file(filepath)
-            print(f"\n✅ Распознано записей: {len(records)}")
-            
-            if records and not args.dry_run:
-                load_inventory(conn, records)
+        # 1. Парсинг: файлы параллельно в процессах (Excel - CPU-bound)
+        if parse_executor:
+            futures = [parse_executor.submit(parse_job, job, args) for job in jobs]
+            results = [future.result() for future in futures]
+        else:
+            results = [parse_job(job, args) for job in jobs]
         
-        # Импорт потребностей
-        if args.requirements:
-            filepath = Path(args.requirements)
-            if not filepath.exists():
-                print(f"❌ Файл не найден: {filepath}")
-                sys.exit(1)
+        for job, (records, parse_seconds, entries) in zip(jobs, results):
+            job['records'] = len(records)
+            job['parse_seconds'] = parse_seconds
+            etl_metrics.extend(entries)
+        
+        # 2. Загрузка: каждый файл в своей транзакции через пул подключений.
+        # Потребности всех файлов грузятся одним вызовом (замена по source),
+        # инкрементальные остатки - по порядку дат (база = предыдущий снапшот).
+        # Даты остатков и металла уникальны (проверено выше) - файлы не
+        # пересекаются и грузятся параллельно
+        if pool:
+            requirements = [(job, records) for job, (records, _, _) in zip(jobs, results)
+                            if job['kind'] == 'requirements']
+            others = [(job, records) for job, (records, _, _) in zip(jobs, results)
+                      if job['kind'] != 'requirements' and records]
             
-            phase_filter = args.phase if hasattr(args, 'phase') else None
-            print(f"\n📄 Парсинг файла потребностей: {filepath}")
-            if phase_filter:
-                print(f"   Фильтр по фазе: {phase_filter}")
-            records = parse_requirements_file(filepath, phase_filter)
-            print(f"\n✅ Распознано записей: {len(records)}")
+            # Группа = (файлы для сводки, [(job, записи)] грузятся по порядку)
+            groups = []
+            if args.incremental or args.history:
+                inventory = sorted([item for item in others if item[0]['kind'] == 'inventory'],
+                                   key=lambda item: item[0]['snapshot_date'])
+                others = [item for item in others if item[0]['kind'] != 'inventory']
+                if inventory:
+                    groups.append(([job for job, _ in inventory], inventory))
             
-            if records and not args.dry_run:
-                load_requirements(conn, records)
-        
-        # Импорт остатков металла
-        if args.materials:
-            filepath = Path(args.materials)
-            if not filepath.exists():
-                print(f"❌ Файл не найден: {filepath}")
-                sys.exit(1)
+            groups.extend(([job], [(job, records)]) for job, records in others)
             
-            print(f"\n📄 Парсинг файла металла: {filepath}")
-            records = parse_materials_file(filepath)
-            print(f"  Распознано записей: {len(records)}")
+            requirement_records = [rec for _, records in requirements for rec in records]
+            if requirement_records:
+                groups.append(([job for job, _ in requirements],
+                               [(requirements[0][0], requirement_records)]))
             
-            if records and not args.dry_run:
-                load_materials(conn, records, snapshot_date)
+            load_futures = [(group, load_executor.submit(load_sequence, pool, items, args))
+                            for group, items in groups]
+            
+            failed = False
+            for group, future in load_futures:
+                try:
+                    load_seconds = future.result()
+                except Exception as e:
+                    failed = True
+                    for job in group:
+                        job['status'] = f"ошибка: {e}"
+                    print(f"\n❌ ОШИБКА загрузки ({', '.join(job['path'].name for job in group)}): {e}")
+                    continue
+                
+                # Потребности из нескольких файлов - одна загрузка на всех
+                if len(load_seconds) != len(group):
+                    load_seconds = load_seconds * len(group)
+                for job, seconds in zip(group, load_seconds):
+                    job['load_seconds'] = seconds
+        
+        print_summary(jobs)
+        
+        entries = etl_metrics.collect(reset=False)
+        etl_metrics.print_summary(entries)
+        if args.metrics:
+            etl_metrics.write_metrics(args.metrics, entries)
+            print(f"📊 Замеры этапов: {args.metrics}")
+        
+        if pool and failed:
+            sys.exit(1)
         
         print("\n" + "=" * 70)
         if args.dry_run:
@@ -886,15 +1421,17 @@ def main():
         print("=" * 70)
         
     except Exception as e:
-        if conn:
-            conn.rollback()
         print(f"\n❌ ОШИБКА: {e}")
         import traceback
         traceback.print_exc()
         sys.exit(1)
     finally:
-        if conn:
-            conn.close()
+        if parse_executor:
+            parse_executor.shutdown()
+        if load_executor:
+            load_executor.shutdown()
+        if pool:
+            pool.closeall()
 
 if __name__ == '__main__':
     main()
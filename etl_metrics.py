@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Замеры этапов ETL: время, строки/сек, пиковая память
+
+Этапы (read_excel, header_detection, classification, record_building,
+db_mapping, db_insert) пишутся в общий список процесса с метками
+текущего файла. Результат - JSON lines или textfile для Prometheus
+node_exporter (по расширению .prom).
+
+Использование:
+    with etl_metrics.labels(file='остатки.xlsx', kind='inventory'):
+        with etl_metrics.stage('classification') as timer:
+            ...
+            timer['rows'] = len(rows)
+
+Подробность логов: VERBOSITY (0 - по умолчанию, 2 - построчный лог парсера).
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Уровень подробности логов (-v в CLI)
+VERBOSITY = 0
+
+STAGES = ['read_excel', 'header_detection', 'classification', 'record_building',
+          'db_mapping', 'db_insert']
+
+_local = threading.local()
+_lock = threading.Lock()
+_entries = []
+
+def peak_rss_mb():
+    """Пиковый RSS процесса, МБ (None если недоступно)"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@contextmanager
+def labels(**values):
+    """Метки (файл, тип) для всех этапов внутри блока, на поток"""
+    previous = getattr(_local, 'labels', {})
+    _local.labels = {**previous, **values}
+    try:
+        yield
+    finally:
+        _local.labels = previous
+
+def record(name, seconds, rows=0):
+    """Запись замера этапа"""
+    entry = {
+        **getattr(_local, 'labels', {}),
+        'stage': name,
+        'seconds': seconds,
+        'rows': rows,
+        'peak_rss_mb': peak_rss_mb()
+    }
+    with _lock:
+        _entries.append(entry)
+
+@contextmanager
+def stage(name, rows=0):
+    """Таймер этапа; количество строк можно задать через timer['rows']"""
+    timer = {'rows': rows}
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        record(name, time.perf_counter() - started, timer['rows'])
+
+def collect(reset=True):
+    """Замеры процесса (для передачи из процесса пула в основной)"""
+    with _lock:
+        entries = list(_entries)
+        if reset:
+            _entries.clear()
+    return entries
+
+def extend(entries):
+    """Добавление замеров, полученных из другого процесса"""
+    with _lock:
+        _entries.extend(entries)
+
+def summarize(entries, keys=('file', 'kind')):
+    """Сумма по (метки, этап): секунды и строки, максимум памяти, строк/сек"""
+    totals = {}
+    for entry in entries:
+        key = tuple(entry.get(k) for k in keys) + (entry['stage'],)
+        total = totals.setdefault(key, {
+            **{k: entry.get(k) for k in keys},
+            'stage': entry['stage'], 'seconds': 0.0, 'rows': 0, 'peak_rss_mb': None
+        })
+        total['seconds'] += entry['seconds']
+        total['rows'] += entry['rows']
+        if entry['peak_rss_mb'] is not None:
+            total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, entry['peak_rss_mb'])
+    
+    order = {name: i for i, name in enumerate(STAGES)}
+    result = sorted(totals.values(), key=lambda t: (
+        tuple(str(t[k]) for k in keys), order.get(t['stage'], len(order))))
+    for total in result:
+        total['rows_per_sec'] = total['rows'] / total['seconds'] if total['seconds'] > 0 else None
+    return result
+
+def print_summary(entries):
+    """Таблица этапов по типам файлов"""
+    print(f"\n⏱️  Этапы:")
+    print(f"   {'Тип':<13} {'Этап':<17} {'Секунд':>8} {'Строк':>9} {'Строк/с':>10} {'RSS, МБ':>8}")
+    for total in summarize(entries, keys=('kind',)):
+        rate = f"{total['rows_per_sec']:.0f}" if total['rows_per_sec'] else '-'
+        rss = f"{total['peak_rss_mb']:.0f}" if total['peak_rss_mb'] is not None else '-'
+        print(f"   {str(total['kind']):<13} {total['stage']:<17} {total['seconds']:>8.3f} "
+              f"{total['rows']:>9} {rate:>10} {rss:>8}")
+
+def prometheus_label(value):
+    """Экранирование значения метки Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def write_metrics(path, entries):
+    """
+    Запись замеров: *.prom - textfile для Prometheus (перезапись),
+    иначе - JSON lines (дописывание, одна строка на файл+этап)
+    """
+    path = Path(path)
+    totals = summarize(entries)
+    
+    if path.suffix == '.prom':
+        metrics = [
+            ('etl_1c_stage_seconds', 'seconds', 'Время этапа ETL, с', 1),
+            ('etl_1c_stage_rows', 'rows', 'Строк обработано на этапе', 1),
+            ('etl_1c_stage_rows_per_second', 'rows_per_sec', 'Пропускная способность этапа, строк/с', 1),
+            ('etl_1c_stage_peak_rss_bytes', 'peak_rss_mb', 'Пиковый RSS процесса после этапа, байт', 1024 * 1024),
+        ]
+        lines = []
+        for name, field, help_text, scale in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for total in totals:
+                if total[field] is None:
+                    continue
+                label_text = ','.join(f'{k}="{prometheus_label(total[k])}"'
+                                      for k in ('file', 'kind', 'stage'))
+                lines.append(f"{name}{{{label_text}}} {total[field] * scale}")
+        
+        # Атомарно: node_exporter не должен прочитать файл наполовину
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        tmp_path.replace(path)
+        return
+    
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    with open(path, 'a', encoding='utf-8') as f:
+        for total in totals:
+            f.write(json.dumps({'ts': timestamp, **total}, ensure_ascii=False) + '\n')
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Расписание фаз после отливки (flow shop): зачистка → дробеструй → фрезеровка → покраска
+
+Отливка из tentative_production_plan (расписание форм или нетто-расчёт)
+раскладывается по рабочим дням и протягивается по цепочке: выпуск фазы
+за день поступает на следующую фазу на следующий рабочий день. Остатки
+снапшота на фазе - поступление на следующую фазу в первый день.
+
+Каждый день на каждой фазе очередь деталей раскладывается по
+параллельным машинам фазы списочным алгоритмом LPT: партии от самой
+длинной (в сменах на лучшей машине) к короткой, каждая - на наименее
+загруженную машину, где деталь делается; что не влезло в смену, идёт
+на следующую машину или остаётся в очереди на завтра. Через фазу
+проходит не больше её нетто-выпуска на горизонт (mrp_netting).
+Фаза без машин (или операция, которой у детали нет) пропускается.
+
+Результат - строки на (машина, день, деталь) в tentative_production_plan
+(status='heuristic') вместо строк этих фаз нетто-расчёта, и сводка
+загрузки по фазам с узким местом.
+
+Использование:
+    python flow_shop_scheduler.py --connection "postgresql://..."
+    python flow_shop_scheduler.py --date 2025-12-01 --dry-run
+"""
+
+import argparse
+import sys
+import os
+import time
+from datetime import datetime, date
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import capacity_model
+import mrp_netting
+from casting_scheduler import CASTING_PHASE
+from planning_common import (horizon, working_days, spread_quantity, machine_states, HORIZON_MONTHS,
+                             ACTIVE_STATUSES, UNAVAILABLE_STATES, REFINED_NOTES)
+
+# Фазы после отливки, по порядку
+FLOW_PHASES = mrp_netting.PHASES[mrp_netting.PHASE_INDEX[CASTING_PHASE] + 1:]
+
+# Метка строк плана, записанных этим планировщиком
+PLAN_NOTE = 'flow_shop'
+
+# Через сколько рабочих дней выпуск фазы доступен следующей
+PHASE_LAG_DAYS = 1
+
+def casting_supply(conn, detail_ids, days):
+    """
+    Отливка по дням из tentative_production_plan [деталь, день]
+    
+    Количество строки делится поровну по рабочим дням её периода.
+    Уточнённые строки (месяц, неделя) не считаются - они повторяют исходные.
+    """
+    supply = np.zeros((len(detail_ids), len(days)), dtype=np.int64)
+    if not len(days):
+        return supply
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT detail_id, start_date, end_date, quantity_planned
+            FROM tentative_production_plan
+            WHERE operation = %s AND status = ANY(%s)
+              AND end_date >= %s AND start_date <= %s
+              AND COALESCE(notes, '') <> ALL(%s)
+        """, (CASTING_PHASE, ACTIVE_STATUSES, days[0].item(), days[-1].item(), REFINED_NOTES))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    detail_pos = {detail_id: d for d, detail_id in enumerate(detail_ids.tolist())}
+    for detail_id, start_date, end_date, quantity in rows:
+        d = detail_pos.get(detail_id)
+        period, shares = spread_quantity(quantity, start_date, end_date)
+        if d is None or not len(period):
+            continue
+        inside = np.isin(period, days)
+        np.add.at(supply[d], np.searchsorted(days, period[inside]), shares[inside])
+    return supply
+
+def schedule_day(queue, pieces, machines, history=None):
+    """
+    LPT на один день фазы
+    
+    Args:
+        queue: штук в очереди по деталям [деталь]
+        pieces: штук за смену [машина фазы, деталь]
+        machines: id машин фазы (ось 0 pieces)
+        history: загрузка машин за прошлые дни - при равной загрузке
+            дня партия идёт на менее загруженную за горизонт машину
+    
+    Возвращает: (обработано [машина, деталь], загрузка машин в долях смены)
+    """
+    done = np.zeros(pieces.shape, dtype=np.int64)
+    load = np.zeros(len(machines))
+    if not len(machines):
+        return done, load
+    
+    # Длительность партии - смен на лучшей машине
+    best = pieces.max(axis=0)
+    if history is None:
+        history = np.zeros(len(machines))
+    lots = np.nonzero((queue > 0) & (best > 0))[0]
+    lots = lots[np.argsort(-(queue[lots] / best[lots]), kind='stable')]
+    
+    for d in lots.tolist():
+        quantity = int(queue[d])
+        for m in np.lexsort((history, load)).tolist():
+            if quantity <= 0:
+                break
+            if pieces[m, d] <= 0 or load[m] >= 1.0:
+                continue
+            portion = min(quantity, int((1.0 - load[m]) * pieces[m, d]))
+            if portion <= 0:
+                continue
+            done[m, d] += portion
+            load[m] += portion / pieces[m, d]
+            quantity -= portion
+    return done, load
+
+def build_flow(conn, start_date, months=HORIZON_MONTHS, sources=None):
+    """
+    Протягивание отливки по фазам
+    
+    Возвращает: dict с полями
+        days, detail_ids: оси времени и деталей
+        phases: {фаза: {'machines': [...], 'done': [машина, деталь, день],
+                        'load': [машина, день], 'queue': [деталь, день]}}
+    """
+    start_month, end_month = horizon(start_date, months)
+    inputs = mrp_netting.load_inputs(conn, start_date, months, sources)
+    output = mrp_netting.net_requirements(inputs['requirements'], inputs['inventory'])
+    detail_ids = inputs['detail_ids']
+    days = working_days(start_date, end_month)
+    
+    model = capacity_model.get_model(conn)
+    states = machine_states(conn, start_date)
+    columns = np.array([model.detail_index.get(detail_id, -1) for detail_id in detail_ids.tolist()])
+    
+    # Поступление на первую фазу: отливка по дням + остаток отливки снапшота
+    arrivals = casting_supply(conn, detail_ids, days)
+    if len(days):
+        arrivals[:, 0] += inputs['inventory'][:, mrp_netting.PHASE_INDEX[CASTING_PHASE]]
+    
+    phases = {}
+    for phase in FLOW_PHASES:
+        p = mrp_netting.PHASE_INDEX[phase]
+        positions = [m for m in np.nonzero(model.machine_phase == phase)[0].tolist()
+                     if model.machine_active[m]
+                     and states.get(int(model.machine_ids[m])) not in UNAVAILABLE_STATES]
+        machines = [int(model.machine_ids[m]) for m in positions]
+        pieces = np.zeros((len(machines), len(detail_ids)), dtype=np.int64)
+        known = columns >= 0
+        if machines:
+            pieces[:, known] = model.pieces[np.ix_(positions, columns[known])]
+        
+        # Сколько деталей должно пройти фазу за горизонт; без операции - транзит
+        limit = output[:, p, :].sum(axis=1)
+        transit = ~inputs['operations'][:, p] | (pieces.max(axis=0, initial=0) <= 0)
+        
+        done = np.zeros((len(machines), len(detail_ids), len(days)), dtype=np.int64)
+        load = np.zeros((len(machines), len(days)))
+        queue = np.zeros((len(detail_ids), len(days)), dtype=np.int64)
+        passed = np.zeros((len(detail_ids), len(days)), dtype=np.int64)
+        waiting = np.zeros(len(detail_ids), dtype=np.int64)
+        processed = np.zeros(len(detail_ids), dtype=np.int64)
+        
+        for t in range(len(days)):
+            waiting += arrivals[:, t]
+            passed[transit, t] = waiting[transit]
+            waiting[transit] = 0
+            # Сверх нетто-выпуска фазы не обрабатываем
+            ready = np.minimum(waiting, np.maximum(limit - processed, 0))
+            ready[transit] = 0
+            done[:, :, t], load[:, t] = schedule_day(ready, pieces, machines, load[:, :t].sum(axis=1))
+            passed[:, t] += done[:, :, t].sum(axis=0)
+            waiting -= done[:, :, t].sum(axis=0)
+            processed += done[:, :, t].sum(axis=0)
+            queue[:, t] = np.minimum(waiting, np.maximum(limit - processed, 0))
+        
+        # Выпуск фазы - поступление на следующую через PHASE_LAG_DAYS
+        arrivals = np.zeros_like(passed)
+        if len(days) > PHASE_LAG_DAYS:
+            arrivals[:, PHASE_LAG_DAYS:] = passed[:, :-PHASE_LAG_DAYS]
+        if len(days):
+            arrivals[:, 0] += inputs['inventory'][:, p]
+        
+        phases[phase] = {'machines': machines, 'done': done, 'load': load, 'queue': queue}
+    
+    return {'days': days, 'detail_ids': detail_ids, 'phases': phases}
+
+def phase_summary(flow):
+    """
+    Загрузка по фазам и узкое место
+    
+    Возвращает: (список {phase, machines, utilization, processed, queue_end, queue_max}, узкая фаза)
+    """
+    summary = []
+    for phase, result in flow['phases'].items():
+        if not result['machines']:
+            continue
+        queue = result['queue'].sum(axis=0)
+        summary.append({
+            'phase': phase,
+            'machines': len(result['machines']),
+            'utilization': float(result['load'].mean()) if result['load'].size else 0.0,
+            'processed': int(result['done'].sum()),
+            'queue_end': int(queue[-1]) if len(queue) else 0,
+            'queue_max': int(queue.max(initial=0))
+        })
+    bottleneck = max(summary, key=lambda row: (row['utilization'], row['queue_max']),
+                     default=None)
+    return summary, bottleneck['phase'] if bottleneck else None
+
+def flow_rows(flow):
+    """Строки tentative_production_plan: (машина, день, деталь)"""
+    rows = []
+    for phase, result in flow['phases'].items():
+        for m, d, t in zip(*np.nonzero(result['done'])):
+            day = flow['days'][t].item()
+            rows.append((
+                int(flow['detail_ids'][d]),
+                phase,
+                result['machines'][m],
+                day,
+                day,
+                int(result['done'][m, d, t]),
+                'heuristic',
+                PLAN_NOTE
+            ))
+    return rows
+
+def write_flow(conn, rows, phases, start_date, end_month):
+    """Замена строк запланированных фаз (нетто-расчёт и прошлый прогон) одной транзакцией"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM tentative_production_plan
+            WHERE operation = ANY(%s) AND notes = ANY(%s)
+              AND end_date >= %s AND start_date < %s
+        """, (phases, [mrp_netting.PLAN_NOTE, PLAN_NOTE], start_date, end_month))
+        deleted = cursor.rowcount
+        
+        if rows:
+            execute_values(cursor, """
+                INSERT INTO tentative_production_plan (
+                    detail_id, operation, machine_id, start_date, end_date,
+                    quantity_planned, status, notes
+                ) VALUES %s
+            """, rows, page_size=1000)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return deleted
+
+def run_flow_shop(conn, start_date=None, months=HORIZON_MONTHS, sources=None, dry_run=False):
+    """
+    Расписание фаз после отливки и запись в tentative_production_plan
+    
+    Возвращает: (flow, узкая фаза)
+    """
+    if start_date is None:
+        start_date = date.today()
+    start_month, end_month = horizon(start_date, months)
+    
+    print(f"\n=== Расписание после отливки: {start_date} - {end_month} ===")
+    
+    started = time.perf_counter()
+    flow = build_flow(conn, start_date, months, sources)
+    summary, bottleneck = phase_summary(flow)
+    print(f"Рабочих дней: {len(flow['days'])} ({time.perf_counter() - started:.2f} с)")
+    
+    print(f"\n📊 Загрузка фаз:")
+    print(f"   {'Фаза':<12} {'Машин':>6} {'Загрузка':>9} {'Обработано':>11} {'Очередь max':>12} {'в конце':>9}")
+    for row in summary:
+        marker = '  ⚠️  узкое место' if row['phase'] == bottleneck else ''
+        print(f"   {row['phase']:<12} {row['machines']:>6} {row['utilization']:>9.0%} "
+              f"{row['processed']:>11} {row['queue_max']:>12} {row['queue_end']:>9}{marker}")
+    skipped = [phase for phase, result in flow['phases'].items() if not result['machines']]
+    if skipped:
+        print(f"⚠️  Нет доступных машин, фаза не планируется: {', '.join(skipped)}")
+    
+    if dry_run:
+        return flow, bottleneck
+    
+    rows = flow_rows(flow)
+    planned = [phase for phase, result in flow['phases'].items() if result['machines']]
+    deleted = write_flow(conn, rows, planned, start_date, end_month)
+    print(f"✅ Строк плана: {len(rows)} (удалено старых: {deleted})")
+    return flow, bottleneck
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Расписание фаз после отливки по параллельным машинам')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Начало горизонта (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--months', type=int, default=HORIZON_MONTHS,
+                       help=f'Горизонт в месяцах (по умолчанию {HORIZON_MONTHS})')
+    parser.add_argument('--source', action='append', choices=mrp_netting.SOURCES,
+                       help='Источник потребностей (можно несколько раз), по умолчанию все')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Расчёт без записи плана в БД')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    start_date = None
+    if args.date:
+        try:
+            start_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        run_flow_shop(conn, start_date, args.months, args.source, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+История остатков без дублей (inventory_history)
+
+inventory_snapshots хранит полную копию остатков на каждую дату, хотя
+за день меняется малая доля ключей (деталь, фаза, склад). Компактный
+режим хранит версии остатка: quantity действует с valid_from до
+valid_to (не включая, NULL - до сих пор). Снапшот за дату закрывает
+версии изменившихся ключей и открывает новые, остальные не трогает.
+
+- record_snapshot() - запись снапшота за дату; даты можно грузить в
+  любом порядке и перезагружать: версии режутся по следующей
+  загруженной дате, соседние версии с тем же остатком склеиваются
+- migrate() - перенос полных снапшотов в историю (с --prune - удаление
+  перенесённых из inventory_snapshots)
+- остатки на любую дату: SELECT * FROM inventory_on('2025-11-12')
+  (schema_final.sql, полный снапшот или восстановление из истории)
+
+Использование:
+    python etl_1c_xls.py --inventory остатки.xlsx --history
+    python inventory_history.py --migrate --prune
+    python inventory_history.py --date 2025-11-12
+    python inventory_history.py                     # размер хранения
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+
+def record_snapshot(cursor, snapshot_date, inserts):
+    """
+    Снапшот за дату в inventory_history (транзакцией вызывающего кода)
+    
+    Args:
+        inserts: [(snapshot_date, detail_id, phase, warehouse_id, quantity)],
+                 дубли ключа суммируются
+    
+    Возвращает: dict changed/unchanged/versions (записано версий)
+    """
+    new = {}
+    for _, detail_id, phase, warehouse_id, quantity in inserts:
+        key = (detail_id, phase, warehouse_id)
+        new[key] = new.get(key, 0) + quantity
+    
+    # Параллельные загрузки пишут историю по очереди
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('inventory_history'))")
+    
+    cursor.execute("SELECT MIN(snapshot_date) FROM inventory_history_dates WHERE snapshot_date > %s",
+                   (snapshot_date,))
+    next_date = cursor.fetchone()[0]
+    
+    def versions(condition, *params):
+        cursor.execute(f"""
+            SELECT detail_id, phase, warehouse_id, quantity, valid_from, valid_to
+            FROM inventory_history
+            WHERE {condition}
+        """, params)
+        return {(detail_id, phase, warehouse_id): (quantity, valid_from, valid_to)
+                for detail_id, phase, warehouse_id, quantity, valid_from, valid_to in cursor.fetchall()}
+    
+    # Версии на дату, закончившиеся в эту дату и начавшиеся в следующую загруженную
+    old = versions("daterange(valid_from, valid_to) @> %s::date", snapshot_date)
+    ended = versions("daterange(valid_from, valid_to) @> %s::date - 1 AND valid_to = %s",
+                     snapshot_date, snapshot_date)
+    following = versions("daterange(valid_from, valid_to) @> %s::date AND valid_from = %s",
+                         next_date, next_date) if next_date else {}
+    
+    changed = [key for key in old.keys() | new.keys()
+               if (old[key][0] if key in old else None) != new.get(key)]
+    
+    deletes, updates, inserted = [], [], []
+    for key in changed:
+        end = next_date
+        if key in old:
+            quantity, valid_from, valid_to = old[key]
+            # Старый остаток снова действует со следующей загруженной даты
+            if next_date is not None and (valid_to is None or valid_to > next_date):
+                inserted.append((*key, quantity, next_date, valid_to))
+            if valid_from < snapshot_date:
+                updates.append((*key, valid_from, snapshot_date))
+            else:
+                deletes.append((*key, valid_from))
+            if valid_to != next_date:
+                following.pop(key, None)
+        
+        if key not in new:
+            continue
+        if key in following and following[key][0] == new[key]:
+            end = following[key][2]
+            deletes.append((*key, next_date))
+        if key in ended and ended[key][0] == new[key]:
+            updates.append((*key, ended[key][1], end))
+        else:
+            inserted.append((*key, new[key], snapshot_date, end))
+    
+    if deletes:
+        execute_values(cursor, """
+            DELETE FROM inventory_history h
+            USING (VALUES %s) AS d(detail_id, phase, warehouse_id, valid_from)
+            WHERE h.detail_id = d.detail_id
+              AND h.phase = d.phase
+              AND h.warehouse_id = d.warehouse_id
+              AND h.valid_from = d.valid_from
+        """, deletes)
+    if updates:
+        execute_values(cursor, """
+            UPDATE inventory_history h
+            SET valid_to = u.valid_to
+            FROM (VALUES %s) AS u(detail_id, phase, warehouse_id, valid_from, valid_to)
+            WHERE h.detail_id = u.detail_id
+              AND h.phase = u.phase
+              AND h.warehouse_id = u.warehouse_id
+              AND h.valid_from = u.valid_from
+        """, updates, template="(%s, %s, %s, %s::date, %s::date)")
+    if inserted:
+        execute_values(cursor, """
+            INSERT INTO inventory_history (
+                detail_id, phase, warehouse_id, quantity, valid_from, valid_to
+            ) VALUES %s
+        """, inserted)
+    cursor.execute("""
+        INSERT INTO inventory_history_dates (snapshot_date) VALUES (%s)
+        ON CONFLICT (snapshot_date) DO UPDATE SET loaded_at = CURRENT_TIMESTAMP
+    """, (snapshot_date,))
+    
+    return {
+        'changed': len(changed),
+        'unchanged': len(new) - sum(1 for key in changed if key in new),
+        'versions': len(inserted)
+    }
+
+def migrate(conn, prune=False):
+    """
+    Перенос полных снапшотов inventory_snapshots в историю, по дате за транзакцию
+    
+    Args:
+        prune: удалить из inventory_snapshots даты, уже перенесённые в историю
+    
+    Возвращает: число перенесённых дат
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT snapshot_date FROM inventory_snapshots
+            EXCEPT
+            SELECT snapshot_date FROM inventory_history_dates
+            ORDER BY 1
+        """)
+        dates = [row[0] for row in cursor.fetchall()]
+        
+        for snapshot_date in dates:
+            cursor.execute("""
+                SELECT snapshot_date, detail_id, phase, warehouse_id, quantity
+                FROM inventory_snapshots
+                WHERE snapshot_date = %s
+            """, (snapshot_date,))
+            stats = record_snapshot(cursor, snapshot_date, cursor.fetchall())
+            conn.commit()
+            print(f"🔁 {snapshot_date}: изменилось {stats['changed']}, без изменений {stats['unchanged']}")
+        
+        if prune:
+            cursor.execute("""
+                DELETE FROM inventory_snapshots s
+                USING inventory_history_dates h
+                WHERE s.snapshot_date = h.snapshot_date
+            """)
+            print(f"✅ Удалено строк полных снапшотов: {cursor.rowcount}")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    print(f"✅ Перенесено дат: {len(dates)}")
+    return len(dates)
+
+def storage_report(conn):
+    """Строки и размер (данные / индексы) полных снапшотов и истории"""
+    cursor = conn.cursor()
+    try:
+        print(f"\n📊 Хранение остатков:")
+        for table in ('inventory_snapshots', 'inventory_history'):
+            cursor.execute("""
+                SELECT COALESCE(SUM(pg_relation_size(r)), 0), COALESCE(SUM(pg_indexes_size(r)), 0)
+                FROM (
+                    SELECT %s::regclass AS r
+                    UNION ALL
+                    SELECT inhrelid::regclass FROM pg_inherits WHERE inhparent = %s::regclass
+                ) relations
+            """, (table, table))
+            data, indexes = cursor.fetchone()
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            rows = cursor.fetchone()[0]
+            print(f"   {table:<20} строк {rows:>10}, данные {data / 1024:>9.0f} КБ, "
+                  f"индексы {indexes / 1024:>9.0f} КБ")
+    finally:
+        cursor.close()
+
+def print_on_date(conn, on_date):
+    """Остатки на дату по фазам (inventory_on)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT phase, MAX(snapshot_date), COUNT(DISTINCT detail_id), SUM(quantity)
+            FROM inventory_on(%s)
+            GROUP BY phase
+            ORDER BY phase
+        """, (on_date,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    if not rows:
+        print(f"⚠️  Нет снапшотов на {on_date}")
+        return
+    print(f"\n📊 Остатки на {on_date} (снапшот {rows[0][1]}):")
+    for phase, _, details, quantity in rows:
+        print(f"   {phase:<12} деталей {details:>4}, штук {quantity:>8}")
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='История остатков без дублей')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--migrate', action='store_true',
+                       help='Перенести полные снапшоты в историю')
+    parser.add_argument('--prune', action='store_true',
+                       help='Удалить из inventory_snapshots даты, перенесённые в историю')
+    parser.add_argument('--date', '-d',
+                       help='Показать остатки на дату (YYYY-MM-DD)')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    try:
+        on_date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    except ValueError:
+        parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        if args.migrate or args.prune:
+            migrate(conn, args.prune)
+        if on_date:
+            print_on_date(conn, on_date)
+        storage_report(conn)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
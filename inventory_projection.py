@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Текущие остатки: последний снапшот 1С + производственные операции после него
+
+Снапшоты приходят из 1С не чаще раза в день, а production_transactions
+пишутся по ходу смены (from_phase → to_phase). Проекция держит в памяти
+массив остатков [деталь, фаза]:
+- старт: current_inventory (последний снапшот), сумма по складам
+- затем операции с transaction_date позже даты снапшота:
+  -quantity на from_phase, +quantity на to_phase (NULL / фаза вне
+  списка - приход или уход из цеха: отгрузка, металл в отливку)
+- refresh() дочитывает операции с id больше последнего просмотренного
+  и пропуски ниже него: id выдаётся при вставке, а строка видна после
+  коммита, поэтому операция с меньшим id может появиться позже.
+  Пропуск перечитывается по первичному ключу, пока не появится; не
+  появился за GAP_TIMEOUT - считается откатом, с предупреждением
+  (если транзакция всё же закоммитится, она не учтётся до нового
+  снапшота). Изменилась current_inventory (новый снапшот или повторная
+  загрузка той же даты, версия из table_versions) - проекция строится
+  заново
+- apply() - операция, только что записанная вызывающим кодом, без запроса
+
+Остаток по (деталь, фаза) - обращение к массиву, без агрегации таблицы.
+
+Использование:
+    projector = inventory_projection.get_projector(conn)
+    projector.quantity(detail_id, 'зачистка')
+    projector.balances     # [деталь, фаза], оси - detail_ids / PHASES
+"""
+
+import argparse
+import sys
+import os
+import time
+import numpy as np
+import psycopg2
+import reference_data
+import current_inventory
+from mrp_netting import PHASES as PLAN_PHASES
+
+# Фазы остатков (как в inventory_snapshots)
+PHASES = PLAN_PHASES + ['брак']
+
+PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+
+# Пропуски id ниже последнего применённого ищутся при построении
+# проекции среди последних LATE_WINDOW id
+LATE_WINDOW = 1000
+
+# Сколько секунд перечитывать пропущенный id, прежде чем считать его
+# откатом (секунды, а не id: долгая транзакция не зависит от потока вставок)
+GAP_TIMEOUT = 3600
+
+# dsn -> InventoryProjector
+_cache = {}
+
+class InventoryProjector:
+    """Остатки [деталь, фаза]: снапшот + операции после него"""
+    
+    def __init__(self, detail_ids):
+        self.detail_ids = np.array(detail_ids, dtype=np.int64)
+        self.detail_index = {detail_id: i for i, detail_id in enumerate(self.detail_ids.tolist())}
+        self.balances = np.zeros((len(self.detail_ids), len(PHASES)), dtype=np.int64)
+        self.snapshot_date = None
+        self.inventory_version = None
+        self.last_transaction_id = 0
+        self.gaps = {}
+        self.expired_gaps = 0
+        self.applied = 0
+    
+    def quantity(self, detail_id, phase):
+        """Текущий остаток детали на фазе (0 - нет данных)"""
+        d = self.detail_index.get(detail_id)
+        p = PHASE_INDEX.get(phase)
+        if d is None or p is None:
+            return 0
+        return int(self.balances[d, p])
+    
+    def apply(self, transaction_id, detail_id, from_phase, to_phase, quantity):
+        """Одна уже записанная операция (refresh() её повторно не применит)"""
+        self.apply_many([(transaction_id, detail_id, from_phase, to_phase, quantity)])
+    
+    def apply_many(self, rows):
+        """
+        Пачка операций: [(id, detail_id, from_phase, to_phase, quantity)]
+        
+        Применяется векторно (np.add.at). Применяются только id больше
+        последнего и id из пропусков - остальные уже учтены.
+        
+        Возвращает: число применённых операций
+        """
+        rows = [row for row in rows if row[0] > self.last_transaction_id or row[0] in self.gaps]
+        if not rows:
+            return 0
+        self.add_rows(rows)
+        self.mark_seen([row[0] for row in rows])
+        return len(rows)
+    
+    def add_rows(self, rows):
+        """Операции в массив остатков, без проверки id"""
+        if not rows:
+            return
+        ids, detail_ids, from_phases, to_phases, quantities = zip(*rows)
+        positions = np.array([self.detail_index.get(detail_id, -1) for detail_id in detail_ids])
+        quantities = np.array(quantities, dtype=np.int64)
+        for phases, sign in ((from_phases, -1), (to_phases, 1)):
+            phase_pos = np.array([PHASE_INDEX.get(phase, -1) for phase in phases])
+            mask = (positions >= 0) & (phase_pos >= 0)
+            np.add.at(self.balances, (positions[mask], phase_pos[mask]), sign * quantities[mask])
+        self.applied += len(rows)
+    
+    def mark_seen(self, ids):
+        """
+        id просмотрены (применены или не относятся к проекции)
+        
+        Закрывает их пропуски; id между последним просмотренным и новым
+        максимумом, которых нет в ids, становятся пропусками.
+        """
+        seen = set(ids)
+        if not seen:
+            return
+        for transaction_id in seen:
+            self.gaps.pop(transaction_id, None)
+        top = max(seen)
+        if top > self.last_transaction_id:
+            now = time.monotonic()
+            for transaction_id in range(self.last_transaction_id + 1, top):
+                if transaction_id not in seen:
+                    self.gaps[transaction_id] = now
+            self.last_transaction_id = top
+    
+    def expire_gaps(self):
+        """Пропуски старше GAP_TIMEOUT: откат, либо операция не учтена до нового снапшота"""
+        low = time.monotonic() - GAP_TIMEOUT
+        expired = sorted(transaction_id for transaction_id, seen_at in self.gaps.items() if seen_at < low)
+        if not expired:
+            return
+        for transaction_id in expired:
+            del self.gaps[transaction_id]
+        self.expired_gaps += len(expired)
+        print(f"⚠️  Операции с id {expired[0]}..{expired[-1]} ({len(expired)} шт) не появились "
+              f"за {GAP_TIMEOUT} с: откат или долгая транзакция - если она закоммитится, "
+              f"проекция разойдётся с операциями до нового снапшота")
+    
+    def load_snapshot(self, conn):
+        """
+        Остатки последнего снапшота (сумма по складам) + операции после него
+        
+        Пропуски - не видимые сейчас id из последних LATE_WINDOW.
+        """
+        self.gaps = {}
+        self.applied = 0
+        self.expired_gaps = 0
+        self.snapshot_date, self.balances = current_inventory.load_array(conn, self.detail_ids, PHASES)
+        
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM production_transactions")
+            top = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT id, detail_id, from_phase, to_phase, quantity
+                FROM production_transactions
+                WHERE id <= %s
+                  AND (%s::date IS NULL OR transaction_date > %s)
+            """, (top, self.snapshot_date, self.snapshot_date))
+            rows = cursor.fetchall()
+            cursor.execute("SELECT id FROM production_transactions WHERE id > %s AND id <= %s",
+                           (top - LATE_WINDOW, top))
+            visible = [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+        
+        self.add_rows(rows)
+        self.last_transaction_id = max(top - LATE_WINDOW, 0)
+        self.mark_seen(visible)
+    
+    def refresh(self, conn):
+        """
+        Дочитать новые операции (или перестроить проекцию по новому снапшоту)
+        
+        Перестраивается при любом изменении current_inventory (версия из
+        table_versions - и повторная загрузка той же даты). Дочитываются
+        id больше последнего и пропуски ниже него: id выдаётся при
+        вставке, а строка видна после коммита. Операции до даты снапшота
+        закрывают пропуск, но не применяются.
+        
+        Возвращает: число применённых операций
+        """
+        cursor = conn.cursor()
+        try:
+            version = reference_data.table_version(cursor, 'current_inventory')
+        finally:
+            cursor.close()
+        if version != self.inventory_version:
+            self.load_snapshot(conn)
+            self.inventory_version = version
+        
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT id, detail_id, from_phase, to_phase, quantity,
+                       %s::date IS NULL OR transaction_date > %s
+                FROM production_transactions
+                WHERE id > %s OR id = ANY(%s)
+                ORDER BY id
+            """, (self.snapshot_date, self.snapshot_date,
+                  self.last_transaction_id, list(self.gaps)))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        
+        applied = self.apply_many([row[:5] for row in rows if row[5]])
+        self.mark_seen([row[0] for row in rows])
+        self.expire_gaps()
+        return applied
+
+def get_projector(conn):
+    """Проекция остатков из кэша процесса, дочитанная до текущих операций"""
+    detail_ids = [row['id'] for row in reference_data.rows(conn, 'details')]
+    projector = _cache.get(conn.dsn)
+    if projector is None or projector.detail_ids.tolist() != detail_ids:
+        projector = InventoryProjector(detail_ids)
+        _cache[conn.dsn] = projector
+    projector.refresh(conn)
+    return projector
+
+def invalidate():
+    """Сброс кэша проекций"""
+    _cache.clear()
+
+def print_projection(projector, details):
+    """Остатки по фазам: всего и по деталям с ненулевым остатком"""
+    codes = {row['id']: row['nomenclature_code'] for row in details}
+    print(f"\n📊 Остатки: снапшот {projector.snapshot_date or '-'} + операций {projector.applied}")
+    if projector.gaps or projector.expired_gaps:
+        print(f"   Ожидается id: {len(projector.gaps)}, сочтено откатом: {projector.expired_gaps}")
+    print(f"   {'Деталь':<16} " + ' '.join(f"{phase[:10]:>10}" for phase in PHASES))
+    for d, detail_id in enumerate(projector.detail_ids.tolist()):
+        if projector.balances[d].any():
+            print(f"   {codes[detail_id][:16]:<16} "
+                  + ' '.join(f"{int(v):>10}" for v in projector.balances[d]))
+    print(f"   {'ВСЕГО':<16} " + ' '.join(f"{int(v):>10}" for v in projector.balances.sum(axis=0)))
+    negative = int((projector.balances < 0).sum())
+    if negative:
+        print(f"⚠️  Отрицательных остатков: {negative} (операции без прихода в снапшоте)")
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Текущие остатки: снапшот + операции после него')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    conn = connect_db(conn_string)
+    try:
+        print_projection(get_projector(conn), reference_data.rows(conn, 'details'))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Нетто-потребности (MRP) по цепочке фаз в памяти
+
+Текущие остатки (current_inventory) и потребности на горизонт загружаются
+в плотные массивы NumPy:
+    inventory[деталь, фаза], requirements[деталь, фаза, месяц]
+
+Каскад от покраски к отливке, для каждой фазы сразу по всем деталям
+и месяцам:
+    спрос = потребность фазы + выпуск следующей фазы
+    выпуск = прирост max(0, накопленный спрос - остаток фазы)
+Деталь на фазе 'фрезеровка' покрывает спрос покраски, но сначала
+уменьшает спрос самой фрезеровки (остаток расходуется с конца цепочки).
+
+Выпуск пишется в tentative_production_plan (status='heuristic') на самую
+производительную машину для (деталь, операция) по capacity_model.
+Операция не планируется, если её у детали нет: покраска при
+requires_painting=false, отливка у покупных (без формы) - спрос всё
+равно передаётся дальше по цепочке.
+
+Использование:
+    python mrp_netting.py --connection "postgresql://..."
+    python mrp_netting.py --date 2025-12-01 --source from_orders --dry-run
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime, date, timedelta
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import reference_data
+import capacity_model
+import current_inventory
+from planning_common import horizon, HORIZON_MONTHS
+
+# Цепочка фаз, по порядку обработки
+PHASES = ['отливка', 'зачистка', 'дробеструй', 'фрезеровка', 'покраска']
+
+PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+
+SOURCES = ['from_orders', '1C_import', 'manual']
+
+# Метка строк плана, записанных нетто-расчётом (для перезаписи только своих строк)
+PLAN_NOTE = 'mrp_netting'
+
+def month_starts(start_month, months):
+    """Первые дни месяцев горизонта"""
+    result = []
+    for offset in range(months):
+        month_index = start_month.month - 1 + offset
+        result.append(date(start_month.year + month_index // 12, month_index % 12 + 1, 1))
+    return result
+
+def load_inputs(conn, start_date=None, months=HORIZON_MONTHS, sources=None):
+    """
+    Массивы для нетто-расчёта
+    
+    Возвращает: dict с полями
+        detail_ids: np.ndarray id деталей (ось 0)
+        months: список первых дней месяцев (ось 2)
+        inventory: текущие остатки (current_inventory) [деталь, фаза]
+        requirements: потребности [деталь, фаза, месяц]
+        operations: есть ли операция у детали [деталь, фаза]
+        snapshot_date: дата снапшота (None если снапшотов нет)
+    """
+    start_month, end_month = horizon(start_date, months)
+    month_list = month_starts(start_month, months)
+    
+    # Выведенные из оборота детали не планируются
+    details = reference_data.rows(conn, 'details', active=True)
+    detail_ids = np.array([row['id'] for row in details], dtype=np.int64)
+    
+    snapshot_date, inventory = current_inventory.load_array(conn, detail_ids, PHASES)
+    requirements = np.zeros((len(detail_ids), len(PHASES), months), dtype=np.int64)
+    
+    operations = np.ones((len(detail_ids), len(PHASES)), dtype=bool)
+    operations[:, PHASE_INDEX['отливка']] = [row['mold_id'] is not None for row in details]
+    operations[:, PHASE_INDEX['покраска']] = [bool(row['requires_painting']) for row in details]
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT detail_id, phase,
+                   (EXTRACT(YEAR FROM requirement_month) * 12 + EXTRACT(MONTH FROM requirement_month))::int,
+                   SUM(required_quantity)
+            FROM detail_requirements
+            WHERE requirement_month >= %s AND requirement_month < %s
+              AND source = ANY(%s)
+              AND detail_id = ANY(%s)
+            GROUP BY 1, 2, 3
+        """, (start_month, end_month, list(sources or SOURCES), detail_ids.tolist()))
+        rows = cursor.fetchall()
+        if rows and len(detail_ids):
+            ids, phases, month_numbers, quantities = zip(*rows)
+            pos = np.searchsorted(detail_ids, ids)
+            phase_pos = [PHASE_INDEX[phase] for phase in phases]
+            month_pos = np.array(month_numbers) - (start_month.year * 12 + start_month.month)
+            np.add.at(requirements, (pos, phase_pos, month_pos), np.array(quantities, dtype=np.int64))
+    finally:
+        cursor.close()
+    
+    return {
+        'detail_ids': detail_ids,
+        'months': month_list,
+        'inventory': inventory,
+        'requirements': requirements,
+        'operations': operations,
+        'snapshot_date': snapshot_date
+    }
+
+def net_requirements(requirements, inventory):
+    """
+    Каскад нетто-потребностей от последней фазы к первой
+    
+    Args:
+        requirements: брутто-потребности [деталь, фаза, месяц]
+        inventory: остатки [деталь, фаза]
+    
+    Возвращает: выпуск [деталь, фаза, месяц] - сколько деталей должно
+    пройти фазу в каждом месяце
+    """
+    output = np.zeros_like(requirements)
+    downstream = np.zeros(requirements[:, 0, :].shape, dtype=requirements.dtype)
+    
+    for phase in reversed(range(requirements.shape[1])):
+        demand = requirements[:, phase, :] + downstream
+        shortage = np.maximum(np.cumsum(demand, axis=1) - inventory[:, phase, None], 0)
+        output[:, phase, :] = np.diff(shortage, axis=1, prepend=0)
+        # Каждая деталь, прошедшая фазу, берётся с предыдущей
+        downstream = output[:, phase, :]
+    
+    return output
+
+def default_machines(conn):
+    """
+    Машина по умолчанию для (деталь, операция)
+    
+    Самая производительная активная машина фазы по модели мощности,
+    без параметров для детали - первая активная машина фазы.
+    
+    Возвращает: {(detail_id, операция): machine_id}
+    """
+    model = capacity_model.get_model(conn)
+    
+    fallback = {}
+    for row in reference_data.rows(conn, 'machines'):
+        if row['status'] == 'active':
+            fallback.setdefault(row['output_phase'], row['id'])
+    
+    machines = {}
+    for detail_id in model.detail_ids.tolist():
+        for phase in PHASES:
+            machine_id = model.best_machine(detail_id, phase) or fallback.get(phase)
+            if machine_id is not None:
+                machines[(detail_id, phase)] = machine_id
+    return machines
+
+def plan_rows(inputs, output, machines, start_date):
+    """
+    Строки tentative_production_plan из массива выпуска
+    
+    Возвращает: (строки, число пропущенных строк без машины)
+    """
+    planned = output * inputs['operations'][:, :, None]
+    detail_pos, phase_pos, month_pos = np.nonzero(planned > 0)
+    
+    rows = []
+    skipped = 0
+    months = inputs['months']
+    for d, p, m in zip(detail_pos, phase_pos, month_pos):
+        detail_id = int(inputs['detail_ids'][d])
+        machine_id = machines.get((detail_id, PHASES[p]))
+        if machine_id is None:
+            skipped += 1
+            continue
+        
+        month_start = months[m]
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        rows.append((
+            detail_id,
+            PHASES[p],
+            machine_id,
+            max(month_start, start_date),
+            next_month - timedelta(days=1),
+            int(planned[d, p, m]),
+            'heuristic',
+            PLAN_NOTE
+        ))
+    return rows, skipped
+
+def write_plan(conn, rows, start_date, end_month):
+    """Замена строк нетто-расчёта на горизонте одной транзакцией"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM tentative_production_plan
+            WHERE notes = %s AND end_date >= %s AND start_date < %s
+        """, (PLAN_NOTE, start_date, end_month))
+        deleted = cursor.rowcount
+        
+        if rows:
+            execute_values(cursor, """
+                INSERT INTO tentative_production_plan (
+                    detail_id, operation, machine_id, start_date, end_date,
+                    quantity_planned, status, notes
+                ) VALUES %s
+            """, rows, page_size=1000)
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return deleted
+
+def run_netting(conn, start_date=None, months=HORIZON_MONTHS, sources=None, dry_run=False):
+    """
+    Нетто-расчёт на горизонт и запись в tentative_production_plan
+    
+    Возвращает: (inputs, output) - массивы для дальнейшего планирования
+    """
+    if start_date is None:
+        start_date = date.today()
+    start_month, end_month = horizon(start_date, months)
+    
+    print(f"\n=== Нетто-потребности: {start_month} - {end_month} ===")
+    
+    inputs = load_inputs(conn, start_date, months, sources)
+    if inputs['snapshot_date'] is None:
+        print("⚠️  Нет снапшотов остатков - считаем от нулевых остатков")
+    else:
+        print(f"Снапшот остатков: {inputs['snapshot_date']}")
+    
+    output = net_requirements(inputs['requirements'], inputs['inventory'])
+    
+    print(f"\n📊 Брутто / выпуск по фазам:")
+    for p, phase in enumerate(PHASES):
+        print(f"   {phase:<12} {int(inputs['requirements'][:, p, :].sum()):>10} "
+              f"{int(output[:, p, :].sum()):>10}")
+    
+    if dry_run:
+        return inputs, output
+    
+    rows, skipped = plan_rows(inputs, output, default_machines(conn), start_date)
+    deleted = write_plan(conn, rows, start_date, end_month)
+    
+    print(f"✅ Строк плана: {len(rows)} (удалено старых: {deleted})")
+    if skipped:
+        print(f"⚠️  Без машины для операции, не записано: {skipped}")
+    return inputs, output
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Нетто-потребности по фазам и предварительный план')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Начало горизонта (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--months', type=int, default=HORIZON_MONTHS,
+                       help=f'Горизонт в месяцах (по умолчанию {HORIZON_MONTHS})')
+    parser.add_argument('--source', action='append', choices=SOURCES,
+                       help='Источник потребностей (можно несколько раз), по умолчанию все')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Расчёт без записи плана в БД')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    start_date = None
+    if args.date:
+        try:
+            start_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        run_netting(conn, start_date, args.months, args.source, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
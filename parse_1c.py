@@ -23,6 +23,7 @@ import pandas as pd
 import numpy as np
 import psycopg2
 from psycopg2.extras import execute_batch
+import reference_data
 
 # ============================================================================
 # ПАРСЕРЫ ФАЙЛОВ 1С
@@ -265,8 +266,7 @@ def load_requirements(conn, records, source='1C_import'):
     print(f"\n=== Загрузка detail_requirements ({len(records)} записей) ===")
     
     # Получаем маппинг деталей
-    cursor.execute("SELECT id, name FROM details")
-    detail_map = {name: detail_id for detail_id, name in cursor.fetchall()}
+    detail_map = reference_data.id_map(conn, 'details', 'name')
     
     # Подготавливаем записи для вставки
     inserts = []
@@ -326,11 +326,13 @@ def load_inventory(conn, records, snapshot_date=None):
     print(f"Дата снапшота: {snapshot_date}")
     
     # Получаем маппинги
-    cursor.execute("SELECT id, name FROM details")
-    detail_map = {name: detail_id for detail_id, name in cursor.fetchall()}
+    detail_map = reference_data.id_map(conn, 'details', 'name')
     
-    cursor.execute("SELECT id, warehouse_name FROM warehouses")
-    warehouse_map = {name: wh_id for wh_id, name in cursor.fetchall()}
+    warehouse_map = reference_data.id_map(conn, 'warehouses', 'warehouse_name', active=True)
+    
+    # Секция месяца снапшота
+    cursor.execute("SELECT ensure_month_partitions('inventory_snapshots', %s, %s)",
+                   (snapshot_date, snapshot_date))
     
     # Удаляем старые данные за эту дату
     cursor.execute("DELETE FROM inventory_snapshots WHERE snapshot_date = %s", 
@@ -372,6 +374,7 @@ def load_inventory(conn, records, snapshot_date=None):
             VALUES (%s, %s, %s, %s, %s)
         """, inserts)
         
+        cursor.execute("SELECT refresh_current_inventory(%s)", (snapshot_date,))
         conn.commit()
     
     print(f"✅ Загружено: {len(inserts)}")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Кэш результатов парсинга файлов 1С на диске
+
+Ключ = хэш содержимого файла + версия парсера + параметры парсинга
+(тип файла, --phase, дата снапшота). Повторный импорт того же файла
+берёт записи из кэша и сразу идёт на загрузку в БД.
+
+Записи хранятся в pickle (кэш-каталог должен быть локальным и доверенным).
+Размер каталога ограничен: при превышении удаляются давно не читанные файлы (LRU).
+
+Использование:
+    records = cached_parse(cache_dir, filepath, ('inventory', snapshot_date), PARSER_VERSION,
+                           parse_inventory_file, filepath, snapshot_date)
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+# Версия формата кэша, менять при изменении структуры записей
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def file_hash(filepath, block_size=1024 * 1024):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_key(filepath, params, parser_version):
+    """Имя файла кэша по содержимому файла, версии парсера и параметрам"""
+    key = repr((file_hash(filepath), parser_version, CACHE_VERSION, params))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def load_cached(cache_dir, key):
+    """Записи из кэша или None. Попадание обновляет время доступа (для LRU)"""
+    path = Path(cache_dir) / f"{key}.pkl"
+    try:
+        with open(path, 'rb') as f:
+            records = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    
+    os.utime(path)
+    return records
+
+def save_cached(cache_dir, key, records, max_bytes=DEFAULT_MAX_BYTES):
+    """Атомарная запись в кэш и вытеснение старых файлов"""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    
+    path = cache_dir / f"{key}.pkl"
+    tmp_path = cache_dir / f"{key}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    
+    evict(cache_dir, max_bytes)
+
+def evict(cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+    """Удаление давно не читанных файлов, пока кэш больше max_bytes"""
+    entries = []
+    for path in Path(cache_dir).glob('*.pkl'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+
+def cached_parse(cache_dir, filepath, params, parser_version, parse_func, *args,
+                 max_bytes=DEFAULT_MAX_BYTES, **kwargs):
+    """
+    Парсинг с кэшем
+    
+    Args:
+        cache_dir: каталог кэша
+        filepath: файл 1С (хэшируется его содержимое)
+        params: параметры, влияющие на результат (тип файла, фаза, дата)
+        parser_version: версия парсеров
+        parse_func: функция парсинга, вызывается при промахе
+    
+    Возвращает: список записей
+    """
+    key = cache_key(filepath, params, parser_version)
+    
+    records = load_cached(cache_dir, key)
+    if records is not None:
+        print(f"♻️  Из кэша: {len(records)} записей ({key[:12]})")
+        return records
+    
+    records = list(parse_func(*args, **kwargs))
+    save_cached(cache_dir, key, records, max_bytes)
+    return records
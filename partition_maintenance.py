@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Месячные секции production_transactions и inventory_snapshots
+
+Обе таблицы секционированы по месяцам даты (schema_final.sql):
+<таблица>_YYYY_MM. Операции вне секций попадают в
+production_transactions_default; у снапшотов DEFAULT нет - загрузка
+остатков сама создаёт секцию месяца. Запросы с условием на дату
+("последний снапшот", "операции за неделю") читают одну секцию.
+
+Здесь:
+- ensure_partitions() - секции с текущего месяца (или самого раннего
+  в DEFAULT) до months_ahead месяцев вперёд; строки из DEFAULT
+  переносятся в свои секции (SQL-функция ensure_month_partitions)
+- detach_partitions() - отключение секций старше retain_months
+  месяцев (таблица остаётся как архив или удаляется с --drop).
+  Секция с последним снапшотом остатков не отключается никогда
+
+Агрегаты mold_wear / metal_consumption_daily при отключении не
+меняются (триггеры на DELETE не срабатывают), но после отключения
+production_aggregates.py --rebuild посчитает только оставшиеся секции.
+
+Запускать по расписанию (раз в день / неделю):
+    python partition_maintenance.py --ensure
+    python partition_maintenance.py --retain-months 24 --detach --dry-run
+    python partition_maintenance.py --retain-months 24 --detach --drop
+    python partition_maintenance.py                  # список секций
+"""
+
+import argparse
+import re
+import sys
+import os
+from datetime import date, datetime, timedelta
+import psycopg2
+from planning_common import horizon
+
+# Секционированные таблицы: колонка даты секции
+PARTITIONED_TABLES = {
+    'production_transactions': 'transaction_date',
+    'inventory_snapshots': 'snapshot_date',
+}
+
+# Сколько месяцев вперёд держать готовые секции
+MONTHS_AHEAD = 2
+
+# Срок хранения по умолчанию, месяцев
+RETAIN_MONTHS = 24
+
+BOUND_PATTERN = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+def default_rows(cursor, table):
+    """Строки в DEFAULT-секции: (число, самая ранняя дата); (0, None) - секции нет"""
+    cursor.execute("SELECT to_regclass(%s)", (f"{table}_default",))
+    if cursor.fetchone()[0] is None:
+        return 0, None
+    cursor.execute(f"SELECT COUNT(*), MIN({PARTITIONED_TABLES[table]}) FROM {table}_default")
+    return cursor.fetchone()
+
+def partitions(conn, table):
+    """
+    Месячные секции таблицы (без DEFAULT), по возрастанию месяца
+    
+    Возвращает: [(имя секции, первый день месяца, первый день следующего, строк ~)]
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass AND c.relkind = 'r'
+        """, (table,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    result = []
+    for name, bound, tuples in rows:
+        match = BOUND_PATTERN.search(bound)
+        if match is None:
+            continue
+        start, end = (datetime.strptime(value, '%Y-%m-%d').date() for value in match.groups())
+        result.append((name, start, end, int(tuples) if tuples >= 0 else None))
+    return sorted(result, key=lambda row: row[1])
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD, today=None):
+    """
+    Недостающие секции с текущего месяца (или самого раннего в DEFAULT)
+    до months_ahead месяцев вперёд
+    
+    Возвращает: {таблица: создано секций}
+    """
+    if today is None:
+        today = date.today()
+    last_day = horizon(today, months_ahead + 1)[1] - timedelta(days=1)
+    
+    created = {}
+    cursor = conn.cursor()
+    try:
+        for table in PARTITIONED_TABLES:
+            first_day = min(filter(None, [default_rows(cursor, table)[1], today]))
+            cursor.execute("SELECT ensure_month_partitions(%s, %s, %s)", (table, first_day, last_day))
+            created[table] = cursor.fetchone()[0]
+            
+            leftover = default_rows(cursor, table)[0]
+            print(f"✅ {table}: создано секций {created[table]} ({first_day:%Y-%m} - {last_day:%Y-%m})")
+            if leftover:
+                print(f"⚠️  {table}_default: осталось строк {leftover} (даты позже {last_day})")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return created
+
+def detach_partitions(conn, retain_months=RETAIN_MONTHS, drop=False, dry_run=False, today=None):
+    """
+    Отключение секций, целиком старше retain_months месяцев
+    
+    Args:
+        drop: удалить отключённые секции (иначе остаются отдельными таблицами)
+        dry_run: только показать, что будет отключено
+    
+    Возвращает: [имена отключённых секций]
+    """
+    if today is None:
+        today = date.today()
+    cutoff = horizon(today, -retain_months)[0]
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT latest_inventory_date()")
+        latest_snapshot = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    
+    detached = []
+    cursor = conn.cursor()
+    try:
+        for table in PARTITIONED_TABLES:
+            for name, start, end, tuples in partitions(conn, table):
+                if end > cutoff:
+                    continue
+                if table == 'inventory_snapshots' and latest_snapshot and start <= latest_snapshot < end:
+                    print(f"⚠️  {name}: последний снапшот остатков ({latest_snapshot}), оставляем")
+                    continue
+                action = 'удалена' if drop else 'отключена'
+                print(f"{'(dry-run) ' if dry_run else ''}🔁 {name}: {action} "
+                      f"(~{tuples if tuples is not None else '?'} строк)")
+                detached.append(name)
+                if dry_run:
+                    continue
+                cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+                if drop:
+                    cursor.execute(f"DROP TABLE {name}")
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    if not detached:
+        print(f"✅ Нет секций старше {cutoff}")
+    return detached
+
+def print_partitions(conn):
+    """Секции таблиц и строки в DEFAULT"""
+    cursor = conn.cursor()
+    try:
+        for table in PARTITIONED_TABLES:
+            rows = partitions(conn, table)
+            leftover = default_rows(cursor, table)[0]
+            print(f"\n📊 {table}: секций {len(rows)}, в DEFAULT строк {leftover}")
+            for name, start, end, tuples in rows:
+                print(f"   {name:<36} {start} - {end}  ~{tuples if tuples is not None else '?'} строк")
+    finally:
+        cursor.close()
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Месячные секции операций и снапшотов остатков')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--ensure', action='store_true',
+                       help='Создать недостающие секции и разобрать DEFAULT')
+    parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD,
+                       help=f'Секции на месяцев вперёд (по умолчанию {MONTHS_AHEAD})')
+    parser.add_argument('--detach', action='store_true',
+                       help='Отключить секции старше --retain-months')
+    parser.add_argument('--retain-months', type=int, default=RETAIN_MONTHS,
+                       help=f'Срок хранения, месяцев (по умолчанию {RETAIN_MONTHS})')
+    parser.add_argument('--drop', action='store_true',
+                       help='Удалить отключённые секции')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Показать секции к отключению без изменений')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    if args.drop and not args.detach:
+        parser.error("--drop только вместе с --detach")
+    if args.retain_months < 1:
+        parser.error("--retain-months должен быть >= 1")
+    
+    conn = connect_db(conn_string)
+    try:
+        if args.ensure:
+            ensure_partitions(conn, args.months_ahead)
+        if args.detach:
+            detach_partitions(conn, args.retain_months, args.drop, args.dry_run)
+        print_partitions(conn)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
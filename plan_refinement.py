@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Иерархическое уточнение плана: 9 месяцев → месяц → неделя → день
+
+Уровни и их строки:
+- horizon: грубый план на горизонт - потребности из заказов, нетто-расчёт,
+  расписание отливки и фаз после неё (строки этих модулей, status='cached')
+- month: строки грубого плана, обрезанные по границам месяца
+  (notes='refine_month', status='cached')
+- week: строки месяца, обрезанные по границам недели, на WEEKS_AHEAD
+  недель вперёд (notes='refine_week', status='cached')
+Строки не сливаются: по каждому дню срез повторяет расписание уровня
+выше (check_slice)
+- day: план на день (daily_plan) на DAYS_AHEAD рабочих дней вперёд
+
+Каждый срез хранит в plan_slices отпечаток своих входов:
+- horizon: заказы и ручные/1С потребности горизонта, версия остатков,
+  модель мощности, состояния машин
+- month / week: строки уровня выше, попадающие в срез
+- day: строки плана на дату, состояния машин, модель мощности
+Если отпечаток не совпал, строки среза помечаются obsolete (их не видят
+daily_plan и другие читатели) и срез пересчитывается. Срезы сверху вниз:
+пересчёт грубого плана меняет только те месяцы, недели и дни, чьи строки
+действительно изменились.
+
+Использование:
+    python plan_refinement.py --connection "postgresql://..."
+    python plan_refinement.py --dry-run        # какие срезы устарели
+    python plan_refinement.py --force          # пересчитать всё
+"""
+
+import argparse
+import sys
+import os
+import json
+import hashlib
+from datetime import datetime, date, timedelta
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+import reference_data
+import capacity_model
+import mrp_netting
+import casting_scheduler
+import flow_shop_scheduler
+import daily_plan
+from planning_common import (horizon, spread_quantity, machine_states, HORIZON_MONTHS,
+                             ACTIVE_STATUSES, REFINED_NOTES)
+from requirements_from_orders import generate_requirements_from_orders
+
+LEVELS = ['horizon', 'month', 'week', 'day']
+
+WEEK_NOTE, MONTH_NOTE = REFINED_NOTES
+
+# Метки строк грубого плана
+COARSE_NOTES = [mrp_netting.PLAN_NOTE, casting_scheduler.PLAN_NOTE, flow_shop_scheduler.PLAN_NOTE]
+
+# На сколько вперёд держим недельные и дневные срезы
+WEEKS_AHEAD = 4
+DAYS_AHEAD = 5
+
+def fingerprint(*parts):
+    """Отпечаток входов среза (md5 от JSON)"""
+    payload = json.dumps(parts, default=str, sort_keys=True, ensure_ascii=False)
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+def plan_slices(start_date, months=HORIZON_MONTHS):
+    """
+    Срезы всех уровней на горизонт
+    
+    Возвращает: [(уровень, начало, конец)] сверху вниз
+    """
+    start_month, end_month = horizon(start_date, months)
+    result = [('horizon', start_month, end_month - timedelta(days=1))]
+    
+    for month_start in mrp_netting.month_starts(start_month, months):
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        result.append(('month', month_start, next_month - timedelta(days=1)))
+    
+    monday = start_date - timedelta(days=start_date.weekday())
+    for week in range(WEEKS_AHEAD):
+        week_start = monday + timedelta(weeks=week)
+        result.append(('week', week_start, week_start + timedelta(days=6)))
+    
+    days = np.busday_offset(np.datetime64(start_date, 'D'), np.arange(1, DAYS_AHEAD + 1), roll='forward')
+    result.extend(('day', day.item(), day.item()) for day in days)
+    return result
+
+# ============================================================================
+# ВХОДЫ СРЕЗОВ
+# ============================================================================
+
+def horizon_inputs(conn, start_date, months):
+    """Отпечаток входов грубого плана"""
+    start_month, end_month = horizon(start_date, months)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT md5(string_agg(concat_ws(':', id, assembly_id, due_date, quantity), ',' ORDER BY id))
+            FROM orders
+            WHERE due_date >= %s AND due_date < %s
+        """, (start_month, end_month))
+        orders = cursor.fetchone()[0]
+        
+        # from_orders - производные от заказов, их пересчитывает сам грубый план
+        cursor.execute("""
+            SELECT md5(string_agg(concat_ws(':', detail_id, phase, requirement_month,
+                                            required_quantity, source), ',' ORDER BY id))
+            FROM detail_requirements
+            WHERE requirement_month >= %s AND requirement_month < %s
+              AND source <> 'from_orders'
+        """, (start_month, end_month))
+        requirements = cursor.fetchone()[0]
+        
+        snapshots = reference_data.table_version(cursor, 'current_inventory')
+    finally:
+        cursor.close()
+    
+    # Только статусы: ежедневная выгрузка тех же состояний план не сбрасывает
+    states = sorted(machine_states(conn, start_date).items())
+    return fingerprint(orders, requirements, snapshots, capacity_model.model_version(conn), states)
+
+def source_rows(conn, level, slice_start, slice_end):
+    """Строки уровня выше, попадающие в срез (месяц - грубый план, неделя - месяц)"""
+    if level == 'month':
+        condition, params = "COALESCE(notes, '') <> ALL(%s)", (REFINED_NOTES,)
+    else:
+        condition, params = "notes = %s", (MONTH_NOTE,)
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT detail_id, operation, machine_id, start_date, end_date, quantity_planned
+            FROM tentative_production_plan
+            WHERE start_date <= %s AND end_date >= %s
+              AND status = ANY(%s)
+              AND {condition}
+            ORDER BY detail_id, operation, machine_id, start_date, id
+        """, (slice_end, slice_start, ACTIVE_STATUSES) + params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def day_inputs(conn, day):
+    """Отпечаток входов плана на день"""
+    rows = sorted(daily_plan.tentative_rows(conn, day))
+    states = sorted(machine_states(conn, day).items())
+    return fingerprint(rows, states, capacity_model.model_version(conn))
+
+# ============================================================================
+# ПЕРЕСЧЁТ СРЕЗОВ
+# ============================================================================
+
+def daily_totals(rows, slice_start, slice_end):
+    """Штук по (деталь, операция, машина, день) внутри среза"""
+    first_day, last_day = np.datetime64(slice_start, 'D'), np.datetime64(slice_end, 'D')
+    totals = {}
+    for detail_id, operation, machine_id, start_date, end_date, quantity in rows:
+        days, shares = spread_quantity(quantity, start_date, end_date)
+        inside = (days >= first_day) & (days <= last_day) & (shares > 0)
+        for day, share in zip(days[inside].tolist(), shares[inside].tolist()):
+            key = (detail_id, operation, machine_id, day)
+            totals[key] = totals.get(key, 0) + share
+    return totals
+
+def derive_rows(source, slice_start, slice_end, note):
+    """
+    Строки среза из строк уровня выше
+    
+    Каждая строка обрезается по границам среза отдельно (без слияния по
+    детали и машине): период - её дни внутри среза, количество - их доли.
+    Если раскладка обрезанной строки по дням не совпадает с исходной
+    (округление), строка делится на строки по одному дню.
+    """
+    first_day, last_day = np.datetime64(slice_start, 'D'), np.datetime64(slice_end, 'D')
+    rows = []
+    for detail_id, operation, machine_id, start_date, end_date, quantity in source:
+        days, shares = spread_quantity(quantity, start_date, end_date)
+        inside = (days >= first_day) & (days <= last_day)
+        if not shares[inside].any():
+            continue
+        
+        start = max(start_date, slice_start)
+        end = min(end_date, slice_end)
+        clipped = int(shares[inside].sum())
+        if np.array_equal(spread_quantity(clipped, start, end)[1], shares[inside]):
+            rows.append((detail_id, operation, machine_id, start, end, clipped, 'cached', note))
+            continue
+        for day, share in zip(days[inside].tolist(), shares[inside].tolist()):
+            if share > 0:
+                rows.append((detail_id, operation, machine_id, day, day, share, 'cached', note))
+    return rows
+
+def check_slice(source, rows, slice_start, slice_end):
+    """Срез повторяет строки уровня выше по каждому дню (иначе RuntimeError)"""
+    expected = daily_totals(source, slice_start, slice_end)
+    actual = daily_totals([row[:6] for row in rows], slice_start, slice_end)
+    if expected != actual:
+        mismatches = sum(1 for key in expected.keys() | actual.keys()
+                         if expected.get(key, 0) != actual.get(key, 0))
+        raise RuntimeError(f"Срез {slice_start} - {slice_end} не совпадает с уровнем выше "
+                           f"по дням: расхождений {mismatches}")
+
+def mark_obsolete(conn, level, slice_start, slice_end):
+    """Строки среза и сам срез - obsolete (одной транзакцией)"""
+    cursor = conn.cursor()
+    try:
+        if level == 'horizon':
+            cursor.execute("""
+                UPDATE tentative_production_plan
+                SET status = 'obsolete', updated_at = CURRENT_TIMESTAMP
+                WHERE notes = ANY(%s) AND start_date <= %s AND end_date >= %s
+            """, (COARSE_NOTES, slice_end, slice_start))
+        elif level in ('month', 'week'):
+            cursor.execute("""
+                UPDATE tentative_production_plan
+                SET status = 'obsolete', updated_at = CURRENT_TIMESTAMP
+                WHERE notes = %s AND start_date >= %s AND end_date <= %s
+            """, (MONTH_NOTE if level == 'month' else WEEK_NOTE, slice_start, slice_end))
+        cursor.execute("""
+            UPDATE plan_slices SET status = 'obsolete'
+            WHERE level = %s AND slice_start = %s
+        """, (level, slice_start))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def write_slice_rows(conn, note, slice_start, slice_end, rows):
+    """Замена строк среза месяца / недели одной транзакцией"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM tentative_production_plan
+            WHERE notes = %s AND start_date >= %s AND end_date <= %s
+        """, (note, slice_start, slice_end))
+        if rows:
+            execute_values(cursor, """
+                INSERT INTO tentative_production_plan (
+                    detail_id, operation, machine_id, start_date, end_date,
+                    quantity_planned, status, notes
+                ) VALUES %s
+            """, rows, page_size=1000)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def compute_horizon(conn, start_date, months):
+    """Грубый план: потребности из заказов → нетто → отливка → фазы после неё"""
+    start_month, end_month = horizon(start_date, months)
+    generate_requirements_from_orders(conn, start_date, months)
+    mrp_netting.run_netting(conn, start_date, months)
+    casting_scheduler.run_scheduler(conn, start_date, months)
+    flow_shop_scheduler.run_flow_shop(conn, start_date, months)
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE tentative_production_plan
+            SET status = 'cached', updated_at = CURRENT_TIMESTAMP
+            WHERE notes = ANY(%s) AND status = 'heuristic'
+              AND end_date >= %s AND start_date < %s
+        """, (COARSE_NOTES, start_date, end_month))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def save_slice(conn, level, slice_start, slice_end, inputs):
+    """Отпечаток пересчитанного среза"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO plan_slices (level, slice_start, slice_end, inputs, status)
+            VALUES (%s, %s, %s, %s, 'cached')
+            ON CONFLICT (level, slice_start) DO UPDATE SET
+                slice_end = EXCLUDED.slice_end,
+                inputs = EXCLUDED.inputs,
+                status = 'cached',
+                computed_at = CURRENT_TIMESTAMP
+        """, (level, slice_start, slice_end, inputs))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def stored_slices(conn, start_date):
+    """
+    Сохранённые срезы: {(уровень, начало): (отпечаток, статус)}
+    
+    Прошедшие срезы (кроме горизонта) удаляются - они больше не проверяются.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM plan_slices WHERE slice_end < %s AND level <> 'horizon'",
+                       (start_date,))
+        cursor.execute("SELECT level, slice_start, inputs, status FROM plan_slices")
+        slices = {(level, start): (inputs, status) for level, start, inputs, status in cursor.fetchall()}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return slices
+
+def refresh_plan(conn, start_date=None, months=HORIZON_MONTHS, force=False, dry_run=False):
+    """
+    Проверка срезов сверху вниз и пересчёт устаревших
+    
+    Возвращает: {уровень: {'cached': n, 'recomputed': n}}
+    """
+    if start_date is None:
+        start_date = date.today()
+    
+    print(f"\n=== Уточнение плана от {start_date} ===")
+    
+    stored = stored_slices(conn, start_date)
+    stats = {level: {'cached': 0, 'recomputed': 0} for level in LEVELS}
+    
+    for level, slice_start, slice_end in plan_slices(start_date, months):
+        source = None
+        if level == 'horizon':
+            inputs = horizon_inputs(conn, start_date, months)
+        elif level == 'day':
+            inputs = day_inputs(conn, slice_start)
+        else:
+            source = source_rows(conn, level, slice_start, slice_end)
+            inputs = fingerprint(source)
+        
+        if not force and stored.get((level, slice_start)) == (inputs, 'cached'):
+            stats[level]['cached'] += 1
+            continue
+        
+        stats[level]['recomputed'] += 1
+        print(f"🔁 {level} {slice_start} - {slice_end}: входы изменились")
+        if dry_run:
+            continue
+        
+        mark_obsolete(conn, level, slice_start, slice_end)
+        if level == 'horizon':
+            compute_horizon(conn, start_date, months)
+        elif level == 'day':
+            daily_plan.generate_daily_plan(conn, slice_start)
+        else:
+            note = MONTH_NOTE if level == 'month' else WEEK_NOTE
+            rows = derive_rows(source, slice_start, slice_end, note)
+            check_slice(source, rows, slice_start, slice_end)
+            write_slice_rows(conn, note, slice_start, slice_end, rows)
+        save_slice(conn, level, slice_start, slice_end, inputs)
+    
+    print(f"\n📊 Срезы плана:")
+    print(f"   {'Уровень':<10} {'Из кэша':>8} {'Пересчитано':>12}")
+    for level in LEVELS:
+        print(f"   {level:<10} {stats[level]['cached']:>8} {stats[level]['recomputed']:>12}")
+    return stats
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Иерархическое уточнение плана: 9 мес → месяц → неделя → день')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Дата отсчёта (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--months', type=int, default=HORIZON_MONTHS,
+                       help=f'Горизонт в месяцах (по умолчанию {HORIZON_MONTHS})')
+    parser.add_argument('--force', action='store_true',
+                       help='Пересчитать все срезы')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Только показать устаревшие срезы')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    start_date = None
+    if args.date:
+        try:
+            start_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        refresh_plan(conn, start_date, args.months, args.force, args.dry_run)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
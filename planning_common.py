@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Общие помощники планировщиков: горизонт, рабочие дни, состояния машин
+
+Модуль не импортирует ни одного планировщика - его импортируют все
+(requirements_from_orders, mrp_netting, casting_scheduler,
+flow_shop_scheduler, plan_refinement, daily_plan, emergency_replan,
+partition_maintenance), без циклов и отложенных импортов.
+
+- horizon(): горизонт планирования по месяцам
+- working_days() / spread_quantity(): рабочие дни периода и раскладка
+  количества по ним целыми штуками - одна для всех уровней плана
+- machine_states(): последнее состояние каждой машины на дату
+- статусы и метки строк tentative_production_plan
+"""
+
+from datetime import date
+import numpy as np
+
+# Горизонт планирования, месяцев
+HORIZON_MONTHS = 9
+
+# Статусы предварительного плана, из которых строится план на день
+ACTIVE_STATUSES = ['heuristic', 'cached', 'emergency']
+
+# Состояния машины, в которых она не работает
+UNAVAILABLE_STATES = ['out_of_order', 'maintenance']
+
+# Метки уточнённого плана (plan_refinement), от мелкого уровня к крупному:
+# на дату по каждой детали и операции берутся строки самого мелкого
+# уровня, который её покрывает
+REFINED_NOTES = ['refine_week', 'refine_month']
+
+def horizon(start_date=None, months=HORIZON_MONTHS):
+    """Горизонт планирования: (первый день месяца start_date, первый день после горизонта)"""
+    if start_date is None:
+        start_date = date.today()
+    start_month = start_date.replace(day=1)
+    month_index = start_month.month - 1 + months
+    end_month = date(start_month.year + month_index // 12, month_index % 12 + 1, 1)
+    return start_month, end_month
+
+def working_days(start_date, end_date):
+    """Рабочие дни [start_date, end_date) как datetime64[D]"""
+    days = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D'))
+    return days[np.is_busday(days)]
+
+def spread_quantity(quantity, start_date, end_date):
+    """
+    Количество периода по его рабочим дням: поровну, целыми штуками,
+    без потерь на округлении
+    
+    Возвращает: (рабочие дни datetime64[D], штук по дням)
+    """
+    period = working_days(start_date, np.datetime64(end_date, 'D') + 1)
+    shares = np.diff(np.floor(quantity * np.arange(len(period) + 1) / max(len(period), 1)))
+    return period, shares.astype(np.int64)
+
+def machine_states(conn, plan_date):
+    """Последнее состояние каждой машины на дату плана: {machine_id: status}"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT ON (machine_id) machine_id, status
+            FROM machine_state
+            WHERE state_date <= %s
+            ORDER BY machine_id, state_date DESC
+        """, (plan_date,))
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Износ форм и расход металла по факту производства
+
+Запросы из примечаний схемы (SUM по production_transactions) читали всю
+таблицу операций. Теперь агрегаты ведутся триггерами на
+production_transactions (см. schema_final.sql):
+- mold_wear: удары по форме (quantity / qty_per_hit по отливке)
+- metal_consumption_daily: кг металла по дням и материалу
+
+Здесь:
+- rebuild_aggregates() - пересчёт агрегатов полным проходом (после
+  правки details задним числом или загрузки в обход триггеров)
+- verify_aggregates() - сверка агрегатов с полным проходом
+- mold_wear_alerts() - формы, выработавшие долю ресурса max_hits
+- metal_balance() - металл последнего снапшота минус расход после него,
+  опционально против отливки в плане на день
+
+Проверки читают одну строку агрегата на форму / материал-день.
+
+Использование:
+    python production_aggregates.py
+    python production_aggregates.py --threshold 0.8 --date 2025-11-12
+    python production_aggregates.py --rebuild
+    python production_aggregates.py --verify
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime
+import psycopg2
+
+CASTING_OPERATION = 'отливка'
+
+# Доля ресурса формы для предупреждения
+WEAR_THRESHOLD = 0.9
+
+DEFAULT_MATERIAL = 'Алюминий'
+
+# Полный проход по операциям (эталон для rebuild / verify)
+FULL_WEAR_SQL = """
+    SELECT d.mold_id, SUM(pt.quantity / COALESCE(d.qty_per_hit, 1)), MAX(pt.transaction_date)
+    FROM production_transactions pt
+    JOIN details d ON pt.detail_id = d.id
+    WHERE pt.operation_type = %s AND d.mold_id IS NOT NULL
+    GROUP BY d.mold_id
+"""
+
+FULL_CONSUMPTION_SQL = """
+    SELECT pt.transaction_date, COALESCE(d.material_type, %s), SUM(d.weight_kg * pt.quantity)
+    FROM production_transactions pt
+    JOIN details d ON pt.detail_id = d.id
+    WHERE pt.operation_type = %s
+    GROUP BY 1, 2
+"""
+
+def rebuild_aggregates(conn):
+    """
+    Пересчёт mold_wear и metal_consumption_daily полным проходом
+    
+    Операции блокируются на запись до конца транзакции, чтобы триггеры
+    не добавили приращение к ещё не пересчитанным агрегатам.
+    
+    Возвращает: (форм, строк расхода)
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("LOCK TABLE production_transactions IN SHARE MODE")
+        cursor.execute("TRUNCATE mold_wear, metal_consumption_daily")
+        cursor.execute(f"""
+            INSERT INTO mold_wear (mold_id, total_hits, last_cast_date)
+            {FULL_WEAR_SQL}
+        """, (CASTING_OPERATION,))
+        molds = cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO metal_consumption_daily (consumption_date, material_type, quantity_kg)
+            {FULL_CONSUMPTION_SQL}
+        """, (DEFAULT_MATERIAL, CASTING_OPERATION))
+        days = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    print(f"🔁 Агрегаты пересчитаны: форм {molds}, строк расхода {days}")
+    return molds, days
+
+def verify_aggregates(conn, tolerance=1e-6):
+    """
+    Сверка агрегатов с полным проходом по операциям
+    
+    Возвращает: число расхождений
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(FULL_WEAR_SQL, (CASTING_OPERATION,))
+        expected_wear = {mold_id: float(hits) for mold_id, hits, _ in cursor.fetchall()}
+        cursor.execute("SELECT mold_id, total_hits FROM mold_wear")
+        actual_wear = {mold_id: float(hits) for mold_id, hits in cursor.fetchall()}
+        
+        cursor.execute(FULL_CONSUMPTION_SQL, (DEFAULT_MATERIAL, CASTING_OPERATION))
+        expected_metal = {(day, material): float(kg) for day, material, kg in cursor.fetchall()}
+        cursor.execute("SELECT consumption_date, material_type, quantity_kg FROM metal_consumption_daily")
+        actual_metal = {(day, material): float(kg) for day, material, kg in cursor.fetchall()}
+    finally:
+        cursor.close()
+    
+    mismatches = 0
+    for name, expected, actual in (('mold_wear', expected_wear, actual_wear),
+                                   ('metal_consumption_daily', expected_metal, actual_metal)):
+        for key in expected.keys() | actual.keys():
+            if abs(expected.get(key, 0.0) - actual.get(key, 0.0)) > tolerance:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"⚠️  {name} {key}: агрегат {actual.get(key, 0.0):.2f}, "
+                          f"по операциям {expected.get(key, 0.0):.2f}")
+    
+    if mismatches:
+        print(f"❌ Расхождений: {mismatches} (пересчёт: --rebuild)")
+    else:
+        print(f"✅ Агрегаты совпадают с операциями")
+    return mismatches
+
+def mold_wear_alerts(conn, threshold=WEAR_THRESHOLD):
+    """
+    Формы, выработавшие не меньше threshold от max_hits
+    
+    Возвращает: [{'mold_id', 'mold_number', 'total_hits', 'max_hits', 'wear'}]
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT m.id, m.mold_number, w.total_hits, m.max_hits
+            FROM mold_wear w
+            JOIN molds m ON m.id = w.mold_id
+            WHERE m.max_hits > 0 AND w.total_hits >= %s * m.max_hits
+            ORDER BY w.total_hits / m.max_hits DESC
+        """, (threshold,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    
+    return [{'mold_id': mold_id, 'mold_number': number, 'total_hits': float(hits),
+             'max_hits': max_hits, 'wear': float(hits) / max_hits}
+            for mold_id, number, hits, max_hits in rows]
+
+def metal_balance(conn, plan_date=None):
+    """
+    Металл на складе: последний снапшот минус расход на отливку после него
+    
+    Args:
+        plan_date: добавить потребность отливки из плана на этот день
+    
+    Возвращает: {material_type: {'snapshot_date', 'snapshot_kg', 'consumed_kg',
+                                 'available_kg', 'planned_kg'}}
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT s.material_type, s.snapshot_date, SUM(s.quantity_kg),
+                   (SELECT COALESCE(SUM(c.quantity_kg), 0)
+                    FROM metal_consumption_daily c
+                    WHERE c.material_type = s.material_type
+                      AND c.consumption_date > s.snapshot_date)
+            FROM material_inventory_snapshots s
+            WHERE s.snapshot_date = (SELECT MAX(snapshot_date) FROM material_inventory_snapshots)
+            GROUP BY s.material_type, s.snapshot_date
+        """)
+        balance = {material: {'snapshot_date': snapshot_date, 'snapshot_kg': float(kg),
+                              'consumed_kg': float(consumed),
+                              'available_kg': float(kg) - float(consumed), 'planned_kg': 0.0}
+                   for material, snapshot_date, kg, consumed in cursor.fetchall()}
+        
+        if plan_date is not None:
+            cursor.execute("""
+                SELECT COALESCE(d.material_type, %s), SUM(d.weight_kg * p.quantity_planned)
+                FROM daily_production_plan p
+                JOIN details d ON d.id = p.detail_id
+                WHERE p.plan_date = %s AND p.operation = %s
+                GROUP BY 1
+            """, (DEFAULT_MATERIAL, plan_date, CASTING_OPERATION))
+            for material, kg in cursor.fetchall():
+                entry = balance.setdefault(material, {'snapshot_date': None, 'snapshot_kg': 0.0,
+                                                      'consumed_kg': 0.0, 'available_kg': 0.0,
+                                                      'planned_kg': 0.0})
+                entry['planned_kg'] = float(kg or 0)
+    finally:
+        cursor.close()
+    
+    return balance
+
+def print_report(alerts, balance, threshold, plan_date=None):
+    """Предупреждения по износу форм и остаток металла"""
+    print(f"\n📊 Износ форм (порог {threshold:.0%} ресурса):")
+    if not alerts:
+        print(f"   ✅ Нет форм выше порога")
+    for alert in alerts:
+        mark = '❌' if alert['wear'] >= 1.0 else '⚠️ '
+        print(f"   {mark} {alert['mold_number']}: {alert['total_hits']:.0f} из {alert['max_hits']} "
+              f"ударов ({alert['wear']:.0%})")
+    
+    print(f"\n📊 Металл (снапшот - расход после него):")
+    for material, entry in sorted(balance.items()):
+        line = (f"   {material:<12} снапшот {entry['snapshot_date'] or '-'}: {entry['snapshot_kg']:.1f} кг, "
+                f"расход {entry['consumed_kg']:.1f} кг, доступно {entry['available_kg']:.1f} кг")
+        if plan_date is not None:
+            line += f", план на {plan_date}: {entry['planned_kg']:.1f} кг"
+        print(line)
+        if plan_date is not None and entry['planned_kg'] > entry['available_kg']:
+            print(f"   ⚠️  Не хватает {entry['planned_kg'] - entry['available_kg']:.1f} кг {material}")
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Износ форм и расход металла по факту производства')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--rebuild', action='store_true',
+                       help='Пересчитать агрегаты полным проходом по операциям')
+    parser.add_argument('--verify', action='store_true',
+                       help='Сверить агрегаты с операциями')
+    parser.add_argument('--threshold', type=float, default=WEAR_THRESHOLD,
+                       help=f'Доля ресурса формы для предупреждения (по умолчанию {WEAR_THRESHOLD})')
+    parser.add_argument('--date', '-d',
+                       help='Сравнить металл с отливкой в плане на день (YYYY-MM-DD)')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    try:
+        plan_date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    except ValueError:
+        parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        if args.rebuild:
+            rebuild_aggregates(conn)
+        if args.verify:
+            if verify_aggregates(conn):
+                sys.exit(1)
+            return
+        print_report(mold_wear_alerts(conn, args.threshold), metal_balance(conn, plan_date),
+                     args.threshold, plan_date)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
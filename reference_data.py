@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Кэш справочников (details, molds, machines, assemblies, warehouses) на процесс
+
+Справочники читаются из БД один раз и переиспользуются всеми загрузчиками.
+Перед выдачей проверяется версия таблицы - одна строка table_versions
+по ключу. Версию ведут триггеры (schema_final.sql): меняется при
+вставке, изменении, удалении или TRUNCATE, в том числе в текущей
+транзакции. invalidate() - сброс кэша без проверки версии.
+
+Использование:
+    detail_map = reference_data.id_map(conn, 'details', 'nomenclature_code')
+    for row in reference_data.rows(conn, 'machines'):
+        ...
+    details = reference_data.rows(conn, 'details', active=True)
+
+active=True - только действующие строки: без retired_at у деталей,
+сборок и складов, статус не 'retired' у форм и машин (init_db.py --sync
+выводит так строки, которых нет в мастер-файле).
+
+Возвращаемые списки и словари общие для всех вызовов - не изменять.
+"""
+
+# Колонки справочников, которые держим в памяти
+TABLES = {
+    'details': ['id', 'nomenclature_code', 'name', 'weight_kg', 'material_type',
+                'requires_painting', 'mold_id', 'qty_per_hit', 'assembly_id', 'qty_in_assembly',
+                'retired_at'],
+    'molds': ['id', 'mold_number', 'name', 'install_date', 'max_hits', 'status'],
+    'machines': ['id', 'machine_number', 'name', 'output_phase', 'status'],
+    'assemblies': ['id', 'name', 'retired_at'],
+    'warehouses': ['id', 'warehouse_name', 'warehouse_type', 'retired_at'],
+}
+
+RETIRED_STATUS = 'retired'
+
+# (dsn, таблица) -> {'version': ..., 'rows': [...], 'maps': {...}}
+_cache = {}
+
+def table_version(cursor, table):
+    """Версия таблицы из table_versions (None - таблица без триггеров версии)"""
+    cursor.execute("SELECT version FROM table_versions WHERE table_name = %s", (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _entry(conn, table):
+    """Актуальная запись кэша таблицы (перечитывает при смене версии)"""
+    if table not in TABLES:
+        raise ValueError(f"Неизвестный справочник: {table}")
+    
+    key = (conn.dsn, table)
+    cursor = conn.cursor()
+    try:
+        version = table_version(cursor, table)
+        entry = _cache.get(key)
+        if entry is None or entry['version'] != version:
+            columns = TABLES[table]
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+            entry = {
+                'version': version,
+                'rows': [dict(zip(columns, row)) for row in cursor.fetchall()],
+                'maps': {}
+            }
+            _cache[key] = entry
+    finally:
+        cursor.close()
+    return entry
+
+def is_active(row):
+    """Строка справочника не выведена из оборота"""
+    return row.get('retired_at') is None and row.get('status') != RETIRED_STATUS
+
+def rows(conn, table, active=False):
+    """Строки справочника: список dict, упорядочен по id (active - только действующие)"""
+    entry = _entry(conn, table)
+    if not active:
+        return entry['rows']
+    if 'active' not in entry:
+        entry['active'] = [row for row in entry['rows'] if is_active(row)]
+    return entry['active']
+
+def id_map(conn, table, key_column, active=False):
+    """{значение key_column: id} - при дублях побеждает меньший id"""
+    entry = _entry(conn, table)
+    if (key_column, active) not in entry['maps']:
+        mapping = {}
+        for row in rows(conn, table, active):
+            mapping.setdefault(row[key_column], row['id'])
+        entry['maps'][(key_column, active)] = mapping
+    return entry['maps'][(key_column, active)]
+
+def invalidate(table=None):
+    """Сброс кэша (всех справочников или одного)"""
+    for key in list(_cache):
+        if table is None or key[1] == table:
+            del _cache[key]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Потребности в деталях из заказов на сборки (detail_requirements, source='from_orders')
+
+Разузлование одним запросом: orders × details по assembly_id,
+количество = orders.quantity × details.qty_in_assembly, сумма по
+(деталь, месяц due_date). Потребность ставится на фазу 'покраска'
+(готовые детали). Время не зависит от числа заказов - один INSERT ... SELECT.
+
+Перегенерация горизонта (9 месяцев от текущего) в одной транзакции:
+старые строки from_orders горизонта удаляются, новые вставляются.
+Строки прошлых месяцев и других источников не трогаются.
+
+Использование:
+    python requirements_from_orders.py --connection "postgresql://..."
+    python requirements_from_orders.py --date 2025-12-01 --months 9
+"""
+
+import argparse
+import sys
+import os
+from datetime import datetime, date
+import psycopg2
+from planning_common import horizon, HORIZON_MONTHS
+
+# Фаза готовой детали - на неё ставятся потребности из заказов
+FINISHED_PHASE = 'покраска'
+
+SOURCE = 'from_orders'
+
+def generate_requirements_from_orders(conn, start_date=None, months=HORIZON_MONTHS):
+    """
+    Перегенерация потребностей from_orders на горизонт
+    
+    Args:
+        conn: подключение к БД
+        start_date: учитываются заказы с due_date >= start_date (по умолчанию сегодня)
+        months: длина горизонта в месяцах
+    
+    Возвращает: dict deleted/inserted/orders
+    """
+    if start_date is None:
+        start_date = date.today()
+    start_month, end_month = horizon(start_date, months)
+    
+    cursor = conn.cursor()
+    
+    print(f"\n=== Потребности из заказов: {start_month} - {end_month} ===")
+    
+    try:
+        cursor.execute("""
+            DELETE FROM detail_requirements
+            WHERE source = %s AND requirement_month >= %s AND requirement_month < %s
+        """, (SOURCE, start_month, end_month))
+        deleted = cursor.rowcount
+        
+        # Разузлование заказов: один проход, агрегат по детали и месяцу
+        cursor.execute("""
+            INSERT INTO detail_requirements (
+                detail_id, phase, requirement_month, required_quantity, source
+            )
+            SELECT
+                d.id,
+                %s,
+                date_trunc('month', o.due_date)::date,
+                SUM(o.quantity * d.qty_in_assembly),
+                %s
+            FROM orders o
+            JOIN details d ON d.assembly_id = o.assembly_id
+            WHERE o.due_date >= %s AND o.due_date < %s
+              AND d.qty_in_assembly IS NOT NULL
+              AND d.retired_at IS NULL
+            GROUP BY d.id, date_trunc('month', o.due_date)
+        """, (FINISHED_PHASE, SOURCE, start_date, end_month))
+        inserted = cursor.rowcount
+        
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE due_date >= %s AND due_date < %s",
+                       (start_date, end_month))
+        orders = cursor.fetchone()[0]
+        
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    print(f"✅ Заказов: {orders}, потребностей: {inserted} (удалено старых: {deleted})")
+    return {'deleted': deleted, 'inserted': inserted, 'orders': orders}
+
+def connect_db(connection_string):
+    """Подключение к БД"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.autocommit = False
+        print(f"✅ Подключено к БД")
+        return conn
+    except Exception as e:
+        print(f"❌ Ошибка подключения: {e}")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description='Потребности в деталях из заказов на сборки')
+    parser.add_argument('--connection', '-c',
+                       help='Connection string (или DATABASE_URL)')
+    parser.add_argument('--date', '-d',
+                       help='Начало горизонта (YYYY-MM-DD), по умолчанию - сегодня')
+    parser.add_argument('--months', type=int, default=HORIZON_MONTHS,
+                       help=f'Горизонт в месяцах (по умолчанию {HORIZON_MONTHS})')
+    
+    args = parser.parse_args()
+    
+    conn_string = args.connection or os.getenv('DATABASE_URL')
+    if not conn_string:
+        parser.error("Не указан connection string. Используй --connection или DATABASE_URL")
+    
+    start_date = None
+    if args.date:
+        try:
+            start_date = datetime.strptime(args.date, '%Y-%m-%d').date()
+        except ValueError:
+            parser.error("Неверный формат даты. Используй YYYY-MM-DD")
+    
+    conn = connect_db(conn_string)
+    try:
+        generate_requirements_from_orders(conn, start_date, args.months)
+    except Exception as e:
+        print(f"\n❌ ОШИБКА: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,12 @@
 -- 
 -- ============================================================================
 
+DROP TABLE IF EXISTS metal_consumption_daily CASCADE;
+DROP TABLE IF EXISTS mold_wear CASCADE;
+DROP TABLE IF EXISTS plan_slices CASCADE;
+DROP TABLE IF EXISTS current_inventory CASCADE;
+DROP TABLE IF EXISTS inventory_history_dates CASCADE;
+DROP TABLE IF EXISTS inventory_history CASCADE;
 DROP TABLE IF EXISTS production_transactions CASCADE;
 DROP TABLE IF EXISTS daily_production_plan CASCADE;
 DROP TABLE IF EXISTS tentative_production_plan CASCADE;
@@ -47,6 +53,7 @@ CREATE TABLE warehouses (
     warehouse_name VARCHAR(200) UNIQUE NOT NULL,
     warehouse_type VARCHAR(50),
     notes TEXT,
+    retired_at TIMESTAMP,  -- убран из мастер-файла (init_db.py --sync), NULL - действует
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -72,6 +79,7 @@ CREATE TABLE assemblies (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) UNIQUE NOT NULL,
     description TEXT,
+    retired_at TIMESTAMP,  -- убрана из мастер-файла (init_db.py --sync), NULL - действует
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -92,6 +100,9 @@ CREATE TABLE details (
     assembly_id INT REFERENCES assemblies(id) ON DELETE SET NULL,
     qty_in_assembly INT,
     
+    -- убрана из мастер-файла (init_db.py --sync), NULL - действует
+    retired_at TIMESTAMP,
+    
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
@@ -175,8 +186,11 @@ CREATE INDEX idx_machine_state_machine ON machine_state(machine_id);
 
 -- остатки деталей на складе
 -- ключ: дата + деталь + фаза + склад
+-- секции по месяцам snapshot_date (см. ensure_month_partitions);
+-- без DEFAULT-секции: загрузка создаёт секцию месяца снапшота, а поиск
+-- последнего снапшота идёт по секциям от новой к старой
 CREATE TABLE inventory_snapshots (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     snapshot_date DATE NOT NULL,
     detail_id INT NOT NULL REFERENCES details(id) ON DELETE CASCADE,
     phase VARCHAR(20) NOT NULL,
@@ -185,16 +199,134 @@ CREATE TABLE inventory_snapshots (
     imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     source VARCHAR(20) DEFAULT '1C_export',
     
+    PRIMARY KEY (id, snapshot_date),
     UNIQUE(snapshot_date, detail_id, phase, warehouse_id),
     CONSTRAINT check_phase_snapshot CHECK (phase IN ('отливка', 'зачистка', 'дробеструй', 'фрезеровка', 'покраска', 'брак')),
     CONSTRAINT check_quantity_snapshot CHECK (quantity >= 0)
-);
+) PARTITION BY RANGE (snapshot_date);
 
-CREATE INDEX idx_inventory_snap_date ON inventory_snapshots(snapshot_date);
+CREATE INDEX idx_inventory_snap_date ON inventory_snapshots USING brin(snapshot_date);
 CREATE INDEX idx_inventory_snap_detail ON inventory_snapshots(detail_id);
 CREATE INDEX idx_inventory_snap_phase ON inventory_snapshots(phase);
 CREATE INDEX idx_inventory_snap_warehouse ON inventory_snapshots(warehouse_id);
 
+-- история остатков без дублей: версия остатка действует с valid_from
+-- до valid_to (не включая; NULL - до сих пор). Новая версия пишется,
+-- только когда остаток по ключу изменился (inventory_history.py)
+CREATE TABLE inventory_history (
+    detail_id INT NOT NULL REFERENCES details(id) ON DELETE CASCADE,
+    phase VARCHAR(20) NOT NULL,
+    warehouse_id INT NOT NULL REFERENCES warehouses(id) ON DELETE CASCADE,
+    quantity INT NOT NULL,
+    valid_from DATE NOT NULL,
+    valid_to DATE,
+    
+    PRIMARY KEY (detail_id, phase, warehouse_id, valid_from),
+    CONSTRAINT check_phase_history CHECK (phase IN ('отливка', 'зачистка', 'дробеструй', 'фрезеровка', 'покраска', 'брак')),
+    CONSTRAINT check_quantity_history CHECK (quantity >= 0),
+    CONSTRAINT check_history_range CHECK (valid_to IS NULL OR valid_to > valid_from)
+);
+
+CREATE INDEX idx_inventory_history_range ON inventory_history USING gist (daterange(valid_from, valid_to));
+
+-- даты снапшотов, загруженных в inventory_history
+CREATE TABLE inventory_history_dates (
+    snapshot_date DATE PRIMARY KEY,
+    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- остатки на дату: последний снапшот не позже p_date - полный из
+-- inventory_snapshots или восстановленный из inventory_history
+CREATE OR REPLACE FUNCTION inventory_on(p_date DATE)
+RETURNS TABLE (detail_id INT, phase VARCHAR, warehouse_id INT, quantity INT, snapshot_date DATE) AS $$
+DECLARE
+    v_full DATE;
+    v_history DATE;
+BEGIN
+    SELECT MAX(s.snapshot_date) INTO v_full FROM inventory_snapshots s WHERE s.snapshot_date <= p_date;
+    SELECT MAX(h.snapshot_date) INTO v_history FROM inventory_history_dates h WHERE h.snapshot_date <= p_date;
+    
+    IF v_history IS NOT NULL AND (v_full IS NULL OR v_history > v_full) THEN
+        RETURN QUERY
+            SELECT h.detail_id, h.phase, h.warehouse_id, h.quantity, v_history
+            FROM inventory_history h
+            WHERE daterange(h.valid_from, h.valid_to) @> p_date;
+    ELSE
+        RETURN QUERY
+            SELECT s.detail_id, s.phase, s.warehouse_id, s.quantity, s.snapshot_date
+            FROM inventory_snapshots s
+            WHERE s.snapshot_date = v_full;
+    END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- дата последнего снапшота не позже p_date (NULL - без ограничения):
+-- большая из полных снапшотов и дат, загруженных в историю
+CREATE OR REPLACE FUNCTION latest_inventory_date(p_date DATE DEFAULT NULL)
+RETURNS DATE AS $$
+    SELECT GREATEST(
+        (SELECT MAX(snapshot_date) FROM inventory_snapshots
+         WHERE snapshot_date <= COALESCE(p_date, 'infinity'::date)),
+        (SELECT MAX(snapshot_date) FROM inventory_history_dates
+         WHERE snapshot_date <= COALESCE(p_date, 'infinity'::date))
+    )
+$$ LANGUAGE sql STABLE;
+
+-- текущие остатки: копия последнего снапшота (inventory_on)
+-- обновляется в транзакции загрузки остатков (refresh_current_inventory)
+CREATE TABLE current_inventory (
+    detail_id INT NOT NULL REFERENCES details(id) ON DELETE CASCADE,
+    phase VARCHAR(20) NOT NULL,
+    warehouse_id INT NOT NULL REFERENCES warehouses(id) ON DELETE CASCADE,
+    quantity INT NOT NULL DEFAULT 0,
+    snapshot_date DATE NOT NULL,
+    
+    PRIMARY KEY (detail_id, phase, warehouse_id)
+);
+
+-- перенос снапшота за дату в current_inventory, если он не старше текущего;
+-- пишутся только изменившиеся строки, возвращает их число
+CREATE OR REPLACE FUNCTION refresh_current_inventory(p_snapshot_date DATE)
+RETURNS INT AS $$
+DECLARE
+    v_current DATE;
+    v_deleted INT;
+    v_upserted INT;
+BEGIN
+    -- параллельные загрузки обновляют по очереди
+    PERFORM pg_advisory_xact_lock(hashtext('refresh_current_inventory'));
+    
+    SELECT snapshot_date INTO v_current FROM current_inventory LIMIT 1;
+    IF v_current > p_snapshot_date THEN
+        RETURN 0;
+    END IF;
+    
+    WITH snapshot AS MATERIALIZED (
+        SELECT * FROM inventory_on(p_snapshot_date)
+    )
+    DELETE FROM current_inventory c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM snapshot s
+        WHERE s.detail_id = c.detail_id
+          AND s.phase = c.phase
+          AND s.warehouse_id = c.warehouse_id
+    );
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    
+    INSERT INTO current_inventory (detail_id, phase, warehouse_id, quantity, snapshot_date)
+    SELECT s.detail_id, s.phase, s.warehouse_id, s.quantity, s.snapshot_date
+    FROM inventory_on(p_snapshot_date) s
+    ON CONFLICT (detail_id, phase, warehouse_id) DO UPDATE SET
+        quantity = EXCLUDED.quantity,
+        snapshot_date = EXCLUDED.snapshot_date
+    WHERE current_inventory.quantity <> EXCLUDED.quantity
+       OR current_inventory.snapshot_date <> EXCLUDED.snapshot_date;
+    GET DIAGNOSTICS v_upserted = ROW_COUNT;
+    
+    RETURN v_deleted + v_upserted;
+END;
+$$ LANGUAGE plpgsql;
+
 -- остатки металла
 CREATE TABLE material_inventory_snapshots (
     id SERIAL PRIMARY KEY,
@@ -302,9 +434,29 @@ CREATE INDEX idx_daily_date ON daily_production_plan(plan_date);
 CREATE INDEX idx_daily_detail ON daily_production_plan(detail_id);
 CREATE INDEX idx_daily_machine ON daily_production_plan(machine_id);
 
+-- срезы иерархического плана (9 мес → месяц → неделя → день)
+-- inputs: отпечаток входов, из которых срез посчитан; при изменении
+-- входов срез и его строки плана помечаются obsolete и пересчитываются
+CREATE TABLE plan_slices (
+    id SERIAL PRIMARY KEY,
+    level VARCHAR(10) NOT NULL,
+    slice_start DATE NOT NULL,
+    slice_end DATE NOT NULL,
+    inputs VARCHAR(32) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    
+    UNIQUE(level, slice_start),
+    CONSTRAINT check_slice_level CHECK (level IN ('horizon', 'month', 'week', 'day')),
+    CONSTRAINT check_slice_status CHECK (status IN ('cached', 'obsolete')),
+    CONSTRAINT check_slice_range CHECK (slice_end >= slice_start)
+);
+
 -- фактические производственные операции
+-- секции по месяцам transaction_date (см. ensure_month_partitions);
+-- DEFAULT-секция - чтобы запись операции с цеха не падала без секции
 CREATE TABLE production_transactions (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     transaction_date DATE NOT NULL,
     detail_id INT NOT NULL REFERENCES details(id) ON DELETE CASCADE,
     operation_type VARCHAR(20) NOT NULL,
@@ -317,39 +469,223 @@ CREATE TABLE production_transactions (
     notes TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
+    PRIMARY KEY (id, transaction_date),
     CONSTRAINT check_operation_type CHECK (operation_type IN ('отливка', 'зачистка', 'дробеструй', 'фрезеровка', 'покраска', 'брак', 'отгрузка')),
     CONSTRAINT check_transaction_quantity CHECK (quantity > 0)
-);
+) PARTITION BY RANGE (transaction_date);
+
+CREATE TABLE production_transactions_default PARTITION OF production_transactions DEFAULT;
 
-CREATE INDEX idx_transactions_date ON production_transactions(transaction_date);
+CREATE INDEX idx_transactions_date ON production_transactions USING brin(transaction_date);
 CREATE INDEX idx_transactions_detail ON production_transactions(detail_id);
 CREATE INDEX idx_transactions_operation ON production_transactions(operation_type);
 CREATE INDEX idx_transactions_machine ON production_transactions(machine_id);
 CREATE INDEX idx_transactions_to_phase ON production_transactions(to_phase);
 
+-- ============================================================================
+-- МЕСЯЧНЫЕ СЕКЦИИ (production_transactions, inventory_snapshots)
+-- ============================================================================
+-- Секция на месяц: <таблица>_YYYY_MM, строки операций вне секций -
+-- в production_transactions_default.
+-- Создание наперёд и отключение старых: python partition_maintenance.py
+
+-- создать недостающие секции за месяцы [p_from, p_to];
+-- строки этих месяцев из DEFAULT-секции (если есть) переносятся в новую
+CREATE OR REPLACE FUNCTION ensure_month_partitions(p_table TEXT, p_from DATE, p_to DATE)
+RETURNS INT AS $$
+DECLARE
+    v_column TEXT;
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_next DATE;
+    v_partition TEXT;
+    v_created INT := 0;
+BEGIN
+    v_column := CASE p_table
+        WHEN 'production_transactions' THEN 'transaction_date'
+        WHEN 'inventory_snapshots' THEN 'snapshot_date'
+    END;
+    IF v_column IS NULL THEN
+        RAISE EXCEPTION 'Таблица без месячных секций: %', p_table;
+    END IF;
+    
+    -- параллельные загрузки создают секцию один раз
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_month_partitions:' || p_table));
+    
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::date;
+        v_partition := p_table || '_' || to_char(v_month, 'YYYY_MM');
+        IF to_regclass(v_partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                           v_partition, p_table);
+            IF to_regclass(p_table || '_default') IS NOT NULL THEN
+                EXECUTE format('WITH moved AS (DELETE FROM %I WHERE %I >= %L AND %I < %L RETURNING *) '
+                               'INSERT INTO %I SELECT * FROM moved',
+                               p_table || '_default', v_column, v_month, v_column, v_next, v_partition);
+            END IF;
+            EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           p_table, v_partition, v_month, v_next);
+            v_created := v_created + 1;
+        END IF;
+        v_month := v_next;
+    END LOOP;
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_month_partitions('production_transactions', CURRENT_DATE, CURRENT_DATE + 60);
+SELECT ensure_month_partitions('inventory_snapshots', CURRENT_DATE, CURRENT_DATE + 60);
+
+-- ============================================================================
+-- АГРЕГАТЫ ПО ФАКТУ (ведутся триггерами на production_transactions)
+-- ============================================================================
+-- Пересчёт с нуля: python production_aggregates.py --rebuild
+-- (нужен после правки details.qty_per_hit / weight_kg / mold_id задним числом)
+
+-- износ формы: удары по отливке
+CREATE TABLE mold_wear (
+    mold_id INT PRIMARY KEY REFERENCES molds(id) ON DELETE CASCADE,
+    total_hits DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    last_cast_date DATE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- расход металла по дням и материалу
+CREATE TABLE metal_consumption_daily (
+    consumption_date DATE NOT NULL,
+    material_type VARCHAR(50) NOT NULL,
+    quantity_kg DECIMAL(14, 4) NOT NULL DEFAULT 0,
+    
+    PRIMARY KEY (consumption_date, material_type)
+);
+
+-- приращение агрегатов по строкам отливки (quantity со знаком)
+CREATE OR REPLACE FUNCTION rollup_casting_delta(p_detail_ids INT[], p_dates DATE[], p_quantities INT[])
+RETURNS void AS $$
+    INSERT INTO mold_wear (mold_id, total_hits, last_cast_date)
+    SELECT d.mold_id, SUM(t.quantity / COALESCE(d.qty_per_hit, 1)), MAX(t.transaction_date)
+    FROM unnest(p_detail_ids, p_dates, p_quantities) AS t(detail_id, transaction_date, quantity)
+    JOIN details d ON d.id = t.detail_id
+    WHERE d.mold_id IS NOT NULL
+    GROUP BY d.mold_id
+    ON CONFLICT (mold_id) DO UPDATE SET
+        total_hits = mold_wear.total_hits + EXCLUDED.total_hits,
+        last_cast_date = GREATEST(mold_wear.last_cast_date, EXCLUDED.last_cast_date),
+        updated_at = CURRENT_TIMESTAMP;
+    
+    INSERT INTO metal_consumption_daily (consumption_date, material_type, quantity_kg)
+    SELECT t.transaction_date, COALESCE(d.material_type, 'Алюминий'), SUM(d.weight_kg * t.quantity)
+    FROM unnest(p_detail_ids, p_dates, p_quantities) AS t(detail_id, transaction_date, quantity)
+    JOIN details d ON d.id = t.detail_id
+    GROUP BY 1, 2
+    ON CONFLICT (consumption_date, material_type) DO UPDATE SET
+        quantity_kg = metal_consumption_daily.quantity_kg + EXCLUDED.quantity_kg;
+$$ LANGUAGE sql;
+
+-- триггер на оператор: пачка операций (ETL) - два UPSERT, а не по строке
+CREATE OR REPLACE FUNCTION rollup_production_transactions()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_casting_delta(array_agg(detail_id), array_agg(transaction_date), array_agg(-quantity))
+        FROM old_rows WHERE operation_type = 'отливка';
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_casting_delta(array_agg(detail_id), array_agg(transaction_date), array_agg(quantity))
+        FROM new_rows WHERE operation_type = 'отливка';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_transactions_rollup_insert
+    AFTER INSERT ON production_transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_production_transactions();
+
+CREATE TRIGGER trg_transactions_rollup_update
+    AFTER UPDATE ON production_transactions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_production_transactions();
+
+CREATE TRIGGER trg_transactions_rollup_delete
+    AFTER DELETE ON production_transactions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_production_transactions();
+
+-- ============================================================================
+-- ВЕРСИИ ТАБЛИЦ (проверка кэшей в процессах: reference_data, capacity_model)
+-- ============================================================================
+-- Версия меняется оператором, изменившим хотя бы одну строку, и TRUNCATE.
+-- Значения из последовательности не повторяются: версия откаченной правки
+-- не совпадёт с версией следующей. Правки одной таблицы из параллельных
+-- транзакций ждут друг друга на строке table_versions.
+
+CREATE SEQUENCE table_versions_seq;
+
+CREATE TABLE table_versions (
+    table_name VARCHAR(63) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT nextval('table_versions_seq'),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version()
+RETURNS trigger AS $$
+BEGIN
+    -- у TRUNCATE нет таблицы переходов
+    IF TG_OP <> 'TRUNCATE' THEN
+        IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    
+    INSERT INTO table_versions (table_name) VALUES (TG_TABLE_NAME)
+    ON CONFLICT (table_name) DO UPDATE SET
+        version = nextval('table_versions_seq'),
+        updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY[
+        'warehouses', 'molds', 'assemblies', 'details', 'machines',
+        'machine_mold_params', 'machine_detail_params', 'current_inventory'
+    ] LOOP
+        EXECUTE format('CREATE TRIGGER trg_%s_version_insert AFTER INSERT ON %I
+                        REFERENCING NEW TABLE AS changed_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', v_table, v_table);
+        EXECUTE format('CREATE TRIGGER trg_%s_version_update AFTER UPDATE ON %I
+                        REFERENCING NEW TABLE AS changed_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', v_table, v_table);
+        EXECUTE format('CREATE TRIGGER trg_%s_version_delete AFTER DELETE ON %I
+                        REFERENCING OLD TABLE AS changed_rows
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', v_table, v_table);
+        EXECUTE format('CREATE TRIGGER trg_%s_version_truncate AFTER TRUNCATE ON %I
+                        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()', v_table, v_table);
+        INSERT INTO table_versions (table_name) VALUES (v_table);
+    END LOOP;
+END;
+$$;
+
 -- ============================================================================
 -- ПРИМЕЧАНИЯ
 -- ============================================================================
 
 -- Вычисляемые значения:
 -- 
--- Износ формы:
---   SELECT SUM(pt.quantity / d.qty_per_hit) as total_hits
---   FROM production_transactions pt
---   JOIN details d ON pt.detail_id = d.id
---   WHERE d.mold_id = X AND pt.operation_type = 'отливка'
+-- Износ формы (ведётся триггером):
+--   SELECT total_hits FROM mold_wear WHERE mold_id = X
 -- 
--- Расход металла за период:
---   SELECT SUM(d.weight_kg * pt.quantity)
---   FROM production_transactions pt
---   JOIN details d ON pt.detail_id = d.id
---   WHERE pt.operation_type = 'отливка'
---   AND pt.transaction_date BETWEEN start_date AND end_date
+-- Расход металла за период (ведётся триггером):
+--   SELECT SUM(quantity_kg) FROM metal_consumption_daily
+--   WHERE consumption_date BETWEEN start_date AND end_date
 -- 
 -- Текущий инвентарь (деталь + фаза):
---   SELECT quantity FROM inventory_snapshots
---   WHERE snapshot_date = latest_date
---   AND detail_id = X AND phase = 'отливка'
+--   SELECT SUM(quantity) FROM current_inventory
+--   WHERE detail_id = X AND phase = 'отливка'
 --
 -- Планировщик при перезаписи плана на день:
 --   DELETE FROM daily_production_plan WHERE plan_date = ?
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических выгрузок 1С для замеров ETL
+
+Файлы повторяют разметку, которую разбирает etl_1c_xls.py:
+1. "Товары на складах": Номенклатура → Характеристика (фаза) → Склад
+2. "Анализ обеспеченности заказов": Фаза → Сборка (Артикул) → ОКП →
+   Номенклатура → Дата запуска
+3. Остатки металла: Материал | Единица | Количество
+
+Размер задаётся числом строк данных, деталей и складов. Коды деталей
+К90.00.000 и дальше не пересекаются с реальными. Шум как в настоящих
+выгрузках: алюминий без кода, строки '-', пустые строки, числа текстом
+('1 234'). Результат детерминирован для одного seed.
+
+Использование:
+    python synthetic_1c.py inventory остатки.xlsx --rows 100000 --details 500 --warehouses 10
+    python synthetic_1c.py requirements отливка.xlsx --rows 50000 --details 500
+    python synthetic_1c.py materials металл.xlsx --rows 1000
+"""
+
+import argparse
+import random
+from datetime import date
+from openpyxl import Workbook
+
+# Фазы, которые примет схема (CHECK по фазе), в написании 1С
+INVENTORY_PHASES = ['Отливка', 'Зачистка', 'Дробеструй', 'Фрезеровка']
+REQUIREMENT_PHASES = ['Отливка', 'Зачистка', 'Дробеструй', 'Токарка', 'Фрезеровка']
+
+ASSEMBLIES = ['Иволга кресло', '4523', 'Лестница', 'Комплект каркаса', 'Опора дивана',
+              'Привод подъемный', 'Лестница Габарит Т']
+
+DETAIL_NAMES = ['Корпус', 'Кронштейн', 'Крышка', 'Основание', 'Рычаг', 'Втулка', 'Фланец']
+
+BASE_WAREHOUSES = ['Склад отливок', 'Литейный цех', 'Склад готовой продукции', 'Брак']
+
+def detail_codes(n):
+    """Коды синтетических деталей: К90.00.000, К90.00.001, ..."""
+    return [f"К{90 + i // 100000}.{i // 1000 % 100:02d}.{i % 1000:03d}" for i in range(n)]
+
+def warehouse_names(m):
+    """Названия складов (распознаются уровнем "Склад" парсера)"""
+    names = BASE_WAREHOUSES[:m]
+    names += [f"Склад №{j}" for j in range(len(names) + 1, m + 1)]
+    return names
+
+def noisy_quantity(rnd, low, high):
+    """Количество как в ячейке 1С: число, иногда текстом с пробелом"""
+    value = rnd.randint(low, high)
+    if value >= 1000 and rnd.random() < 0.3:
+        return f"{value // 1000} {value % 1000:03d}"
+    return value
+
+def write_inventory(path, rows, details=300, warehouses=8, seed=1):
+    """
+    "Товары на складах" на ~rows строк данных
+    
+    Каждая (деталь, фаза, склад) встречается один раз, как в настоящем
+    отчёте (иначе загрузка нарушит UNIQUE снапшота).
+    """
+    codes = detail_codes(details)
+    warehouse_list = warehouse_names(warehouses)
+    per_detail = 1 + len(INVENTORY_PHASES) * (1 + warehouses)
+    if rows > details * per_detail:
+        raise ValueError(f"Не хватает деталей/складов для {rows} строк: "
+                         f"максимум {details * per_detail} (увеличь --details или --warehouses)")
+    
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('TDSheet')
+    
+    ws.append(['Отчет: Товары на складах'])
+    ws.append([f"Период: 01.{date.today():%m.%Y} - {date.today():%d.%m.%Y}"])
+    ws.append(['Отбор: Склад В списке'])
+    ws.append([])
+    ws.append([None, 'Номенклатура', None, 'Начальный остаток', 'Приход', 'Расход', 'Конечный остаток'])
+    ws.append([None, 'Характеристика номенклатуры'])
+    ws.append([None, 'Склад'])
+    ws.append([])
+    
+    written = 0
+    for i, code in enumerate(codes):
+        budget = rows * (i + 1) // details - rows * i // details
+        if budget <= 0:
+            continue
+        
+        # Металл в том же отчёте - без кода детали, в записи не попадает
+        if i % 50 == 49:
+            ws.append([None, 'Алюминий сплав АК12', None, None, None, None, rnd.randint(100, 5000)])
+            ws.append([None, 'Алюминий 1 месяц', None, None, None, None, rnd.randint(100, 5000)])
+            ws.append([None, BASE_WAREHOUSES[0], None, None, None, None, rnd.randint(100, 5000)])
+        
+        ws.append([None, f"{rnd.choice(DETAIL_NAMES)} ({code})", None,
+                   rnd.randint(0, 500), None, None, rnd.randint(0, 500)])
+        budget -= 1
+        written += 1
+        
+        phases = rnd.sample(INVENTORY_PHASES, len(INVENTORY_PHASES))
+        for k, phase in enumerate(phases):
+            if budget <= 0:
+                break
+            # Остаток строк делим поровну между оставшимися фазами
+            share = budget // (len(phases) - k)
+            count = max(0, min(warehouses, share - 1, budget - 1))
+            ws.append([None, phase, None, None, None, None, rnd.randint(0, 500)])
+            budget -= 1
+            written += 1
+            
+            for warehouse in rnd.sample(warehouse_list, count):
+                quantity = rnd.choice([noisy_quantity(rnd, 0, 2000), noisy_quantity(rnd, 0, 50), '-'])
+                ws.append([None, warehouse, None, None, None, None, quantity])
+                budget -= 1
+                written += 1
+        
+        if rnd.random() < 0.02:
+            ws.append([None, '-'])
+        if rnd.random() < 0.02:
+            ws.append([])
+    
+    ws.append([None, 'Итого', None, None, None, None, rnd.randint(0, 10 ** 6)])
+    wb.save(path)
+    return written
+
+def write_requirements(path, rows, details=300, seed=1, months=9):
+    """
+    "Анализ обеспеченности заказов" на ~rows строк данных
+    
+    Строки делятся поровну между фазами; детали идут группами по сборкам,
+    у каждой детали - даты запуска на months месяцев вперёд.
+    """
+    codes = detail_codes(details)
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('TDSheet')
+    
+    ws.append(['Анализ обеспеченности заказов: отчет'])
+    ws.append([f"Параметры: Период с {date.today():%d.%m.%Y}"])
+    ws.append([])
+    ws.append([None, 'Характеристика номенклатуры.Наименование', None, 'Заказано', 'Потребность'])
+    ws.append([None, 'Артикул'])
+    ws.append([None, 'ОКП'])
+    ws.append([None, 'Номенклатура'])
+    ws.append([None, 'Дата запуска'])
+    ws.append([])
+    
+    today = date.today()
+    launch_dates = []
+    for offset in range(months):
+        month = (today.month - 1 + offset) % 12 + 1
+        year = today.year + (today.month - 1 + offset) // 12
+        launch_dates += [f"{day:02d}.{month:02d}.{year} 0:00:00" for day in (1, 10, 20)]
+    
+    written = 0
+    detail_idx = 0
+    for k, phase in enumerate(REQUIREMENT_PHASES):
+        budget = rows * (k + 1) // len(REQUIREMENT_PHASES) - rows * k // len(REQUIREMENT_PHASES)
+        ws.append([None, phase, None, None, rnd.randint(0, 10000)])
+        budget -= 1
+        written += 1
+        
+        while budget > 0:
+            ws.append([None, ASSEMBLIES[detail_idx % len(ASSEMBLIES)]])
+            budget -= 1
+            written += 1
+            if rnd.random() < 0.5:
+                ws.append([None, f"({rnd.randint(1, 9)}-{rnd.randint(1, 9)})"])
+                budget -= 1
+                written += 1
+            
+            for _ in range(rnd.randint(2, 6)):
+                if budget <= 0:
+                    break
+                code = codes[detail_idx % details]
+                detail_idx += 1
+                if rnd.random() < 0.5:
+                    name = f"{rnd.choice(DETAIL_NAMES)} ({code})"
+                else:
+                    name = f"{rnd.choice(DETAIL_NAMES)} {code}"
+                ws.append([None, name, None, None, rnd.randint(0, 5000)])
+                budget -= 1
+                written += 1
+                
+                count = max(1, min(budget, rnd.randint(1, months)))
+                for launch_idx in sorted(rnd.sample(range(len(launch_dates)), count)):
+                    quantity = rnd.choice([noisy_quantity(rnd, 1, 1500), noisy_quantity(rnd, 1, 200), '-'])
+                    ws.append([None, launch_dates[launch_idx], None, None, quantity])
+                    budget -= 1
+                    written += 1
+            
+            if rnd.random() < 0.05:
+                ws.append([None, 'Алюминий сплав АК7', None, None, rnd.randint(0, 500)])
+                budget -= 1
+                written += 1
+    
+    wb.save(path)
+    return written
+
+def write_materials(path, rows, seed=1):
+    """Остатки металла на rows строк (марки уникальны)"""
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('TDSheet')
+    
+    ws.append(['Остатки металла'])
+    ws.append([])
+    ws.append(['Материал', 'Единица', 'Количество'])
+    for i in range(rows):
+        if rnd.random() < 0.1:
+            ws.append([f"АК{rnd.choice([5, 7, 9, 12])} партия {i}", 'г', rnd.randint(1000, 10 ** 6)])
+        else:
+            ws.append([f"АК{rnd.choice([5, 7, 9, 12])} партия {i}", 'кг', round(rnd.uniform(0, 5000), 1)])
+    
+    wb.save(path)
+    return rows
+
+def generate(kind, path, rows, details=300, warehouses=8, seed=1):
+    """Файл нужного типа, возвращает число записанных строк данных"""
+    if kind == 'inventory':
+        return write_inventory(path, rows, details, warehouses, seed)
+    if kind == 'requirements':
+        return write_requirements(path, rows, details, seed)
+    if kind == 'materials':
+        return write_materials(path, rows, seed)
+    raise ValueError(f"Неизвестный тип файла: {kind}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетические выгрузки 1С для замеров ETL')
+    parser.add_argument('kind', choices=['inventory', 'requirements', 'materials'],
+                       help='Тип файла')
+    parser.add_argument('output', help='Куда сохранить .xlsx')
+    parser.add_argument('--rows', type=int, default=10000,
+                       help='Строк данных (по умолчанию 10000)')
+    parser.add_argument('--details', type=int, default=300,
+                       help='Число деталей (по умолчанию 300)')
+    parser.add_argument('--warehouses', type=int, default=8,
+                       help='Число складов (по умолчанию 8)')
+    parser.add_argument('--seed', type=int, default=1)
+    
+    args = parser.parse_args()
+    
+    written = generate(args.kind, args.output, args.rows, args.details, args.warehouses, args.seed)
+    print(f"✅ {args.output}: {written} строк")
+
+if __name__ == '__main__':
+    main()
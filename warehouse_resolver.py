@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Сопоставление названий складов из выгрузок 1С со справочником warehouses
+
+Порядок поиска (индекс строится один раз на загрузку):
+1. Точное совпадение (без учёта регистра и лишних пробелов)
+2. Название склада содержится в строке 1С (одна регулярка-альтернация,
+   побеждает самое длинное название) или строка 1С - часть названия склада
+3. Таблица псевдонимов: подстрока строки 1С -> название склада
+
+Результат запоминается для каждой уникальной строки 1С.
+Ненайденные склады копятся в unresolved и выводятся отчётом, а не
+подменяются складом по умолчанию.
+"""
+
+import re
+from collections import Counter
+
+def normalize(name):
+    """Ключ сравнения: без регистра, пробелы схлопнуты"""
+    return ' '.join(str(name).split()).casefold()
+
+def parse_aliases(values):
+    """['Малярка=Склад готовой продукции', ...] -> dict"""
+    aliases = {}
+    for value in values or []:
+        alias, sep, warehouse_name = value.partition('=')
+        if not sep or not alias.strip() or not warehouse_name.strip():
+            raise ValueError(f"Псевдоним склада в формате ПСЕВДОНИМ=СКЛАД: {value}")
+        aliases[alias.strip()] = warehouse_name.strip()
+    return aliases
+
+class WarehouseResolver:
+    """Детерминированный поиск warehouse_id по строке склада из 1С"""
+    
+    def __init__(self, warehouses, aliases=None):
+        """
+        Args:
+            warehouses: [(id, warehouse_name), ...]
+            aliases: {подстрока 1С: warehouse_name}
+        """
+        # При одинаковых названиях побеждает меньший id
+        self.exact = {}
+        for wh_id, name in sorted(warehouses):
+            self.exact.setdefault(normalize(name), wh_id)
+        
+        # Длинные названия раньше: в альтернации выигрывает первая подходящая ветка
+        names = sorted(self.exact, key=lambda name: (-len(name), name))
+        self.names = names
+        self.contains_re = re.compile('|'.join(re.escape(name) for name in names)) if names else None
+        
+        self.aliases = []
+        for alias, warehouse_name in (aliases or {}).items():
+            wh_id = self.exact.get(normalize(warehouse_name))
+            if wh_id is None:
+                raise ValueError(f"Склад для псевдонима '{alias}' не найден: {warehouse_name}")
+            self.aliases.append((normalize(alias), wh_id))
+        self.aliases.sort(key=lambda item: (-len(item[0]), item[0]))
+        
+        self.cache = {}
+        self.unresolved = Counter()
+    
+    def lookup(self, raw):
+        """Поиск без кэша"""
+        key = normalize(raw)
+        if not key:
+            return None
+        
+        # 1. Точное совпадение
+        if key in self.exact:
+            return self.exact[key]
+        
+        # 2. Название склада внутри строки 1С - самое длинное, при равенстве первое
+        if self.contains_re:
+            matches = [m.group(0) for m in self.contains_re.finditer(key)]
+            if matches:
+                return self.exact[max(matches, key=len)]
+        
+        # Строка 1С - часть названия склада: самое короткое название
+        containing = [name for name in self.names if key in name]
+        if containing:
+            return self.exact[min(containing, key=lambda name: (len(name), name))]
+        
+        # 3. Псевдонимы
+        for alias, wh_id in self.aliases:
+            if alias in key:
+                return wh_id
+        
+        return None
+    
+    def resolve(self, raw):
+        """warehouse_id или None; каждая уникальная строка ищется один раз"""
+        if raw not in self.cache:
+            self.cache[raw] = self.lookup(raw)
+        wh_id = self.cache[raw]
+        if wh_id is None:
+            self.unresolved[raw] += 1
+        return wh_id
+    
+    def report(self):
+        """Отчёт по ненайденным складам"""
+        if not self.unresolved:
+            return
+        print(f"⚠️  Склады не найдены ({len(self.unresolved)}), записи пропущены:")
+        for raw, count in self.unresolved.most_common():
+            print(f"   '{raw}': {count} записей")